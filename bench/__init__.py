@@ -0,0 +1 @@
+# Офлайн-бенчмарк пайплайна бота: python -m bench.run --help
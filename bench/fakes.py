@@ -0,0 +1,319 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+import gspread
+import httpx
+import requests
+from telegram.request import BaseRequest
+
+from config import CATEGORIES_MAP, DATE_COLUMN
+from services.calendar_service import get_current_date_us, get_week_range
+
+# ==============================================================================
+# Локальные заменители внешних API. Все работают в процессе (без сокетов):
+# OpenAI — через httpx.MockTransport, Sheets — объект с интерфейсом gspread.Worksheet,
+# Telegram — свой BaseRequest для PTB. У каждого: задержка, доля 429 и счетчики вызовов.
+# ==============================================================================
+
+class CallCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = defaultdict(int)
+
+    def inc(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def total(self):
+        return sum(self.calls.values())
+
+def _jitter(latency: float) -> float:
+    """Задержка ±25%, чтобы запросы не шли строем."""
+    return latency * random.uniform(0.75, 1.25) if latency > 0 else 0.0
+
+# --- OpenAI ---
+
+class FakeOpenAI(CallCounter):
+    """
+    Отвечает на /chat/completions и /audio/transcriptions.
+    Даты в ответах — из недель, которые есть в FakeWorksheet.
+    """
+
+    def __init__(self, latency: float = 0.8, rate_429: float = 0.0, weeks: int = 8):
+        super().__init__()
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.weeks = weeks
+        self.categories = [c for c in CATEGORIES_MAP if c != "gross"]
+
+    def transport(self):
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        kind = "audio" if path.endswith("/audio/transcriptions") else "chat"
+        self.inc(kind)
+        stream = kind == "chat" and json.loads(request.content).get("stream")
+        delay = _jitter(self.latency)
+        # Поток: первый кусок через ~30% времени, остальное — пока "генерируется"
+        await asyncio.sleep(delay * 0.3 if stream else delay)
+
+        if random.random() < self.rate_429:
+            self.inc("429")
+            return httpx.Response(
+                429,
+                headers={"retry-after-ms": "200", "x-ratelimit-remaining-requests": "0"},
+                json={"error": {"message": "Rate limit reached (fake)", "type": "requests", "code": "rate_limit_exceeded"}},
+            )
+
+        headers = {
+            "x-ratelimit-remaining-requests": "10000",
+            "x-ratelimit-remaining-tokens": "2000000",
+            "x-ratelimit-reset-requests": "1s",
+            "x-ratelimit-reset-tokens": "1s",
+        }
+        if kind == "audio":
+            return httpx.Response(200, headers=headers, json={"text": "Заправился на 120 долларов, дизель"})
+        completion = self._completion(len(request.content))
+        if stream:
+            headers["content-type"] = "text/event-stream"
+            return httpx.Response(200, headers=headers, content=self._stream(completion, delay * 0.7))
+        return httpx.Response(200, headers=headers, json=completion)
+
+    async def _stream(self, completion, duration: float):
+        """SSE как у OpenAI: ответ кусками по ~20 символов, равномерно за duration секунд."""
+        content = completion["choices"][0]["message"]["content"]
+        pieces = [content[i:i + 20] for i in range(0, len(content), 20)]
+        base = {k: completion[k] for k in ("id", "created", "model")}
+        for piece in pieces:
+            await asyncio.sleep(duration / len(pieces))
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n".encode()
+        usage = {**base, "object": "chat.completion.chunk", "choices": [], "usage": completion["usage"]}
+        yield f"data: {json.dumps(usage)}\n\n".encode()
+        yield b"data: [DONE]\n\n"
+
+    def _completion(self, request_size: int):
+        day = get_current_date_us() - timedelta(days=random.randrange(self.weeks * 7))
+        items = [
+            {
+                "category": random.choice(self.categories),
+                "amount": round(random.uniform(10, 900), 2),
+                "description": "bench item",
+            }
+            for _ in range(random.randint(1, 4))
+        ]
+        content = json.dumps({"date": day.strftime("%m.%d.%Y"), "items": items})
+        prompt_tokens = max(1, request_size // 4)
+        return {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "gpt-4o",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(content) // 4,
+                "total_tokens": prompt_tokens + len(content) // 4,
+            },
+        }
+
+# --- Google Sheets ---
+
+def _api_error(code: int, message: str):
+    response = requests.Response()
+    response.status_code = code
+    response._content = json.dumps({"error": {"code": code, "message": message, "status": "RESOURCE_EXHAUSTED"}}).encode()
+    return gspread.exceptions.APIError(response)
+
+class FakeSpreadsheet:
+    def __init__(self, sheet):
+        self._sheet = sheet
+        self.id = "bench-spreadsheet"
+
+    def get_lastUpdateTime(self):
+        self._sheet._call("revision")
+        return self._sheet.revision
+
+    def fetch_sheet_metadata(self, params=None):
+        if "ranges" not in params:
+            self._sheet._call("metadata")
+            return {"sheets": [{"properties": {
+                "sheetId": self._sheet.id, "gridProperties": {"rowCount": self._sheet.row_count},
+            }}]}
+        self._sheet._call("read_row")
+        return self._sheet._read_range(params["ranges"])
+
+    def batch_update(self, body):
+        self._sheet._call("write_row")
+        return self._sheet._apply(body["requests"])
+
+class FakeWorksheet(CallCounter):
+    """
+    Лист недель в памяти: колонка B — диапазоны недель (как в боевой таблице),
+    C..N — суммы с заметками. Вызовы блокирующие (time.sleep), как у gspread.
+    """
+
+    def __init__(self, latency: float = 0.2, rate_429: float = 0.0, weeks: int = 8):
+        super().__init__()
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.id = 0
+        self.title = "WeeklyData"
+        self.spreadsheet = FakeSpreadsheet(self)
+        self.revision = "0"
+        self._cells = {}  # (row, колонка) -> {"value": ..., "note": ...}
+        self._write_lock = threading.Lock()
+
+        self._cells[(1, DATE_COLUMN)] = {"value": "Week"}
+        today = get_current_date_us()
+        for i in range(weeks + 1):
+            week = get_week_range(today - timedelta(days=7 * (weeks - i)))
+            self._cells[(i + 2, DATE_COLUMN)] = {"value": week}
+        self.row_count = weeks + 3
+
+    def _call(self, op):
+        self.inc(op)
+        time.sleep(_jitter(self.latency))
+        if random.random() < self.rate_429:
+            self.inc("429")
+            raise _api_error(429, "Quota exceeded (fake)")
+
+    def col_values(self, col):
+        self._call("col_values")
+        letter = chr(64 + col)
+        last = max(row for row, _ in self._cells)
+        return [str(self._cells.get((row, letter), {}).get("value", "")) for row in range(1, last + 1)]
+
+    def batch_get(self, ranges, value_render_option=None):
+        """Как gspread: по списку строк на диапазон, хвостовые пустые ячейки/строки обрезаны."""
+        self._call("batch_get")
+        result = []
+        for range_a1 in ranges:
+            start, end = range_a1.split(":")
+            first_row, last_row = int(start[1:]), int(end[1:])
+            rows = []
+            for row in range(first_row, last_row + 1):
+                values = [self._cells.get((row, chr(code)), {}).get("value", "")
+                          for code in range(ord(start[0]), ord(end[0]) + 1)]
+                while values and values[-1] in ("", None):
+                    values.pop()
+                rows.append(values)
+            while rows and not rows[-1]:
+                rows.pop()
+            result.append(rows)
+        return result
+
+    def _read_range(self, range_a1):
+        # 'Title'!B5:N5
+        cells = range_a1.split("!", 1)[1]
+        start, end = cells.split(":")
+        row = int(start[1:])
+        values = []
+        for code in range(ord(start[0]), ord(end[0]) + 1):
+            cell = self._cells.get((row, chr(code)), {})
+            value = cell.get("value")
+            api_cell = {}
+            if value not in (None, ""):
+                api_cell["formattedValue"] = str(value)
+                if isinstance(value, (int, float)):
+                    api_cell["effectiveValue"] = {"numberValue": value}
+            if cell.get("note"):
+                api_cell["note"] = cell["note"]
+            values.append(api_cell)
+        return {"sheets": [{"data": [{"rowData": [{"values": values}]}]}]}
+
+    def _apply(self, requests_):
+        with self._write_lock:
+            for req in requests_:
+                upd = req["updateCells"]
+                row = upd["range"]["startRowIndex"] + 1
+                col = chr(65 + upd["range"]["startColumnIndex"])
+                value = upd["rows"][0]["values"][0]
+                self._cells[(row, col)] = {
+                    "value": value["userEnteredValue"]["numberValue"],
+                    "note": value.get("note", ""),
+                }
+            self.revision = str(int(self.revision) + 1)
+        return {"replies": [{} for _ in requests_]}
+
+    def totals(self):
+        """Сумма по всем ячейкам C..N — для сверки с отправленным."""
+        return sum(c["value"] for (_, col), c in self._cells.items() if col != DATE_COLUMN and isinstance(c.get("value"), (int, float)))
+
+# --- Telegram Bot API ---
+
+class FakeBotRequest(BaseRequest, CallCounter):
+    """
+    Bot API для PTB без сети. Исходящие сообщения складываются в очередь чата,
+    чтобы сценарий мог дождаться кнопок или итогового ответа бота.
+    """
+
+    def __init__(self, files: dict, latency: float = 0.05, rate_429: float = 0.0):
+        CallCounter.__init__(self)
+        self.files = files  # file_id -> bytes
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.outbox = defaultdict(asyncio.Queue)  # chat_id -> (метод, параметры)
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, chat_id, text, message_id=None, reply_markup=None):
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "FinBot", "username": "finbot_bench"},
+            "text": text,
+        }
+        if reply_markup:
+            message["reply_markup"] = reply_markup
+        return message
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        await asyncio.sleep(_jitter(self.latency))
+
+        if "/file/bot" in url:
+            self.inc("download")
+            file_id = url.rsplit("/", 1)[1]
+            return 200, self.files[file_id]
+
+        api_method = url.rsplit("/", 1)[1]
+        self.inc(api_method)
+        if random.random() < self.rate_429:
+            self.inc("429")
+            body = {"ok": False, "error_code": 429, "description": "Too Many Requests", "parameters": {"retry_after": 1}}
+            return 429, json.dumps(body).encode()
+
+        params = request_data.parameters if request_data else {}
+        result = True
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "FinBot", "username": "finbot_bench"}
+        elif api_method == "getFile":
+            file_id = params["file_id"]
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.files[file_id]),
+                      "file_path": f"files/{file_id}"}
+        elif api_method in ("sendMessage", "editMessageText"):
+            chat_id = int(params["chat_id"])
+            result = self._message(chat_id, params["text"], params.get("message_id"), params.get("reply_markup"))
+            self.outbox[chat_id].put_nowait((api_method, result))
+        return 200, json.dumps({"ok": True, "result": result}).encode()
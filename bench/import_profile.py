@@ -0,0 +1,107 @@
+"""
+Профиль импорта (холодный старт): сколько стоит `import main` и кто тяжелее всех.
+
+    python -m bench.import_profile
+    python -m bench.import_profile --budget-ms 900 --json import_profile.json
+
+Код возврата 1, если превышен бюджет или при старте загрузились модули,
+которые должны грузиться лениво (LAZY_MODULES) — удобно для CI.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+# Эти библиотеки нужны только при первом документе/запросе — при импорте main их быть не должно
+LAZY_MODULES = ("openai", "gspread", "google.oauth2", "pdfplumber", "pypdfium2", "pydub")
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+def profile_once(module: str, cwd: str) -> list:
+    """Один запуск `python -X importtime` в чистом процессе: [(модуль, self_us, cumulative_us, глубина)]."""
+    env = dict(os.environ)
+    env.setdefault("TELEGRAM_TOKEN", "1:profile")
+    env.setdefault("OPENAI_API_KEY", "profile")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _LINE_RE.match(line)
+        if m:
+            depth = (len(m.group(3)) - 1) // 2
+            rows.append((m.group(4), int(m.group(1)), int(m.group(2)), depth))
+    return rows
+
+def summarize(runs: list, module: str, top: int) -> dict:
+    # Каждый модуль импортируется один раз за процесс — берем медиану по запускам
+    by_name = {}
+    for rows in runs:
+        for name, self_us, cum_us, depth in rows:
+            by_name.setdefault(name, {"self": [], "cumulative": [], "depth": depth})
+            by_name[name]["self"].append(self_us)
+            by_name[name]["cumulative"].append(cum_us)
+    medians = {
+        name: {
+            "self_ms": statistics.median(v["self"]) / 1000,
+            "cumulative_ms": statistics.median(v["cumulative"]) / 1000,
+            "depth": v["depth"],
+        }
+        for name, v in by_name.items()
+    }
+    total = medians.get(module, {}).get("cumulative_ms", 0.0)
+    # Прямые зависимости проекта и сторонние пакеты верхнего уровня
+    top_level = sorted(
+        ((name, m) for name, m in medians.items() if m["depth"] == 1),
+        key=lambda item: item[1]["cumulative_ms"], reverse=True,
+    )[:top]
+    loaded_lazy = [name for name in LAZY_MODULES if name in medians]
+    return {
+        "module": module,
+        "total_ms": round(total, 1),
+        "modules_loaded": len(medians),
+        "top": [{"name": name, "cumulative_ms": round(m["cumulative_ms"], 1), "self_ms": round(m["self_ms"], 1)}
+                for name, m in top_level],
+        "eager_heavy_modules": loaded_lazy,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time profile of the bot entry point")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, help="упасть, если импорт дольше")
+    parser.add_argument("--json", help="сохранить отчет в JSON")
+    args = parser.parse_args()
+
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    runs = [profile_once(args.module, cwd) for _ in range(args.repeat)]
+    report = summarize(runs, args.module, args.top)
+
+    print(f"import {report['module']}: {report['total_ms']} ms, модулей: {report['modules_loaded']} "
+          f"(медиана из {args.repeat})")
+    print(f"\n{'модуль':<40}{'всего, ms':>12}{'сам, ms':>10}")
+    for row in report["top"]:
+        print(f"{row['name']:<40}{row['cumulative_ms']:>12}{row['self_ms']:>10}")
+
+    failed = False
+    if report["eager_heavy_modules"]:
+        print(f"\n⚠️ Загружены при старте (должны быть ленивыми): {', '.join(report['eager_heavy_modules'])}")
+        failed = True
+    if args.budget_ms and report["total_ms"] > args.budget_ms:
+        print(f"\n⚠️ Бюджет превышен: {report['total_ms']} > {args.budget_ms} ms")
+        failed = True
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""
+Офлайн-бенчмарк: гоняет транзакции через настоящие хендлеры main.py,
+а Telegram, OpenAI и Sheets подменены локальными фейками (bench/fakes.py).
+
+    python -m bench.run --transactions 200 --users 20
+    python -m bench.run --mix pdf=3,photo=2,text=1 --openai-latency 1.5 --openai-429 0.1
+    python -m bench.run --recorded ./recorded.jsonl --json before.json
+
+Печатает пропускную способность, p50/p95/p99 по стадиям и транзакциям,
+число вызовов каждого API на одну транзакцию.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+# Исходы по тексту последнего ответа бота
+OUTCOMES = {
+    "📅 Неделя": "saved",
+    "❌ Неделя": "week_not_found",
+    "🤷": "no_data",
+    "💰": "no_date",
+    "⚠️": "zero",
+    "⌛": "expired",
+    "Error": "error",
+    "Ошибка": "error",
+}
+
+def classify(text: str):
+    for prefix, outcome in OUTCOMES.items():
+        if text.startswith(prefix):
+            return outcome
+    return None
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[k]
+
+def parse_mix(spec: str) -> dict:
+    weights = {}
+    for part in spec.split(","):
+        kind, _, weight = part.partition("=")
+        weights[kind.strip()] = float(weight or 1)
+    return weights
+
+def prepare_env(args):
+    """Настройки бота — до импорта config: фейковые ключи, свои пользователи, без внешнего хранилища."""
+    os.environ["TELEGRAM_TOKEN"] = "1:bench"
+    os.environ["OPENAI_API_KEY"] = "bench"
+    os.environ["SHEET_ID"] = "bench-spreadsheet"
+    os.environ["PERSISTENCE_URL"] = ""
+    os.environ["ALLOWED_IDS"] = ",".join(str(u) for u in user_ids(args.users))
+    # Кэш результатов AI исказил бы замеры — включается явно
+    os.environ["AI_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench_cache.sqlite") if args.cache else ""
+    # Журнал записи: свежий на каждый прогон; --no-journal — синхронная запись в таблицу
+    os.environ["SAVE_JOURNAL_PATH"] = "" if args.no_journal else os.path.join(tempfile.mkdtemp(), "bench_journal.sqlite")
+
+def user_ids(count: int):
+    return range(100001, 100001 + count)
+
+async def wait_for_reply(outbox, timeout: float, want_keyboard: bool):
+    """Ждет кнопки (want_keyboard) или итоговый ответ. Возвращает (сообщение, исход)."""
+    deadline = time.monotonic() + timeout
+    while True:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return None, "timeout"
+        try:
+            _, message = await asyncio.wait_for(outbox.get(), left)
+        except asyncio.TimeoutError:
+            return None, "timeout"
+        outcome = classify(message["text"])
+        if outcome:
+            return message, outcome
+        if want_keyboard and message.get("reply_markup"):
+            return message, None
+
+async def run_transaction(application, bot_request, user_id, tx, timeout):
+    from telegram import Update
+    from bench.scenarios import message_update, callback_update
+
+    bot_request.files.update(tx.files)
+    outbox = bot_request.outbox[user_id]
+    for message in tx.messages:
+        await application.update_queue.put(Update.de_json(message_update(user_id, **message), application.bot))
+
+    if tx.doc_type:
+        prompt, outcome = await wait_for_reply(outbox, timeout, want_keyboard=True)
+        if outcome:
+            return outcome
+        data = callback_update(user_id, prompt, f"type_{tx.doc_type}")
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+    _, outcome = await wait_for_reply(outbox, timeout, want_keyboard=False)
+    return outcome
+
+async def run(args, transactions):
+    import httpx
+    from openai import AsyncOpenAI
+    from telegram.ext import ApplicationBuilder
+
+    import main
+    import services.ai_service as ai_service
+    import services.sheet_service as sheet_service
+    from bench.fakes import FakeOpenAI, FakeWorksheet, FakeBotRequest
+    from services.executor import shutdown_pools
+    from services.metrics import add_stage_observer
+
+    # main включает INFO-логи; на нагрузке они только мешают
+    logging.getLogger().setLevel(args.log_level)
+
+    fake_openai = FakeOpenAI(args.openai_latency, args.openai_429, args.weeks)
+    fake_sheet = FakeWorksheet(args.sheets_latency, args.sheets_429, args.weeks)
+    bot_request = FakeBotRequest({}, args.telegram_latency, args.telegram_429)
+
+    fake_client = AsyncOpenAI(
+        api_key="bench", base_url="https://openai.bench.local/v1", max_retries=0,
+        http_client=httpx.AsyncClient(transport=fake_openai.transport()),
+    )
+    ai_service.get_client = lambda: fake_client
+    sheet_service.get_worksheet = lambda tenant=None: fake_sheet
+
+    stage_samples = defaultdict(list)
+    add_stage_observer(lambda stage, seconds: stage_samples[stage].append(seconds))
+
+    builder = (
+        ApplicationBuilder()
+        .token(os.environ["TELEGRAM_TOKEN"])
+        .request(bot_request)
+        .get_updates_request(FakeBotRequest({}))
+        .updater(None)
+    )
+    application = main.build_application(builder)
+
+    # Транзакции раскладываем по водителям: у каждого — строго по очереди, как в жизни
+    queues = defaultdict(list)
+    users = list(user_ids(args.users))
+    for i, tx in enumerate(transactions):
+        queues[users[i % len(users)]].append(tx)
+
+    results = []  # (вид, исход, секунды)
+
+    async def driver(user_id, txs):
+        for tx in txs:
+            start = time.perf_counter()
+            outcome = await run_transaction(application, bot_request, user_id, tx, args.timeout)
+            results.append((tx.kind, outcome, time.perf_counter() - start))
+
+    async with application:
+        await application.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(driver(u, txs) for u, txs in queues.items()))
+        wall = time.perf_counter() - started
+        # Ответы получены; дожидаемся фоновой записи журнала, чтобы сверить таблицу
+        flush_started = time.perf_counter()
+        if sheet_service.journal_flusher:
+            await sheet_service.journal_flusher.drain(args.timeout)
+        flush = time.perf_counter() - flush_started
+        await application.stop()
+    shutdown_pools()
+
+    return {
+        "wall": wall,
+        "flush": flush,
+        "results": results,
+        "stages": stage_samples,
+        "calls": {
+            "openai": dict(fake_openai.calls),
+            "sheets": dict(fake_sheet.calls),
+            "telegram": dict(bot_request.calls),
+        },
+        "sheet_total": fake_sheet.totals(),
+    }
+
+def summarize(report) -> dict:
+    results = report["results"]
+    n = len(results) or 1
+
+    def pct(values):
+        return {
+            "p50": round(percentile(values, 50), 4),
+            "p95": round(percentile(values, 95), 4),
+            "p99": round(percentile(values, 99), 4),
+            "count": len(values),
+        }
+
+    by_kind = defaultdict(list)
+    outcomes = defaultdict(int)
+    for kind, outcome, seconds in results:
+        by_kind[kind].append(seconds)
+        outcomes[outcome] += 1
+
+    return {
+        "transactions": len(results),
+        "wall_seconds": round(report["wall"], 3),
+        "journal_drain_seconds": round(report["flush"], 3),
+        "throughput_tps": round(len(results) / report["wall"], 3) if report["wall"] else 0.0,
+        "outcomes": dict(outcomes),
+        "transaction_latency": {kind: pct(values) for kind, values in sorted(by_kind.items())},
+        "stage_latency": {stage: pct(values) for stage, values in sorted(report["stages"].items())},
+        "calls_per_transaction": {
+            api: {op: round(count / n, 3) for op, count in sorted(calls.items())}
+            for api, calls in report["calls"].items()
+        },
+        "sheet_total": round(report["sheet_total"], 2),
+    }
+
+def print_summary(summary):
+    print(f"\nТранзакций: {summary['transactions']} за {summary['wall_seconds']}s "
+          f"-> {summary['throughput_tps']} tx/s")
+    print(f"Дозапись журнала после последнего ответа: {summary['journal_drain_seconds']}s")
+    print("Исходы: " + ", ".join(f"{k}={v}" for k, v in sorted(summary["outcomes"].items(), key=str)))
+
+    def table(title, rows):
+        print(f"\n{title:<28}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for name, s in rows.items():
+            print(f"{name:<28}{s['count']:>6}{s['p50']:>10.3f}{s['p95']:>10.3f}{s['p99']:>10.3f}")
+
+    table("Транзакция", summary["transaction_latency"])
+    table("Стадия", summary["stage_latency"])
+
+    print("\nВызовов API на транзакцию:")
+    for api, calls in summary["calls_per_transaction"].items():
+        print(f"  {api:<10}" + ", ".join(f"{op}={v}" for op, v in calls.items()))
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the bot pipeline with fake APIs")
+    parser.add_argument("--transactions", type=int, default=100)
+    parser.add_argument("--users", type=int, default=10, help="водителей (параллельных чатов)")
+    parser.add_argument("--mix", default="text=2,voice=1,pdf=2,pdf_template=1,photo=2,album=1")
+    parser.add_argument("--recorded", help="JSONL с записанными сценариями вместо синтетики")
+    parser.add_argument("--openai-latency", type=float, default=0.8)
+    parser.add_argument("--openai-429", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--sheets-latency", type=float, default=0.2)
+    parser.add_argument("--sheets-429", type=float, default=0.0)
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--telegram-429", type=float, default=0.0)
+    parser.add_argument("--weeks", type=int, default=8, help="недель в фейковой таблице")
+    parser.add_argument("--cache", action="store_true", help="включить кэш результатов AI")
+    parser.add_argument("--no-journal", action="store_true", help="писать в таблицу синхронно, без журнала")
+    parser.add_argument("--timeout", type=float, default=120, help="ожидание ответа бота, сек")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="сохранить итог в JSON (для сравнения до/после)")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    prepare_env(args)
+
+    from bench.scenarios import synthetic_mix, load_recorded
+    transactions = load_recorded(args.recorded) if args.recorded else synthetic_mix(args.transactions, parse_mix(args.mix))
+
+    summary = summarize(asyncio.run(run(args, transactions)))
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    sys.exit(main())
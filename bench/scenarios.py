@@ -0,0 +1,187 @@
+import io
+import itertools
+import json
+import os
+import random
+import time
+
+from PIL import Image
+
+# ==============================================================================
+# Сценарии = "транзакции" водителя: одно или несколько сообщений + нажатие кнопки.
+# Синтетические (генерируем PDF/фото/голос) или записанные (JSONL с путями к файлам).
+# ==============================================================================
+
+KINDS = ("text", "voice", "pdf", "pdf_template", "photo", "album")
+
+_ids = itertools.count(1)
+
+def make_pdf(pages) -> bytes:
+    """Минимальный PDF с текстовым слоем. pages: список страниц, страница — список строк."""
+    objs = []
+    n = len(pages)
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(n))
+    objs.append("<< /Type /Catalog /Pages 2 0 R >>")
+    objs.append(f"<< /Type /Pages /Kids [{kids}] /Count {n} >>")
+    font_id = 3 + 2 * n
+    for i, lines in enumerate(pages):
+        objs.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>"
+        )
+        body = "BT /F1 10 Tf 40 750 Td 14 TL " + " ".join(f"({line}) '" for line in lines) + " ET"
+        objs.append(f"<< /Length {len(body)} >>\nstream\n{body}\nendstream")
+    objs.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objs):
+        offsets.append(len(out))
+        out += f"{i + 1} 0 obj\n{obj}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n".encode()
+    for off in offsets:
+        out += f"{off:010d} 00000 n \n".encode()
+    out += f"trailer << /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF".encode()
+    return out
+
+def settlement_pdf(pages: int = 2) -> bytes:
+    lines = [f"Load {1000 + i}  Pickup Dallas TX  Rate ${random.uniform(800, 3000):,.2f}" for i in range(30)]
+    return make_pdf([["Driver Settlement Statement"] + lines for _ in range(pages)])
+
+def fuel_template_pdf() -> bytes:
+    """Попадает в локальный шаблон fuel_card_summary — без вызова модели."""
+    total = random.uniform(300, 1500)
+    return make_pdf([[
+        "Fuel Card Weekly Summary",
+        "Period Ending: " + time.strftime("%m/%d/%Y"),
+        f"Total Payables After Non-Cash Adjustment: ${total + 40:,.2f}",
+        f"Total Payables After Discount: ${total:,.2f}",
+    ]])
+
+def receipt_photo(size=(2400, 1800)) -> bytes:
+    """JPEG "с камеры": крупный, с шумом — чтобы предобработка реально работала."""
+    img = Image.effect_noise(size, 40).convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=92)
+    return buf.getvalue()
+
+def voice_note(seconds: int = 15) -> bytes:
+    # Без ffmpeg pydub его не разберет — prepare_voice вернет исходник, как и в проде при ошибке
+    return os.urandom(2000 * seconds)
+
+# --- Telegram updates ---
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"Driver{user_id}"}
+
+def message_update(user_id, **fields):
+    return {
+        "update_id": next(_ids),
+        "message": {
+            "message_id": next(_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            **fields,
+        },
+    }
+
+def callback_update(user_id, bot_message, data):
+    return {
+        "update_id": next(_ids),
+        "callback_query": {
+            "id": str(next(_ids)),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "message": bot_message,
+            "data": data,
+        },
+    }
+
+class Transaction:
+    """
+    Шаги одной транзакции: messages — сообщения пользователя (альбом — несколько),
+    doc_type — какую кнопку нажать (None для текста/голоса). files — file_id -> bytes.
+    """
+
+    def __init__(self, kind, messages, doc_type=None, files=None):
+        self.kind = kind
+        self.messages = messages
+        self.doc_type = doc_type
+        self.files = files or {}
+
+def _file_id(prefix):
+    return f"{prefix}{next(_ids)}"
+
+def _document(data, files, name="doc.pdf"):
+    file_id = _file_id("pdf")
+    files[file_id] = data
+    return {"document": {"file_id": file_id, "file_unique_id": file_id, "file_name": name,
+                         "mime_type": "application/pdf", "file_size": len(data)}}
+
+def _photo(data, files):
+    file_id = _file_id("photo")
+    files[file_id] = data
+    return {"photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 2400, "height": 1800,
+                       "file_size": len(data)}]}
+
+def _voice(data, files, unique_id=None):
+    file_id = _file_id("voice")
+    files[file_id] = data
+    return {"voice": {"file_id": file_id, "file_unique_id": unique_id or file_id, "duration": 15,
+                      "mime_type": "audio/ogg", "file_size": len(data)}}
+
+def build_transaction(kind, payloads=None) -> Transaction:
+    """payloads — байты файлов (для записанных сценариев); иначе генерируем."""
+    files = {}
+    if kind == "text":
+        text = payloads or f"fuel {random.uniform(50, 400):.2f} diesel"
+        return Transaction(kind, [{"text": text}])
+    if kind == "voice":
+        data = payloads[0] if payloads else voice_note()
+        return Transaction(kind, [_voice(data, files)], files=files)
+    if kind == "pdf":
+        data = payloads[0] if payloads else settlement_pdf()
+        return Transaction(kind, [_document(data, files)], "statement", files)
+    if kind == "pdf_template":
+        data = payloads[0] if payloads else fuel_template_pdf()
+        return Transaction(kind, [_document(data, files)], "fuel", files)
+    if kind == "photo":
+        data = payloads[0] if payloads else receipt_photo()
+        return Transaction(kind, [_photo(data, files)], "general", files)
+    if kind == "album":
+        group = str(next(_ids))
+        datas = payloads or [receipt_photo() for _ in range(3)]
+        messages = [{"media_group_id": group, **_photo(d, files)} for d in datas]
+        return Transaction(kind, messages, "general", files)
+    raise ValueError(f"Unknown scenario kind: {kind}")
+
+def synthetic_mix(count: int, weights: dict):
+    """count транзакций в заданной пропорции видов (weights: вид -> вес)."""
+    kinds = [k for k in KINDS if weights.get(k)]
+    return [build_transaction(k) for k in random.choices(kinds, [weights[k] for k in kinds], k=count)]
+
+def load_recorded(path: str):
+    """
+    JSONL: {"kind": "pdf", "files": ["a.pdf"]} | {"kind": "text", "text": "..."} | {"kind": "album", "files": [...]}.
+    Пути к файлам — относительно JSONL.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    result = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            if rec["kind"] == "text":
+                result.append(build_transaction("text", rec["text"]))
+                continue
+            payloads = []
+            for name in rec.get("files", []):
+                with open(os.path.join(base, name), "rb") as fh:
+                    payloads.append(fh.read())
+            tx = build_transaction(rec["kind"], payloads or None)
+            tx.doc_type = rec.get("doc_type", tx.doc_type)
+            result.append(tx)
+    return result
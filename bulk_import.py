@@ -0,0 +1,237 @@
+"""
+Массовая загрузка документов в таблицу (бэкфилл в конце месяца).
+
+    python bulk_import.py ./settlements --doc-type auto --concurrency 4 [--tenant fleet_a]
+
+1. Сканирует папку (PDF и фото).
+2. Тип документа: из --doc-type, из имени файла/папки или по содержимому PDF.
+3. Извлекает данные (локальные шаблоны, иначе AI) с ограниченным параллелизмом.
+4. Группирует по неделям и пишет каждую неделю одним пакетным запросом.
+Прогресс пишется в журнал (JSONL) — повторный запуск продолжает с места остановки.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+from collections import defaultdict
+
+from config import OPENAI_MAX_CONCURRENCY
+from services.ai_service import analyze_content
+from services.ai_scheduler import PRIORITY_BULK
+from services.calendar_service import bucket_by_week
+from services.executor import shutdown_pools
+from services.file_processor import extract_pdf_content_async
+from services.local_parsers import parse_known_layout_async, match_template
+from services.models import Transaction
+from services.sheet_service import save_week_items_async
+from services.tenants import default_tenant, get_tenant
+
+PDF_EXT = {".pdf"}
+IMAGE_EXT = {".jpg", ".jpeg", ".png", ".webp"}
+DOC_TYPES = ("statement", "fuel", "general")
+
+# --- Журнал прогресса ---
+
+def load_journal(path: str):
+    """Возвращает (файлы {sha: запись}, применённые sha)."""
+    files, applied = {}, set()
+    if not os.path.exists(path):
+        return files, applied
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # недописанная строка после падения
+            if rec.get("type") == "file":
+                files[rec["sha"]] = rec
+            elif rec.get("type") == "week" and rec.get("status") == "applied":
+                applied.update(rec["shas"])
+    return files, applied
+
+def append_journal(path: str, rec: dict):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+# --- Тип документа ---
+
+def infer_doc_type_from_path(path: str):
+    name = path.lower()
+    if "statement" in name or "settlement" in name:
+        return "statement"
+    if "fuel" in name:
+        return "fuel"
+    return None
+
+def infer_doc_type_from_text(text: str) -> str:
+    template = match_template(text)
+    if template:
+        return template.doc_type
+    low = text.lower()
+    if "settlement" in low or "delivery" in low:
+        return "statement"
+    if "gallons" in low or "diesel" in low or "fuel" in low:
+        return "fuel"
+    return "general"
+
+# --- Обработка файла ---
+
+async def analyze_file(path: str, data: bytes, doc_type: str, tenant=None):
+    """Возвращает (doc_type, Transaction или None)."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in IMAGE_EXT:
+        doc_type = doc_type or "general"
+        return doc_type, await analyze_content(None, data, doc_type=doc_type, priority=PRIORITY_BULK, tenant=tenant)
+
+    content = await extract_pdf_content_async(data)
+    text, images = content["text"], content["images"]
+    if text:
+        doc_type = doc_type or infer_doc_type_from_text(text)
+        local = await parse_known_layout_async(data, text, tenant.categories if tenant else None)
+        if local and local[0] == doc_type:
+            return doc_type, local[1]
+    doc_type = doc_type or "general"
+    if not text and not images:
+        return doc_type, None
+    return doc_type, await analyze_content(
+        text, images or None, doc_type=doc_type, priority=PRIORITY_BULK, tenant=tenant
+    )
+
+async def process_files(paths, args, journal_files, applied):
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def one(path):
+        # Файл читаем под семафором: в памяти не больше concurrency файлов разом
+        async with sem:
+            with open(path, "rb") as f:
+                data = f.read()
+            sha = hashlib.sha256(data).hexdigest()
+
+            if sha in applied:
+                return {"type": "file", "path": path, "sha": sha, "status": "applied"}
+            done = journal_files.get(sha)
+            if done and done["status"] in ("analyzed", "no_date", "empty"):
+                return done
+
+            doc_type = None if args.doc_type == "auto" else args.doc_type
+            doc_type = doc_type or infer_doc_type_from_path(path)
+            try:
+                doc_type, result = await analyze_file(path, data, doc_type, args.tenant)
+            except Exception as e:
+                logging.error(f"{path}: {e}")
+                rec = {"type": "file", "path": path, "sha": sha, "status": "failed", "error": str(e)}
+                append_journal(args.journal, rec)
+                return rec
+
+        rec = {"type": "file", "path": path, "sha": sha, "doc_type": doc_type,
+               "result": result.to_dict() if result else None}
+        if not result or not result.items:
+            rec["status"] = "empty"
+        elif not result.date:
+            rec["status"] = "no_date"
+        else:
+            rec["status"] = "analyzed"
+        append_journal(args.journal, rec)
+        print(f"[{rec['status']}] {path}")
+        return rec
+
+    return await asyncio.gather(*(one(p) for p in paths))
+
+async def apply_weeks(records, args):
+    """Одна пакетная запись на неделю."""
+    analyzed = [rec for rec in records if rec["status"] == "analyzed"]
+    by_week = bucket_by_week(analyzed, key=lambda rec: rec["result"]["date"])
+
+    report = {}
+    for week, recs in sorted(by_week.items()):
+        # В журнале транзакция лежит как to_dict() — читаем обратно той же моделью
+        categories = args.tenant.categories
+        # Метка #{sha файла}-{номер} в заметке: повторный прогон (после сбоя или таймаута,
+        # когда запись на сервере уже прошла) пропустит позиции, которые уже в таблице
+        entries = [
+            (col, amount, comment, f"{rec['sha'][:12]}-{i}")
+            for rec in recs
+            for i, (col, amount, comment) in enumerate(
+                Transaction.from_dict(rec["result"], categories).entries(categories)
+            )
+        ]
+        shas = [rec["sha"] for rec in recs]
+        total = sum(entry[1] for entry in entries)
+
+        if args.dry_run:
+            report[week] = ("dry-run", len(recs), total)
+            continue
+        try:
+            saved = await save_week_items_async(week, entries, args.tenant) if entries else (None, {})
+            status = "applied" if saved else "not_found"
+        except Exception as e:
+            logging.error(f"Week {week}: {e}")
+            status = "failed"
+
+        append_journal(args.journal, {"type": "week", "week": week, "shas": shas, "status": status})
+        if status == "applied":
+            for rec in recs:
+                rec["status"] = "applied"
+        report[week] = (status, len(recs), total)
+    return report
+
+def print_summary(records, report):
+    counts = defaultdict(int)
+    for rec in records:
+        counts[rec["status"]] += 1
+
+    print("\n=== Итог ===")
+    for status, n in sorted(counts.items()):
+        print(f"{status:>10}: {n}")
+    if report:
+        print("\nНедели:")
+        for week, (status, n, total) in report.items():
+            print(f"  {week}  {status:<10} файлов: {n:<3} сумма: ${total:,.2f}")
+    for rec in records:
+        if rec["status"] in ("failed", "no_date", "empty"):
+            print(f"  ⚠️ {rec['status']}: {rec['path']}")
+
+async def run(args):
+    paths = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(args.folder)
+        for name in names
+        if os.path.splitext(name)[1].lower() in PDF_EXT | IMAGE_EXT
+    )
+    journal_files, applied = load_journal(args.journal)
+    print(f"Файлов: {len(paths)}, уже в журнале: {len(journal_files)}")
+
+    records = await process_files(paths, args, journal_files, applied)
+    report = await apply_weeks(records, args)
+    print_summary(records, report)
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import of PDFs/photos into the weekly sheet")
+    parser.add_argument("folder")
+    parser.add_argument("--doc-type", choices=("auto",) + DOC_TYPES, default="auto")
+    parser.add_argument("--concurrency", type=int, default=OPENAI_MAX_CONCURRENCY)
+    parser.add_argument("--journal", help="JSONL-журнал прогресса (по умолчанию в папке импорта)")
+    parser.add_argument("--dry-run", action="store_true", help="только анализ, без записи в таблицу")
+    parser.add_argument("--tenant", help="автопарк из TENANTS (обязателен, если автопарков несколько)")
+    args = parser.parse_args()
+    try:
+        args.tenant = get_tenant(args.tenant) if args.tenant else default_tenant()
+    except ValueError as e:
+        parser.error(str(e))
+    if args.tenant is None:
+        parser.error("unknown tenant")
+    args.journal = args.journal or os.path.join(args.folder, ".bulk_import_journal.jsonl")
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.WARNING)
+    try:
+        asyncio.run(run(args))
+    finally:
+        shutdown_pools()
+
+if __name__ == '__main__':
+    sys.exit(main())
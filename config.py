@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Загружаем .env, но НЕ перезаписываем переменные окружения (убрали override=True)
@@ -16,19 +17,123 @@ if not TELEGRAM_TOKEN:
 SHEET_ID = os.getenv("SHEET_ID")
 TAB_NAME = os.getenv("TAB_NAME", "WeeklyData")
 
+# Клиент Sheets живет весь процесс: токен обновляем заранее (за N секунд до истечения)
+SHEETS_TOKEN_REFRESH_MARGIN = int(os.getenv("SHEETS_TOKEN_REFRESH_MARGIN", "300"))
+# Размер пула HTTP-соединений к Google API
+SHEETS_HTTP_POOL_SIZE = int(os.getenv("SHEETS_HTTP_POOL_SIZE", "10"))
+# Сколько секунд доверяем индексу недель (колонка B) без проверки ревизии таблицы
+WEEK_INDEX_TTL = int(os.getenv("WEEK_INDEX_TTL", "600"))
+
+# Локальная копия листа для команд /week /month /summary
+REPLICA_CHECK_TTL = int(os.getenv("REPLICA_CHECK_TTL", "60"))     # сек без проверки ревизии таблицы
+REPLICA_FULL_TTL = int(os.getenv("REPLICA_FULL_TTL", "3600"))     # полная перезагрузка листа
+REPLICA_HOT_WEEKS = int(os.getenv("REPLICA_HOT_WEEKS", "6"))      # последние недели, перечитываемые при изменениях
+
 # --- Google Service Account Key ---
-if os.getenv("GOOGLE_SA_JSON"):
-    GOOGLE_SA_JSON = os.getenv("GOOGLE_SA_JSON")
-else:
-    try:
-        if os.path.exists("google_key.json"):
-            with open("google_key.json", "r", encoding="utf-8") as f:
-                GOOGLE_SA_JSON = f.read()
+# Читается при первом обращении к таблице, а не при импорте (холодный старт)
+_google_sa_json = None
+
+def get_google_sa_json():
+    global _google_sa_json
+    if _google_sa_json is None:
+        if os.getenv("GOOGLE_SA_JSON"):
+            _google_sa_json = os.getenv("GOOGLE_SA_JSON")
         else:
-            GOOGLE_SA_JSON = None
-    except Exception as e:
-        print(f"Ошибка чтения ключа: {e}")
-        GOOGLE_SA_JSON = None
+            try:
+                if os.path.exists("google_key.json"):
+                    with open("google_key.json", "r", encoding="utf-8") as f:
+                        _google_sa_json = f.read()
+            except Exception as e:
+                print(f"Ошибка чтения ключа: {e}")
+    return _google_sa_json
+
+# --- OpenAI Scheduler ---
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "4"))  # под наш rate tier
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "90"))               # сек на один вызов
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "4"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "1.0"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "30"))
+# Если в минутной квоте осталось меньше токенов — ждем ее сброса
+OPENAI_TOKEN_RESERVE = int(os.getenv("OPENAI_TOKEN_RESERVE", "8000"))
+# Потоковые ответы: позиции разбираются по мере генерации ("0" — только обычный запрос)
+AI_STREAMING = os.getenv("AI_STREAMING", "1") == "1"
+# Не чаще одной правки статусного сообщения за N секунд (лимиты Telegram на edit)
+STATUS_EDIT_INTERVAL = float(os.getenv("STATUS_EDIT_INTERVAL", "1.5"))
+# Цены модели за 1M токенов (USD) — для учета стоимости вызовов по типам документов
+OPENAI_PRICE_INPUT = float(os.getenv("OPENAI_PRICE_INPUT", "2.5"))
+OPENAI_PRICE_OUTPUT = float(os.getenv("OPENAI_PRICE_OUTPUT", "10"))
+
+# --- Prompt Budget ---
+# Потолок входных токенов на текст запроса (системный промпт + документ, без картинок); 0 — без ограничения
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "12000"))
+# Документы сверх потолка сначала фильтруем: только строки с суммами, датами и ключевыми словами
+PROMPT_SECTION_FILTER = os.getenv("PROMPT_SECTION_FILTER", "1") == "1"
+
+# --- AI Result Cache ---
+# Повторно присланные документы отвечаем из кэша, без запроса к модели.
+# Пустой путь — кэш выключен.
+AI_CACHE_PATH = os.getenv("AI_CACHE_PATH", os.path.join(tempfile.gettempdir(), "finbot_cache.sqlite"))
+AI_CACHE_MAX_MB = int(os.getenv("AI_CACHE_MAX_MB", "50"))
+
+# --- Save Journal (write-ahead) ---
+# Подтвержденные позиции сначала пишутся в локальный журнал, пользователь сразу получает ответ,
+# в таблицу они уходят фоном (с повторами, если Sheets недоступен).
+# Включается только явным путем на постоянном диске: на Cloud Run без тома /tmp живет в памяти
+# инстанса, и позиции, подтвержденные до записи в таблицу, пропали бы вместе с ним.
+# Пустой путь (по умолчанию) — запись в таблицу синхронно, ответ пользователю после нее.
+SAVE_JOURNAL_PATH = os.getenv("SAVE_JOURNAL_PATH", "")
+SAVE_JOURNAL_INTERVAL = float(os.getenv("SAVE_JOURNAL_INTERVAL", "5"))        # опрос журнала без новых позиций, сек
+SAVE_JOURNAL_BATCH = int(os.getenv("SAVE_JOURNAL_BATCH", "200"))              # позиций за один проход
+SAVE_JOURNAL_BACKOFF_MAX = float(os.getenv("SAVE_JOURNAL_BACKOFF_MAX", "300"))  # макс. пауза между повторами
+SAVE_JOURNAL_MAX_ATTEMPTS = int(os.getenv("SAVE_JOURNAL_MAX_ATTEMPTS", "20"))   # после стольких ошибок позиция -> failed
+SAVE_JOURNAL_DRAIN_TIMEOUT = float(os.getenv("SAVE_JOURNAL_DRAIN_TIMEOUT", "8"))  # дописываем при остановке (Cloud Run дает ~10с)
+SAVE_JOURNAL_KEEP_DAYS = int(os.getenv("SAVE_JOURNAL_KEEP_DAYS", "30"))       # сколько хранить записанные позиции
+
+# --- Image Preprocessing (перед vision-запросом) ---
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1600"))        # длинная сторона, px
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "80"))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "0") == "1"       # документы можно в ч/б
+IMAGE_AUTOCROP = os.getenv("IMAGE_AUTOCROP", "0") == "1"         # обрезка по листу бумаги
+
+# --- PDF Extraction ---
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "50"))          # дальше страниц не читаем
+PDF_MAX_CHARS = int(os.getenv("PDF_MAX_CHARS", "60000"))       # бюджет текста на документ
+PDF_PAGES_PER_CHUNK = int(os.getenv("PDF_PAGES_PER_CHUNK", "4"))  # страниц на одну задачу пула
+# Скан без текстового слоя: сколько страниц и в каком DPI отправляем картинками
+PDF_SCAN_PAGES = int(os.getenv("PDF_SCAN_PAGES", "3"))         # страниц для проверки текстового слоя
+PDF_MIN_TEXT_CHARS = int(os.getenv("PDF_MIN_TEXT_CHARS", "20"))
+PDF_RENDER_DPI = int(os.getenv("PDF_RENDER_DPI", "150"))
+PDF_MAX_IMAGE_PAGES = int(os.getenv("PDF_MAX_IMAGE_PAGES", "4"))
+
+# --- Voice ---
+VOICE_PREPROCESS = os.getenv("VOICE_PREPROCESS", "1") == "1"    # обрезка тишины + даунсемплинг (ffmpeg)
+VOICE_PREPROCESS_MIN_SEC = int(os.getenv("VOICE_PREPROCESS_MIN_SEC", "20"))  # короче — шлем как есть
+VOICE_SILENCE_DB = float(os.getenv("VOICE_SILENCE_DB", "-40"))
+VOICE_SAMPLE_RATE = int(os.getenv("VOICE_SAMPLE_RATE", "16000"))
+
+# --- Albums ---
+# Сколько секунд ждем следующую часть альбома (media_group_id), прежде чем спросить тип
+ALBUM_WINDOW = float(os.getenv("ALBUM_WINDOW", "1.5"))
+
+# --- Persistence (диалоги и временные файлы) ---
+# "" — в памяти процесса, "sqlite:///data/finbot.sqlite" или "redis://host:6379/0"
+PERSISTENCE_URL = os.getenv("PERSISTENCE_URL", "")
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "5"))
+CONVERSATION_TTL = int(os.getenv("CONVERSATION_TTL", str(24 * 3600)))  # брошенный диалог живет сутки
+BLOB_TTL = int(os.getenv("BLOB_TTL", str(6 * 3600)))                   # фото/страницы сканов
+
+# --- Concurrency ---
+# Сколько апдейтов Telegram обрабатываем параллельно (апдейты одного чата — по очереди)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))
+# Пул потоков для Google Sheets и пул процессов для PDF
+SHEETS_WORKERS = int(os.getenv("SHEETS_WORKERS", "8"))
+SHEETS_MAX_PENDING = int(os.getenv("SHEETS_MAX_PENDING", "64"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+PDF_MAX_PENDING = int(os.getenv("PDF_MAX_PENDING", "8"))
+# Окно (сек), за которое записи в одну строку склеиваются в один запрос
+WRITE_COALESCE_WINDOW = float(os.getenv("WRITE_COALESCE_WINDOW", "0.2"))
+# Прогрев после старта webhook: клиенты OpenAI/Sheets и воркеры пула до первого апдейта ("0" — выключить)
+WARMUP = os.getenv("WARMUP", "1") == "1"
 
 # --- Security ---
 ALLOWED_IDS = []
@@ -56,3 +161,19 @@ CATEGORIES_MAP = {
 }
 
 DATE_COLUMN = "B"
+
+# --- Tenants (несколько автопарков на одном инстансе) ---
+# JSON: {"fleet_a": {"sheet_id": "...", "tab": "WeeklyData", "users": [111, 222], "categories": {"gross": "C", ...}}}
+# tab и categories можно опустить — возьмутся TAB_NAME и CATEGORIES_MAP.
+# Файл TENANTS_PATH или строка TENANTS_JSON; без них — один автопарк из SHEET_ID/TAB_NAME/ALLOWED_IDS.
+TENANTS_PATH = os.getenv("TENANTS_PATH", "")
+TENANTS_JSON = os.getenv("TENANTS_JSON", "")
+# Открытых листов в кэше (LRU) и сколько секунд неактивный лист держим открытым
+TENANT_CACHE_SIZE = int(os.getenv("TENANT_CACHE_SIZE", "32"))
+TENANT_IDLE_TTL = int(os.getenv("TENANT_IDLE_TTL", "3600"))
+# Квоты на автопарк (при нескольких автопарках; 0 — без ограничения):
+# одновременных вызовов и вызовов в минуту — один тяжелый автопарк не забирает общие лимиты
+TENANT_OPENAI_CONCURRENCY = int(os.getenv("TENANT_OPENAI_CONCURRENCY", "2"))
+TENANT_OPENAI_PER_MIN = int(os.getenv("TENANT_OPENAI_PER_MIN", "30"))
+TENANT_SHEETS_CONCURRENCY = int(os.getenv("TENANT_SHEETS_CONCURRENCY", "2"))
+TENANT_SHEETS_PER_MIN = int(os.getenv("TENANT_SHEETS_PER_MIN", "60"))
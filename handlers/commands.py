@@ -0,0 +1,116 @@
+import logging
+import re
+from datetime import date, timedelta
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from handlers.common import check_auth
+from services.calendar_service import parse_date, get_current_date_us
+from services.sheet_service import get_replica_async
+
+# ==============================================================================
+# Отчеты из локальной копии листа: без открытия таблицы и почти без запросов к Sheets.
+# ==============================================================================
+
+_MONTH_RE = re.compile(r"^(\d{1,2})(?:[./-](\d{4}))?$")
+
+def _money(value: float) -> str:
+    return f"${value:,.2f}"
+
+def _format_totals(totals: dict) -> list:
+    """Строки по ненулевым категориям + вычеты (все, кроме gross) и остаток."""
+    lines = [f"{category.upper()}: {_money(amount)}" for category, amount in totals.items() if amount]
+    if not lines:
+        return ["Пока пусто."]
+    deductions = sum(amount for category, amount in totals.items() if category != "gross")
+    lines.append(f"➖ Вычеты: {_money(deductions)}")
+    lines.append(f"💵 Остаток: {_money(totals.get('gross', 0.0) - deductions)}")
+    return lines
+
+async def _replica(update: Update, tenant):
+    try:
+        return await get_replica_async(tenant)
+    except Exception as e:
+        logging.error(f"Replica Error: {e}")
+        await update.message.reply_text(f"Ошибка чтения таблицы: {e}")
+        return None
+
+async def week_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/week [дата] — итоги недели (по умолчанию текущей)."""
+    tenant = await check_auth(update)
+    if not tenant: return
+    replica = await _replica(update, tenant)
+    if not replica:
+        return
+
+    d = parse_date(" ".join(context.args)) if context.args else get_current_date_us()
+    found = replica.week_totals(d)
+    if not found:
+        await update.message.reply_text(f"❌ Неделя с датой {d.strftime('%m.%d.%Y')} не найдена в таблице.")
+        return
+    week, totals = found
+    await update.message.reply_text(f"📊 Неделя {week}\n" + "\n".join(_format_totals(totals)))
+
+async def month_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/month [MM.YYYY | MM] — итоги месяца (неделя относится к месяцу своего четверга)."""
+    tenant = await check_auth(update)
+    if not tenant: return
+
+    today = get_current_date_us()
+    month, year = today.month, today.year
+    if context.args:
+        m = _MONTH_RE.match(context.args[0])
+        if not m or not 1 <= int(m.group(1)) <= 12:
+            await update.message.reply_text("Формат: /month 10.2026 или /month 10")
+            return
+        month, year = int(m.group(1)), int(m.group(2) or year)
+
+    replica = await _replica(update, tenant)
+    if not replica:
+        return
+    start = date(year, month, 1)
+    end = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    totals, weeks = replica.period_totals(start, end)
+    await update.message.reply_text(
+        f"📅 Месяц {month:02d}.{year} (недель: {weeks})\n" + "\n".join(_format_totals(totals))
+    )
+
+async def summary_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /summary [категория] [недель] — по категории: суммы по неделям;
+    без категории — итоги по всем категориям за последние N недель (по умолчанию 8).
+    """
+    tenant = await check_auth(update)
+    if not tenant: return
+
+    category, weeks = None, 8
+    for arg in context.args or []:
+        if arg.isdigit():
+            weeks = max(1, min(int(arg), 104))
+        elif arg.lower() in tenant.categories:
+            category = arg.lower()
+        else:
+            await update.message.reply_text(
+                "Формат: /summary [категория] [недель]\nКатегории: " + ", ".join(tenant.categories)
+            )
+            return
+
+    replica = await _replica(update, tenant)
+    if not replica:
+        return
+    today = get_current_date_us()
+
+    if category:
+        history = replica.category_history(category, weeks, today)
+        lines = [f"{week}: {_money(amount)}" for week, amount in history]
+        total = sum(amount for _, amount in history)
+        lines.append(f"Σ {_money(total)}, в среднем {_money(total / len(history) if history else 0)}/нед.")
+        await update.message.reply_text(f"📈 {category.upper()} за {weeks} нед.\n" + "\n".join(lines))
+        return
+
+    this_monday = today - timedelta(days=today.weekday())
+    start = this_monday - timedelta(days=7 * (weeks - 1))
+    totals, found = replica.period_totals(start, this_monday + timedelta(days=6))
+    await update.message.reply_text(
+        f"📈 Итоги за {weeks} нед. (в таблице: {found})\n" + "\n".join(_format_totals(totals))
+    )
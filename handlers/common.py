@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor, ConversationHandler
+from telegram.ext._handlers.conversationhandler import PendingState
+from services.metrics import new_trace_id
+from services.models import parse_amount
+from services.tenants import tenant_for_user
+
+async def check_auth(update: Update):
+    """Проверка прав доступа. Возвращает автопарк пользователя или None."""
+    user_id = update.effective_user.id
+    tenant = tenant_for_user(user_id)
+    if tenant is None:
+        await update.effective_message.reply_text(f"⛔ Access denied. Your ID: {user_id}")
+        return None
+    return tenant
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Разные чаты обрабатываются параллельно, апдейты одного чата — строго по очереди.
+    Так ConversationHandler не ловит гонки состояний, а медленное сохранение
+    одного водителя не блокирует остальных.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._chat_locks = {}  # chat_id -> [Lock, число ожидающих]
+
+    async def do_process_update(self, update, coroutine):
+        # Trace id живет в контексте задачи апдейта и попадает во все его логи
+        new_trace_id()
+        chat = update.effective_chat if isinstance(update, Update) else None
+        logging.debug(f"Update from chat {chat.id if chat else '-'}")
+        if chat is None:
+            await coroutine
+            return
+
+        entry = self._chat_locks.setdefault(chat.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._chat_locks.pop(chat.id, None)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+class SharedConversationHandler(ConversationHandler):
+    """
+    ConversationHandler, у которого состояние диалога живет в общем хранилище, а не в памяти инстанса.
+    PTB читает состояния из persistence только при старте и пишет по таймеру — при нескольких
+    инстансах нажатие кнопки или ответ с датой, попавшие на другой инстанс, теряли диалог.
+    - refresh (TypeHandler в группе -1) перед каждым апдейтом берет состояние из хранилища;
+    - после смены состояния user_data и состояние пишутся сразу (user_data первой —
+      инстанс, увидевший состояние, увидит и данные к нему).
+    Без persistence ведет себя как обычный ConversationHandler.
+    Опирается на внутренности PTB (_conversations, _get_key, PendingState): версия PTB
+    закреплена в requirements.txt, tests/test_persistence.py упадет, если их раскладка изменится.
+    """
+
+    def _shared(self, update, application):
+        return (
+            self.persistent and application.persistence is not None
+            and isinstance(update, Update) and update.effective_chat and update.effective_user
+        )
+
+    async def refresh(self, update, context):
+        if not self._shared(update, context.application):
+            return
+        key = self._get_key(update)
+        if isinstance(self._conversations.get(key), PendingState):
+            return
+        state = await context.application.persistence.get_conversation(self.name, key)
+        # Без отметки об изменении: прочитанное не должно уйти обратно в периодический сброс
+        if state is None:
+            self._conversations.data.pop(key, None)
+        else:
+            self._conversations.update_no_track({key: state})
+
+    async def handle_update(self, update, application, check_result, context):
+        try:
+            return await super().handle_update(update, application, check_result, context)
+        finally:
+            if self._shared(update, application):
+                key = check_result[1]
+                state = self._conversations.get(key)
+                if not isinstance(state, PendingState):
+                    persistence = application.persistence
+                    await persistence.update_user_data(update.effective_user.id, context.user_data)
+                    await persistence.update_conversation(self.name, key, state)
+
+class StatusProgress:
+    """
+    Промежуточный прогресс анализа в статусном сообщении ("⏳ 3 поз. на $1200.00...").
+    Правки не чаще раза в interval секунд и фоном — чтение потока модели не ждет Telegram.
+    """
+
+    def __init__(self, message, interval: float):
+        self.message = message
+        self.interval = interval
+        self._last_edit = 0.0
+        self._task = None
+
+    async def __call__(self, items):
+        if self.message is None:
+            return
+        now = time.monotonic()
+        if now - self._last_edit < self.interval or (self._task and not self._task.done()):
+            return
+        self._last_edit = now
+        total_amount = sum(parse_amount(item['amount']) for item in items)
+        self._task = asyncio.create_task(
+            self._edit(f"⏳ Уже {len(items)} поз. на ${total_amount:.2f}, читаю дальше...")
+        )
+
+    async def _edit(self, text):
+        try:
+            await self.message.edit_text(text)
+        except Exception as e:
+            logging.debug(f"Progress edit skipped: {e}")
+
+    async def close(self):
+        """Дожидается последней правки, чтобы она не перезаписала итоговый ответ."""
+        if self._task:
+            await self._task
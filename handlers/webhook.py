@@ -0,0 +1,73 @@
+import asyncio
+import json
+import re
+import logging
+import signal
+import tornado.web
+from telegram import Update
+from services.metrics import render_metrics, CONTENT_TYPE
+
+# ==============================================================================
+# Свой webhook-сервер вместо application.run_webhook:
+# на том же порту (Cloud Run дает один) отдаем /metrics для Prometheus.
+# ==============================================================================
+
+class TelegramWebhookHandler(tornado.web.RequestHandler):
+    SUPPORTED_METHODS = ("POST",)
+
+    def initialize(self, bot_app):
+        self.bot_app = bot_app
+
+    async def post(self):
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            return
+        update = Update.de_json(data, self.bot_app.bot)
+        if update:
+            await self.bot_app.update_queue.put(update)
+        self.set_status(200)
+
+class MetricsHandler(tornado.web.RequestHandler):
+    SUPPORTED_METHODS = ("GET",)
+
+    async def get(self):
+        # Сборщики ходят в SQLite (журнал, кэш) — не на event loop
+        body = await asyncio.to_thread(render_metrics)
+        self.set_header("Content-Type", CONTENT_TYPE)
+        self.write(body)
+
+async def serve_webhook(application, listen: str, port: int, url_path: str, webhook_url: str, warm_up=None):
+    """
+    Аналог run_webhook: post_init -> set_webhook -> start ... SIGTERM -> stop -> post_stop -> post_shutdown.
+    warm_up — корутина-функция, запускается фоном, когда порт уже слушается.
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    web_app = tornado.web.Application([
+        (rf"/{re.escape(url_path)}/?", TelegramWebhookHandler, {"bot_app": application}),
+        (r"/metrics", MetricsHandler),
+    ])
+
+    async with application:  # initialize() / shutdown()
+        if application.post_init:
+            await application.post_init(application)
+        server = web_app.listen(port, address=listen)
+        await application.bot.set_webhook(webhook_url, allowed_updates=Update.ALL_TYPES)
+        await application.start()
+        logging.info(f"Webhook server on {listen}:{port}, metrics at /metrics")
+        if warm_up:
+            application.create_task(warm_up())
+        try:
+            await stop_event.wait()
+        finally:
+            server.stop()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
@@ -1,43 +1,52 @@
 import os
 import logging
 import asyncio
-import tempfile
+import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ConversationHandler
+from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters, ConversationHandler
 
-from config import TELEGRAM_TOKEN, ALLOWED_IDS, CATEGORIES_MAP
-from services.ai_service import analyze_content, transcribe_audio
-from services.file_processor import extract_text_from_pdf
+from config import (
+    TELEGRAM_TOKEN, CONCURRENT_UPDATES, ALBUM_WINDOW, WARMUP, PDF_WORKERS,
+    STATUS_EDIT_INTERVAL, SAVE_JOURNAL_DRAIN_TIMEOUT, SAVE_JOURNAL_KEEP_DAYS,
+)
+from services.ai_service import analyze_content, transcribe_audio, get_cached_transcript, get_client
+from services.file_processor import extract_pdf_content_async, preload_worker
+from services.local_parsers import parse_known_layout_async
 from services.calendar_service import parse_date, get_week_range
-from services.sheet_service import get_worksheet, find_row_by_week, update_cell_with_note
+from services.sheet_service import save_week_items_async, get_replica_async, journal_flusher, prepare_client
+from services.tenants import MULTI_TENANT
+from services.executor import shutdown_pools, pdf_pool, sheets_pool
+from services.persistence import blob_store, build_persistence
+from handlers.common import PerChatUpdateProcessor, StatusProgress, SharedConversationHandler, check_auth
+from handlers.commands import week_command, month_command, summary_command
+from handlers.webhook import serve_webhook
+from services.metrics import timed, install_log_trace_ids
 
 # --- Состояния разговора ---
 WAITING_FOR_DOC_TYPE = 1  # Ждем нажатия кнопки
 WAITING_FOR_DATE = 2      # Ждем ввода даты вручную
 
 # --- Настройка логов ---
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+logging.basicConfig(format='%(asctime)s - [%(trace_id)s] %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+install_log_trace_ids()
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
-async def check_auth(update: Update):
-    """Проверка прав доступа"""
-    user_id = update.effective_user.id
-    if user_id not in ALLOWED_IDS:
-        await update.message.reply_text(f"⛔ Access denied. Your ID: {user_id}")
-        return False
-    return True
-
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_auth(update): return
-    await update.message.reply_text("🚛 FinBot v3.5 готов!\nКидай PDF, фото, голосовые или текст.")
+    await update.message.reply_text(
+        "🚛 FinBot v3.5 готов!\nКидай PDF, фото, голосовые или текст.\n"
+        "Итоги из таблицы: /week, /month, /summary"
+    )
 
+@timed("process_input")
 async def process_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Главная функция приема сообщений.
     1. Если Текст/Голос -> сразу анализируем (General).
     2. Если Файл/Фото -> сохраняем и показываем кнопки выбора.
     """
-    if not await check_auth(update): return
+    tenant = await check_auth(update)
+    if not tenant: return
     
     msg = update.message
     
@@ -52,26 +61,22 @@ async def process_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
         # Если голос
         elif msg.voice:
-            # --- ИСПРАВЛЕНИЕ WINDOWS ERROR ---
-            temp_path = ""
-            # Создаем файл, закрываем его, и только потом используем
-            with tempfile.NamedTemporaryFile(suffix=".ogg", delete=False) as tmp:
-                temp_path = tmp.name
-            
-            try:
+            # Пересланное голосовое могли уже распознать — не качаем повторно
+            text_content = get_cached_transcript(msg.voice.file_unique_id)
+            if text_content is None:
+                # Качаем в память, без временных файлов на диске
                 file = await msg.voice.get_file()
-                await file.download_to_drive(temp_path)
-                text_content = await transcribe_audio(temp_path)
-            finally:
-                # Удаляем файл даже если произошла ошибка
-                if os.path.exists(temp_path):
-                    os.unlink(temp_path)
+                audio_bytes = await file.download_as_bytearray()
+                text_content = await transcribe_audio(
+                    audio_bytes, file_unique_id=msg.voice.file_unique_id, tenant=tenant,
+                    duration=msg.voice.duration,
+                )
 
             await status_msg.edit_text(f"🗣 Распознано: {text_content}\n🧠 Думаю...")
 
         # --- ВАЖНОЕ ИСПРАВЛЕНИЕ ЗДЕСЬ ---
         # Мы возвращаем результат анализа (WAITING_FOR_DATE или END), а не завершаем принудительно.
-        return await run_ai_analysis(update, context, status_msg, text=text_content, doc_type="general")
+        return await run_ai_analysis(update, context, status_msg, text=text_content, doc_type="general", tenant=tenant)
 
     # --- СЦЕНАРИЙ 2: ФАЙЛЫ (PDF / ФОТО) ---
     # Нужно спросить тип документа
@@ -79,37 +84,29 @@ async def process_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Очищаем временное хранилище
     context.user_data['temp_text'] = ""
     context.user_data['temp_image'] = None
+    context.user_data['local_result'] = None
+    # Альбом (несколько фото/файлов одним сообщением) собираем в одну задачу
+    context.user_data['album_id'] = msg.media_group_id
+    context.user_data['album_count'] = 0
     
+    # Окно альбома считаем от прихода части, а не от конца ее загрузки
+    context.user_data['album_last'] = time.monotonic()
+
     status_msg = await msg.reply_text("📥 Читаю файл...")
 
     try:
-        # Если PDF
-        if msg.document and msg.document.mime_type == 'application/pdf':
-            file = await msg.document.get_file()
-            byte_array = await file.download_as_bytearray()
-            # Читаем текст из PDF сразу
-            text_from_pdf = extract_text_from_pdf(byte_array)
-            context.user_data['temp_text'] = text_from_pdf
-            
-        # Если ФОТО
-        elif msg.photo:
-            file = await msg.photo[-1].get_file()
-            image_bytes = await file.download_as_bytearray()
-            context.user_data['temp_image'] = image_bytes
-            # Не забываем про подпись (Caption)
-            if msg.caption:
-                context.user_data['temp_text'] = msg.caption
-
-        # Показываем кнопки
-        keyboard = [
-            [InlineKeyboardButton("📄 Statement (Стейтмент)", callback_data="type_statement")],
-            [InlineKeyboardButton("⛽ Fuel (Топливо)", callback_data="type_fuel")],
-            [InlineKeyboardButton("🧾 Receipt / Other (Чек/Прочее)", callback_data="type_general")],
-            [InlineKeyboardButton("❌ Отмена", callback_data="cancel")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await status_msg.edit_text("📂 Что это за документ?", reply_markup=reply_markup)
+        if not await read_attachment(msg, context.user_data, tenant):
+            await status_msg.edit_text("🤷‍♂️ Не удалось прочитать PDF.")
+            return ConversationHandler.END
+
+        if msg.media_group_id:
+            # Остальные части альбома придут отдельными апдейтами — ждем их и потом спрашиваем тип
+            context.application.create_task(
+                ask_album_doc_type(status_msg, context.user_data, msg.media_group_id)
+            )
+            return WAITING_FOR_DOC_TYPE
+
+        await status_msg.edit_text("📂 Что это за документ?", reply_markup=doc_type_keyboard())
         
         # Ждем нажатия кнопки
         return WAITING_FOR_DOC_TYPE
@@ -119,10 +116,106 @@ async def process_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await status_msg.edit_text(f"Ошибка чтения файла: {e}")
         return ConversationHandler.END
 
+def doc_type_keyboard():
+    keyboard = [
+        [InlineKeyboardButton("📄 Statement (Стейтмент)", callback_data="type_statement")],
+        [InlineKeyboardButton("⛽ Fuel (Топливо)", callback_data="type_fuel")],
+        [InlineKeyboardButton("🧾 Receipt / Other (Чек/Прочее)", callback_data="type_general")],
+        [InlineKeyboardButton("❌ Отмена", callback_data="cancel")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+async def read_attachment(msg, user_data, tenant=None) -> bool:
+    """
+    Скачивает PDF/фото и дописывает во временное хранилище:
+    текст — в temp_text, картинки — в blob_store, а в temp_image только ссылки на них.
+    tenant — автопарк: по его категориям проверяется локальный разбор (для альбома не нужен).
+    False — если PDF пустой/нечитаемый.
+    """
+    images = user_data.get('temp_image') or []
+    texts = [user_data['temp_text']] if user_data.get('temp_text') else []
+
+    # Если PDF
+    if msg.document and msg.document.mime_type == 'application/pdf':
+        file = await msg.document.get_file()
+        byte_array = await file.download_as_bytearray()
+        # Читаем PDF сразу (в отдельном процессе).
+        # Скан без текстового слоя придет картинками страниц — пойдет как фото.
+        pdf_content = await extract_pdf_content_async(byte_array)
+        if not pdf_content['text'] and not pdf_content['images']:
+            return False
+        if pdf_content['text']:
+            texts.append(pdf_content['text'])
+        for page_image in pdf_content['images']:
+            images.append(await blob_store.put(page_image))
+        # Известный шаблон (брокер/топливная карта) разбираем локально, без модели.
+        # Для альбома не годится — там несколько документов в одной задаче.
+        if pdf_content['text'] and not msg.media_group_id:
+            user_data['local_result'] = await parse_known_layout_async(
+                byte_array, pdf_content['text'], tenant.categories if tenant else None
+            )
+        
+    # Если ФОТО
+    elif msg.photo:
+        file = await msg.photo[-1].get_file()
+        image_bytes = await file.download_as_bytearray()
+        images.append(await blob_store.put(image_bytes))
+
+    # Не забываем про подпись (Caption)
+    if msg.caption:
+        texts.append(msg.caption)
+
+    user_data['temp_text'] = "\n\n".join(texts)
+    user_data['temp_image'] = images or None
+    user_data['album_count'] = user_data.get('album_count', 0) + 1
+    return True
+
+async def collect_album_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Следующие части альбома, пока ждем выбора типа документа."""
+    msg = update.message
+    if not msg.media_group_id or msg.media_group_id != context.user_data.get('album_id'):
+        return None
+    # Окно альбома считаем от прихода части, а не от конца ее загрузки
+    context.user_data['album_last'] = time.monotonic()
+    context.user_data['album_reading'] = True
+    try:
+        if not await read_attachment(msg, context.user_data):
+            logging.warning(f"Album {msg.media_group_id}: unreadable PDF skipped")
+    except Exception as e:
+        logging.error(f"Album Upload Error: {e}")
+    finally:
+        context.user_data['album_reading'] = False
+    return None
+
+async def ask_album_doc_type(status_msg, user_data, album_id):
+    """Ждет, пока альбом перестанет пополняться (ALBUM_WINDOW), и показывает одни кнопки на всё."""
+    while True:
+        wait = user_data.get('album_last', 0) + ALBUM_WINDOW - time.monotonic()
+        # Часть альбома еще качается — ее не считаем, ждем конца загрузки
+        if wait <= 0 and user_data.get('album_reading'):
+            wait = 0.2
+        if wait <= 0:
+            break
+        await asyncio.sleep(wait)
+
+    # Пользователь уже начал что-то другое
+    if user_data.get('album_id') != album_id:
+        return
+    try:
+        await status_msg.edit_text(
+            f"📂 Альбом: {user_data.get('album_count', 0)} файл(ов). Что это за документы?",
+            reply_markup=doc_type_keyboard()
+        )
+    except Exception as e:
+        logging.error(f"Album prompt error: {e}")
+
 async def doc_type_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает нажатие кнопок"""
     query = update.callback_query
     await query.answer()
+    tenant = await check_auth(update)
+    if not tenant:
+        return ConversationHandler.END
     
     choice = query.data
     
@@ -140,14 +233,24 @@ async def doc_type_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Достаем данные из памяти
     text_content = context.user_data.get('temp_text')
-    image_bytes = context.user_data.get('temp_image')
+    image_refs = context.user_data.get('temp_image') or []
+    image_bytes = [img for img in [await blob_store.get(ref) for ref in image_refs] if img]
+    if image_refs and not image_bytes:
+        await query.message.reply_text("⌛ Файл устарел, пришли его заново.")
+        context.user_data.clear()
+        return ConversationHandler.END
+    
+    # Если документ уже разобран локальным шаблоном того же типа — AI не нужен
+    local = context.user_data.get('local_result')
+    precomputed = local[1] if local and local[0] == doc_type else None
     
     # Запускаем анализ
-    return await run_ai_analysis(update, context, None, text_content, image_bytes, doc_type, is_callback=True)
+    return await run_ai_analysis(update, context, None, text_content, image_bytes or None, doc_type, is_callback=True, precomputed=precomputed, tenant=tenant)
 
-async def run_ai_analysis(update, context, status_msg, text=None, image_bytes=None, doc_type="general", is_callback=False):
+async def run_ai_analysis(update, context, status_msg, text=None, image_bytes=None, doc_type="general", is_callback=False, precomputed=None, tenant=None):
     """
     Общая функция логики AI и сохранения.
+    tenant — автопарк пользователя: категории, квоты и лист для записи.
     """
     if is_callback:
         effective_message = update.callback_query.message
@@ -155,11 +258,18 @@ async def run_ai_analysis(update, context, status_msg, text=None, image_bytes=No
         effective_message = update.message
 
     try:
-        # 1. Запрос к AI с нужным PROMPT (doc_type)
-        result = await analyze_content(text, image_bytes, doc_type=doc_type)
+        # 1. Запрос к AI с нужным PROMPT (doc_type), если нет локального результата.
+        # Пока модель пишет ответ, показываем найденные позиции в статусе
+        progress = StatusProgress(effective_message if is_callback else status_msg, STATUS_EDIT_INTERVAL)
+        try:
+            result = precomputed or await analyze_content(
+                text, image_bytes, doc_type=doc_type, on_progress=progress, tenant=tenant
+            )
+        finally:
+            await progress.close()
         
         # Если ничего не нашли
-        if not result or not result.get("items"):
+        if not result or not result.items:
             err_text = "🤷‍♂️ AI не смог извлечь данные."
             if is_callback: await effective_message.reply_text(err_text)
             else: await status_msg.edit_text(err_text)
@@ -169,11 +279,11 @@ async def run_ai_analysis(update, context, status_msg, text=None, image_bytes=No
         context.user_data['pending_transaction'] = result
         
         # Считаем сумму для красоты
-        total_amount = sum(item['amount'] for item in result['items'])
-        count_items = len(result['items'])
+        total_amount = result.total
+        count_items = len(result.items)
         
         # 3. Проверяем Дату
-        if not result.get("date"):
+        if not result.date:
             # Если даты нет, просим ввести
             ask_text = f"💰 Нашел {count_items} поз. на ${total_amount:.2f}.\n📅 Даты нет в документе (или я тупой). Введи дату (MM.DD):"
             
@@ -186,7 +296,7 @@ async def run_ai_analysis(update, context, status_msg, text=None, image_bytes=No
             return WAITING_FOR_DATE
         
         # 4. Если дата есть — сохраняем
-        await execute_save(effective_message, context, result['date'])
+        await execute_save(effective_message, context, result.date, tenant)
         return ConversationHandler.END
 
     except Exception as e:
@@ -197,17 +307,20 @@ async def run_ai_analysis(update, context, status_msg, text=None, image_bytes=No
 
 async def ask_date_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Если юзер вводит дату вручную"""
+    tenant = await check_auth(update)
+    if not tenant:
+        return ConversationHandler.END
     date_text = update.message.text
     # Пытаемся распарсить дату через наш сервис
     parsed_date = parse_date(date_text)
     date_str = parsed_date.strftime("%m.%d.%Y")
     
     # Сохраняем
-    await execute_save(update.message, context, date_str)
+    await execute_save(update.message, context, date_str, tenant)
     return ConversationHandler.END
 
-async def execute_save(message, context, date_str):
-    """Финальная запись в Google Sheets"""
+async def execute_save(message, context, date_str, tenant):
+    """Финальная запись в Google Sheets (лист автопарка tenant)"""
     data = context.user_data.get('pending_transaction')
     
     try:
@@ -215,32 +328,30 @@ async def execute_save(message, context, date_str):
         d_obj = parse_date(date_str)
         week_range = get_week_range(d_obj)
         
-        # 2. Ищем строку
-        ws = get_worksheet()
-        row = find_row_by_week(ws, week_range)
-        
-        if not row:
-            await message.reply_text(f"❌ Неделя {week_range} не найдена в таблице.")
-            return
-
+        # 2. Собираем позиции по колонкам (Transaction уже проверил суммы и категории)
+        entries = data.entries(tenant.categories)
         report_lines = []
-        items = data.get('items', [])
+        for item in data.items:
+            if item.amount > 0:
+                line = f"✅ {item.category.upper()}: ${item.amount} ({item.description})"
+                if item.unknown_category:
+                    line += f" ⚠️ категория «{item.unknown_category}» не из списка"
+                report_lines.append(line)
         
-        # 3. Записываем каждую позицию
-        for item in items:
-            cat = item.get('category', 'other')
-            amt = item.get('amount', 0.0)
-            desc = item.get('description', 'Bot')
-            
-            if amt > 0:
-                # Маппинг колонки
-                col = CATEGORIES_MAP.get(cat, CATEGORIES_MAP['other'])
-                # Обновление
-                old, new = update_cell_with_note(ws, row, col, amt, desc)
-                report_lines.append(f"✅ {cat.upper()}: ${amt} ({desc})")
+        # 3. Журнал включен — отвечаем сразу, в таблицу позиции допишет фоновый флашер.
+        # Иначе ищем строку и пишем все позиции одним запросом.
+        if entries and journal_flusher:
+            await journal_flusher.submit(week_range, entries, message.chat_id, tenant.id)
+        elif entries:
+            saved = await save_week_items_async(week_range, entries, tenant)
+            if not saved:
+                await message.reply_text(f"❌ Неделя {week_range} не найдена в таблице.")
+                return
         
         # Отчет
         if report_lines:
+            if data.rejected:
+                report_lines.append(f"⚠️ Пропущено позиций без суммы: {data.rejected}")
             await message.reply_text(
                 f"📅 Неделя: {week_range}\n" + "\n".join(report_lines)
             )
@@ -258,25 +369,87 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Отмена.")
     return ConversationHandler.END
 
-if __name__ == '__main__':
-    application = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+async def on_startup(application):
+    # Позиции, не записанные до прошлой остановки, уходят в таблицу сразу после старта
+    if journal_flusher:
+        journal_flusher.journal.purge(SAVE_JOURNAL_KEEP_DAYS)
+        journal_flusher.start()
+
+async def on_shutdown(application):
+    if journal_flusher:
+        await journal_flusher.drain(SAVE_JOURNAL_DRAIN_TIMEOUT)
+    shutdown_pools()
+
+async def warm_up():
+    """
+    Прогрев после того, как webhook уже слушает порт (не задерживает старт):
+    импорт openai + клиент, авторизация в Sheets и копия листа, процессы пула с pdfplumber.
+    """
+    started = time.perf_counter()
+    steps = {
+        "openai": asyncio.to_thread(get_client),
+        # Один автопарк — сразу его копия листа; несколько — только авторизация, листы откроются по запросу
+        "sheets": sheets_pool.run(prepare_client) if MULTI_TENANT else get_replica_async(),
+        "pdf_pool": asyncio.gather(*(pdf_pool.run(preload_worker) for _ in range(PDF_WORKERS))),
+    }
+    results = await asyncio.gather(*steps.values(), return_exceptions=True)
+    for name, result in zip(steps, results):
+        if isinstance(result, Exception):
+            logging.warning(f"Warm-up {name} failed: {result}")
+    logging.info(f"Warm-up done in {time.perf_counter() - started:.2f}s")
+
+def build_application(builder=None):
+    """
+    Собирает Application со всеми хендлерами.
+    builder — готовый ApplicationBuilder с токеном (bench/ подставляет фейковый Bot API).
+    """
+    builder = (
+        (builder or ApplicationBuilder().token(TELEGRAM_TOKEN))
+        .concurrent_updates(PerChatUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    # Диалоги переживают рестарт/масштабирование, если задан PERSISTENCE_URL
+    persistence = build_persistence()
+    if persistence:
+        builder = builder.persistence(persistence)
+    application = builder.build()
+    if journal_flusher:
+        # Неделю не нашли уже после ответа пользователю — сообщаем отдельным сообщением
+        journal_flusher.notify = application.bot.send_message
     
-    # Обработчик диалога
-    conv_handler = ConversationHandler(
+    # Обработчик диалога: состояние — в общем хранилище, если задан PERSISTENCE_URL
+    conv_handler = SharedConversationHandler(
         entry_points=[
             # Ловим Фото, PDF, Голос, Текст
             MessageHandler(filters.PHOTO | filters.Document.PDF | filters.VOICE | filters.TEXT & ~filters.COMMAND, process_input)
         ],
         states={
-            WAITING_FOR_DOC_TYPE: [CallbackQueryHandler(doc_type_callback)],
+            WAITING_FOR_DOC_TYPE: [
+                CallbackQueryHandler(doc_type_callback),
+                # Остальные фото/файлы альбома
+                MessageHandler(filters.PHOTO | filters.Document.PDF, collect_album_item),
+            ],
             WAITING_FOR_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_date_handler)],
         },
-        fallbacks=[CommandHandler("cancel", cancel)]
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="finbot",
+        persistent=persistence is not None,
     )
 
+    if persistence:
+        # До всех хендлеров: состояние диалога могли сменить на другом инстансе
+        application.add_handler(TypeHandler(Update, conv_handler.refresh), group=-1)
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("week", week_command))
+    application.add_handler(CommandHandler("month", month_command))
+    application.add_handler(CommandHandler("summary", summary_command))
     application.add_handler(conv_handler)
-    
+    return application
+
+if __name__ == '__main__':
+    application = build_application()
+
     # --- ЗАПУСК ДЛЯ CLOUD RUN ---
     PORT = os.environ.get("PORT")
     WEBHOOK_URL = os.environ.get("WEBHOOK_URL") 
@@ -284,12 +457,15 @@ if __name__ == '__main__':
     if PORT and WEBHOOK_URL:
         # Если есть PORT и URL (в облаке)
         print(f"🚀 Starting Webhook on port {PORT}...")
-        application.run_webhook(
+        # Свой сервер на tornado: webhook + /metrics на одном порту
+        asyncio.run(serve_webhook(
+            application,
             listen="0.0.0.0",
             port=int(PORT),
             url_path=TELEGRAM_TOKEN,
-            webhook_url=f"{WEBHOOK_URL}/{TELEGRAM_TOKEN}"
-        )
+            webhook_url=f"{WEBHOOK_URL}/{TELEGRAM_TOKEN}",
+            warm_up=warm_up if WARMUP else None,
+        ))
     else:
         # Если нет (локально)
         print("🐢 Starting Polling (Local Mode)...")
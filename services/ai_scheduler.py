@@ -0,0 +1,188 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import re
+
+# --- Приоритеты: меньше = раньше ---
+PRIORITY_INTERACTIVE = 0   # текст/голос/чеки от водителя — он ждет ответа
+PRIORITY_BULK = 1          # стейтменты и топливные отчеты
+
+def _is_retryable(e) -> bool:
+    # openai грузится лениво (холодный старт): к моменту ошибки он уже импортирован клиентом
+    import openai
+    return isinstance(e, (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+        asyncio.TimeoutError,
+    ))
+
+def _is_rate_limit(e) -> bool:
+    import openai
+    return isinstance(e, openai.RateLimitError)
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def parse_reset(value) -> float:
+    """'6m0s' / '1.5s' / '20ms' из x-ratelimit-reset-* -> секунды."""
+    if not value:
+        return 0.0
+    return sum(float(num) * _UNITS[unit] for num, unit in _DURATION_RE.findall(str(value)))
+
+def _retry_after(e) -> float:
+    """Сколько сервер просит подождать (retry-after / retry-after-ms), 0 — не просит."""
+    response = getattr(e, "response", None)
+    if response is None:
+        return 0.0
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return parse_reset(headers.get("x-ratelimit-reset-requests"))
+
+class AIScheduler:
+    """
+    Планировщик запросов к OpenAI:
+    - не больше max_concurrency запросов одновременно, очередь с приоритетами;
+    - учет лимитов из заголовков x-ratelimit-* (если квота кончилась — ждем сброса);
+    - таймаут на каждый вызов и повторы с экспоненциальной задержкой и джиттером;
+    - квота арендатора (tenant_budget) берется до общего слота: упершийся в свою квоту
+      автопарк ждет, не занимая общих слотов.
+    """
+
+    def __init__(self, max_concurrency: int, timeout: float, max_retries: int,
+                 backoff_base: float, backoff_max: float, token_reserve: int, tenant_budget=None):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.token_reserve = token_reserve
+        self.tenant_budget = tenant_budget
+
+        self._free = max_concurrency
+        self._waiters = []               # heap: (priority, seq, future)
+        self._seq = itertools.count()
+        self._blocked_until = 0.0        # loop.time(), до которого квота исчерпана
+
+        # --- Метрики ---
+        self.remaining_requests = None
+        self.remaining_tokens = None
+        self.retries = 0
+        self.failures = 0
+
+    # --- Слоты с приоритетом ---
+
+    async def _acquire(self, priority: int):
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # Слот успели отдать, а нас отменили — возвращаем его следующему
+            if fut.done() and not fut.cancelled():
+                self._release()
+            raise
+
+    def _release(self):
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._free += 1
+
+    # --- Учет квоты по заголовкам ---
+
+    def _update_limits(self, headers):
+        loop = asyncio.get_running_loop()
+        try:
+            if headers.get("x-ratelimit-remaining-requests") is not None:
+                self.remaining_requests = int(headers["x-ratelimit-remaining-requests"])
+            if headers.get("x-ratelimit-remaining-tokens") is not None:
+                self.remaining_tokens = int(headers["x-ratelimit-remaining-tokens"])
+        except ValueError:
+            return
+
+        wait = 0.0
+        if self.remaining_requests is not None and self.remaining_requests <= 0:
+            wait = max(wait, parse_reset(headers.get("x-ratelimit-reset-requests")))
+        if self.remaining_tokens is not None and self.remaining_tokens < self.token_reserve:
+            wait = max(wait, parse_reset(headers.get("x-ratelimit-reset-tokens")))
+        if wait:
+            self._blocked_until = max(self._blocked_until, loop.time() + wait)
+
+    async def _wait_for_budget(self):
+        delay = self._blocked_until - asyncio.get_running_loop().time()
+        if delay > 0:
+            logging.info(f"OpenAI quota exhausted, waiting {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    # --- Вызов ---
+
+    async def call(self, request, priority: int = PRIORITY_INTERACTIVE, consume=None, tenant=None):
+        """
+        request: функция без аргументов, возвращающая корутину with_raw_response.create(...).
+        Возвращает распарсенный ответ (raw.parse()).
+        consume: async-функция для потокового ответа — дочитывается, пока слот занят,
+        и ее результат возвращается вместо самого потока.
+        tenant: id автопарка — вызов идет в счет его квоты (вместе с повторами).
+        """
+        if self.tenant_budget is None or tenant is None:
+            return await self._call(request, priority, consume)
+        async with self.tenant_budget.slot(tenant):
+            return await self._call(request, priority, consume)
+
+    async def _call(self, request, priority: int, consume):
+        attempt = 0
+        while True:
+            await self._acquire(priority)
+            try:
+                await self._wait_for_budget()
+                raw = await asyncio.wait_for(request(), self.timeout)
+                self._update_limits(raw.headers)
+                if consume is None:
+                    return raw.parse()
+                return await asyncio.wait_for(consume(raw.parse()), self.timeout)
+            except Exception as e:
+                if not _is_retryable(e):
+                    raise
+                if attempt >= self.max_retries:
+                    self.failures += 1
+                    raise
+                delay = max(_retry_after(e), self._backoff(attempt))
+                if _is_rate_limit(e):
+                    # 429 — вся очередь упирается в ту же квоту
+                    loop = asyncio.get_running_loop()
+                    self._blocked_until = max(self._blocked_until, loop.time() + delay)
+                logging.warning(f"OpenAI retry {attempt + 1}/{self.max_retries} in {delay:.1f}s: {e!r}")
+            finally:
+                self._release()
+
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.max_concurrency - self._free,
+            "queued": len(self._waiters),
+            "remaining_requests": self.remaining_requests,
+            "remaining_tokens": self.remaining_tokens,
+            "retries": self.retries,
+            "failures": self.failures,
+        }
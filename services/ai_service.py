@@ -1,18 +1,70 @@
 import base64
 import json
-from openai import AsyncOpenAI
-from config import OPENAI_API_KEY, CATEGORIES_MAP
+import logging
+import threading
+import time
+from functools import lru_cache
+from config import (
+    OPENAI_API_KEY, CATEGORIES_MAP, AI_CACHE_PATH, AI_CACHE_MAX_MB,
+    OPENAI_MAX_CONCURRENCY, OPENAI_TIMEOUT, OPENAI_MAX_RETRIES,
+    OPENAI_BACKOFF_BASE, OPENAI_BACKOFF_MAX, OPENAI_TOKEN_RESERVE, AI_STREAMING,
+    OPENAI_PRICE_INPUT, OPENAI_PRICE_OUTPUT, PROMPT_MAX_TOKENS, PROMPT_SECTION_FILTER,
+    VOICE_PREPROCESS, VOICE_PREPROCESS_MIN_SEC,
+)
+from services.result_cache import ResultCache, make_cache_key
+from services.image_processor import prepare_image
+from services.audio_processor import prepare_voice
+from services.executor import pdf_pool
+from services.ai_scheduler import AIScheduler, PRIORITY_INTERACTIVE, PRIORITY_BULK
+from services.metrics import timed, AI_TOKENS, AI_CALL_LATENCY, AI_COST, register_collector
+from services.json_stream import ItemStreamParser, SchemaError
+from services.models import Transaction
+from services.prompt_budget import prepare_document_text, estimate_tokens
+from services.tenants import openai_budget
 
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+# Клиент создается при первом запросе: импорт openai — заметная часть холодного старта
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import AsyncOpenAI
+            # Повторы делает планировщик, встроенные ретраи клиента отключены
+            _client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+        return _client
+
+scheduler = AIScheduler(
+    max_concurrency=OPENAI_MAX_CONCURRENCY,
+    timeout=OPENAI_TIMEOUT,
+    max_retries=OPENAI_MAX_RETRIES,
+    backoff_base=OPENAI_BACKOFF_BASE,
+    backoff_max=OPENAI_BACKOFF_MAX,
+    token_reserve=OPENAI_TOKEN_RESERVE,
+    tenant_budget=openai_budget,
+)
+
+# Версия промптов/модели: при изменении старые записи кэша перестают совпадать
+PROMPT_VERSION = "2"
+
+result_cache = ResultCache(AI_CACHE_PATH, AI_CACHE_MAX_MB * 1024 * 1024) if AI_CACHE_PATH else None
+
+# Список категорий для промптов — одной строкой, без питоновского repr списка
+_CATEGORY_LIST = ", ".join(CATEGORIES_MAP)
+
+def _compact(prompt: str) -> str:
+    """Без пустых краев и хвостовых пробелов в строках — лишние токены на каждый запрос."""
+    return "\n".join(line.rstrip() for line in prompt.strip().splitlines())
 
 # ==============================================================================
 # 1. ПРОМПТ ДЛЯ СТЕЙТМЕНТОВ (Логика сохранена + добавлено правило null)
 # ==============================================================================
-PROMPT_STATEMENT = f"""
+PROMPT_STATEMENT = _compact(f"""
 Ты — профессиональный бухгалтер для траковой компании.
 Твоя задача: проанализировать Driver Settlement (Зарплатный лист) и извлечь транзакции.
 
-ДОСТУПНЫЕ КАТЕГОРИИ: {list(CATEGORIES_MAP.keys())}
+ДОСТУПНЫЕ КАТЕГОРИИ: {_CATEGORY_LIST}
 
 ПРАВИЛА АНАЛИЗА (СТРОГО):
 
@@ -41,15 +93,15 @@ PROMPT_STATEMENT = f"""
 
 ФОРМАТ ОТВЕТА (JSON):
 {{ "date": "MM.DD.YYYY" или null, "items": [ {{ "category": "...", "amount": 0.0, "description": "..." }} ] }}
-"""
+""")
 
 # ==============================================================================
 # 2. ПРОМПТ ДЛЯ ТОПЛИВА (Логика сохранена + добавлено правило null)
 # ==============================================================================
-PROMPT_FUEL = f"""
+PROMPT_FUEL = _compact(f"""
 Ты — бухгалтер по топливу. Анализируешь топливные отчеты или чеки.
 
-ДОСТУПНЫЕ КАТЕГОРИИ: {list(CATEGORIES_MAP.keys())}
+ДОСТУПНЫЕ КАТЕГОРИИ: {_CATEGORY_LIST}
 
 ПРАВИЛА:
 1. ДАТА - ФОРМАТ MM.DD.YYYY:
@@ -65,15 +117,15 @@ PROMPT_FUEL = f"""
 
 ФОРМАТ ОТВЕТА (JSON):
 {{ "date": "MM.DD.YYYY" или null, "items": [ {{ "category": "fuel", "amount": 0.0, "description": "..." }} ] }}
-"""
+""")
 
 # ==============================================================================
 # 3. ПРОМПТ ОБЩИЙ (Здесь главное изменение для голосовых)
 # ==============================================================================
-PROMPT_GENERAL = f"""
+PROMPT_GENERAL = _compact(f"""
 Ты — бухгалтер. Анализируешь чеки (Receipts), инвойсы, фото и ТЕКСТОВЫЕ/ГОЛОСОВЫЕ заметки.
 
-ДОСТУПНЫЕ КАТЕГОРИИ: {list(CATEGORIES_MAP.keys())}
+ДОСТУПНЫЕ КАТЕГОРИИ: {_CATEGORY_LIST}
 
 ПРАВИЛА:
 1. ДАТА (DATE):
@@ -89,15 +141,115 @@ PROMPT_GENERAL = f"""
 
 ФОРМАТ ОТВЕТА (JSON):
 {{ "date": "MM.DD.YYYY" или null, "items": [ {{ "category": "...", "amount": 0.0, "description": "..." }} ] }}
-"""
+""")
+
+_PROMPTS = {"statement": PROMPT_STATEMENT, "fuel": PROMPT_FUEL, "general": PROMPT_GENERAL}
+
+@lru_cache(maxsize=256)
+def _system_prompt(doc_type: str, category_list: str) -> str:
+    """Промпт под doc_type со списком категорий автопарка (у большинства — общий список)."""
+    prompt = _PROMPTS.get(doc_type, PROMPT_GENERAL)
+    if category_list == _CATEGORY_LIST:
+        return prompt
+    return prompt.replace(f"ДОСТУПНЫЕ КАТЕГОРИИ: {_CATEGORY_LIST}", f"ДОСТУПНЫЕ КАТЕГОРИИ: {category_list}")
+
+def _record_usage(usage, doc_type: str, seconds: float):
+    """Токены, стоимость и задержка (с очередью и повторами) одного вызова модели — по doc_type."""
+    AI_CALL_LATENCY.observe(seconds, doc_type=doc_type)
+    # В потоке usage приходит словарем (поле вне схемы chunk в этой версии openai)
+    if not usage:
+        return
+    if isinstance(usage, dict):
+        prompt, completion = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    else:
+        prompt, completion = usage.prompt_tokens, usage.completion_tokens
+    cost = (prompt * OPENAI_PRICE_INPUT + completion * OPENAI_PRICE_OUTPUT) / 1_000_000
+    AI_TOKENS.inc(prompt, doc_type=doc_type, kind="prompt")
+    AI_TOKENS.inc(completion, doc_type=doc_type, kind="completion")
+    AI_COST.inc(cost, doc_type=doc_type)
+    logging.info(f"AI call ({doc_type}): {prompt} prompt + {completion} completion tokens, ${cost:.4f}, {seconds:.2f}s")
+
+def _create_completion(messages, **kwargs):
+    return get_client().chat.completions.with_raw_response.create(
+        model="gpt-4o",
+        messages=messages,
+        response_format={"type": "json_object"},
+        temperature=0.1,
+        **kwargs,
+    )
+
+async def _complete(messages, doc_type: str, priority: int, tenant_id=None) -> dict:
+    started = time.perf_counter()
+    response = await scheduler.call(lambda: _create_completion(messages), priority=priority, tenant=tenant_id)
+    _record_usage(response.usage, doc_type, time.perf_counter() - started)
+    return json.loads(response.choices[0].message.content)
+
+async def _complete_streaming(messages, doc_type: str, priority: int, on_progress=None, tenant_id=None) -> dict:
+    """
+    Потоковый ответ: позиции разбираются по мере прихода, on_progress(items) зовется на каждую новую.
+    Ответ не по схеме — SchemaError сразу, поток закрывается, не дожидаясь конца генерации.
+    """
+    started = time.perf_counter()
 
-async def analyze_content(text: str = None, image_bytes: bytes = None, doc_type: str = "general"):
-    if doc_type == "statement":
-        system_prompt = PROMPT_STATEMENT
-    elif doc_type == "fuel":
-        system_prompt = PROMPT_FUEL
+    async def consume(stream):
+        parser = ItemStreamParser()  # новый на каждую попытку планировщика
+        usage = None
+        try:
+            async for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta and parser.feed(delta) and on_progress:
+                    await on_progress(parser.items)
+        finally:
+            await stream.close()
+        _record_usage(usage, doc_type, time.perf_counter() - started)
+        return parser.result()
+
+    return await scheduler.call(
+        lambda: _create_completion(messages, stream=True, extra_body={"stream_options": {"include_usage": True}}),
+        priority=priority,
+        consume=consume,
+        tenant=tenant_id,
+    )
+
+@timed("analyze_content")
+async def analyze_content(text: str = None, image_bytes=None, doc_type: str = "general", priority: int = None,
+                          on_progress=None, tenant=None):
+    """
+    image_bytes — одна картинка или список (страницы скана, альбом).
+    on_progress(items) — async-колбэк с уже пришедшими позициями (в потоковом режиме).
+    tenant — автопарк: его категории в промпте и его квота OpenAI.
+    Возвращает Transaction с позициями или None.
+    """
+    categories = tenant.categories if tenant else CATEGORIES_MAP
+    tenant_id = tenant.id if tenant else None
+    category_list = ", ".join(categories)
+    system_prompt = _system_prompt(doc_type, category_list)
+
+    # Стейтменты и топливо — тяжелые пакетные документы, пропускаем вперед живые сообщения
+    if priority is None:
+        priority = PRIORITY_BULK if doc_type in ("statement", "fuel") else PRIORITY_INTERACTIVE
+
+    if isinstance(image_bytes, (list, tuple)):
+        images = [img for img in image_bytes if img]
     else:
-        system_prompt = PROMPT_GENERAL
+        images = [image_bytes] if image_bytes else []
+
+    # Из длинного документа — только нужные разделы и не больше потолка токенов
+    if text:
+        doc_budget = max(PROMPT_MAX_TOKENS - estimate_tokens(system_prompt), 500) if PROMPT_MAX_TOKENS else 0
+        text = prepare_document_text(text, doc_type, doc_budget, PROMPT_SECTION_FILTER)
+
+    # Тот же документ уже разбирали — отвечаем из кэша
+    # Свой список категорий — свой ответ модели; общий список ключ не меняет
+    scope = () if category_list == _CATEGORY_LIST else (category_list,)
+    cache_key = make_cache_key(doc_type, PROMPT_VERSION, *scope, text, *images)
+    if result_cache:
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return Transaction.from_dict(cached, categories)
 
     messages = [{"role": "system", "content": system_prompt}]
     
@@ -105,11 +257,19 @@ async def analyze_content(text: str = None, image_bytes: bytes = None, doc_type:
     if text:
         user_content.append({"type": "text", "text": f"Данные:\n{text}"})
         
-    if image_bytes:
-        b64_image = base64.b64encode(image_bytes).decode('utf-8')
+    for image in images:
+        # Поворот/уменьшение/пережатие — CPU, гоняем в том же пуле процессов, что и PDF
+        image, mime, stats = await pdf_pool.run(prepare_image, bytes(image))
+        if stats:
+            logging.info(
+                f"Image prepared: {stats['original_bytes']} -> {stats['bytes']} bytes "
+                f"(-{stats['saved_bytes']}), ~{stats['original_tokens']} -> {stats['tokens']} tokens "
+                f"(-{stats['saved_tokens']})"
+            )
+        b64_image = base64.b64encode(image).decode('utf-8')
         user_content.append({
             "type": "image_url",
-            "image_url": {"url": f"data:image/jpeg;base64,{b64_image}"}
+            "image_url": {"url": f"data:{mime};base64,{b64_image}"}
         })
         
     if not user_content:
@@ -118,21 +278,72 @@ async def analyze_content(text: str = None, image_bytes: bytes = None, doc_type:
     messages.append({"role": "user", "content": user_content})
     
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            response_format={"type": "json_object"},
-            temperature=0.1
-        )
-        return json.loads(response.choices[0].message.content)
+        result = None
+        if AI_STREAMING:
+            try:
+                result = await _complete_streaming(messages, doc_type, priority, on_progress, tenant_id)
+            except SchemaError as e:
+                # Модель понесло — сразу переспрашиваем обычным запросом
+                logging.warning(f"AI stream aborted ({doc_type}): {e}")
+            except Exception as e:
+                logging.warning(f"AI stream failed ({doc_type}), fallback to non-streaming: {e}")
+        if result is None:
+            result = await _complete(messages, doc_type, priority, tenant_id)
+        transaction = Transaction.from_result(result, doc_type, categories)
+        if transaction.rejected:
+            logging.warning(f"AI returned {transaction.rejected} invalid item(s) ({doc_type})")
+        if not transaction.items:
+            return None
+        if result_cache:
+            result_cache.put(cache_key, transaction.to_dict())
+        return transaction
     except Exception as e:
-        print(f"AI Error: {e}")
+        logging.error(f"AI Error: {e}")
         return None
 
-async def transcribe_audio(file_path):
-    with open(file_path, "rb") as audio:
-        transcript = await client.audio.transcriptions.create(
+def get_cached_transcript(file_unique_id: str):
+    """Голосовое с тем же file_unique_id уже распознавали — вернем текст без загрузки."""
+    if not result_cache or not file_unique_id:
+        return None
+    cached = result_cache.get(make_cache_key("voice", file_unique_id))
+    return cached.get("text") if cached else None
+
+@timed("transcribe_audio")
+async def transcribe_audio(audio, file_unique_id: str = None, filename: str = "voice.ogg", tenant=None,
+                           duration: int = None):
+    """
+    Распознает голос целиком в памяти.
+    audio — bytes/bytearray или файловый объект.
+    duration — длительность в секундах (из Telegram), если известна.
+    tenant — автопарк, в счет квоты которого идет вызов.
+    """
+    if hasattr(audio, "read"):
+        audio = audio.read()
+    audio = bytes(audio)
+
+    # Обрезка тишины/даунсемплинг — ffmpeg, гоняем в пуле процессов.
+    # Короткие заметки (по длительности от Telegram) в пул не отправляем: ждали бы за PDF
+    if VOICE_PREPROCESS and (duration is None or duration >= VOICE_PREPROCESS_MIN_SEC):
+        audio, filename = await pdf_pool.run(prepare_voice, audio, filename)
+
+    transcript = await scheduler.call(
+        lambda: get_client().audio.transcriptions.with_raw_response.create(
             model="whisper-1", 
-            file=audio
-        )
+            file=(filename, audio)
+        ),
+        priority=PRIORITY_INTERACTIVE,
+        tenant=tenant.id if tenant else None,
+    )
+
+    if result_cache and file_unique_id and transcript.text:
+        result_cache.put(make_cache_key("voice", file_unique_id), {"text": transcript.text})
     return transcript.text
+
+@register_collector
+def _collect_ai_metrics():
+    for key, value in scheduler.stats().items():
+        yield f"finbot_openai_{key}", value, {}
+    if result_cache:
+        stats = result_cache.stats()
+        yield "finbot_ai_cache_hits_total", stats["hits"], {}
+        yield "finbot_ai_cache_misses_total", stats["misses"], {}
@@ -0,0 +1,43 @@
+import io
+import logging
+from config import VOICE_PREPROCESS, VOICE_PREPROCESS_MIN_SEC, VOICE_SILENCE_DB, VOICE_SAMPLE_RATE
+
+def prepare_voice(audio_bytes: bytes, filename: str = "voice.ogg"):
+    """
+    Ужимает голосовое перед Whisper (нужен ffmpeg):
+    обрезает тишину в начале/конце, моно, понижает частоту до VOICE_SAMPLE_RATE.
+    Короткие заметки не трогаем — выигрыш меньше, чем стоимость перекодирования.
+    Возвращает (bytes, filename).
+    """
+    if not VOICE_PREPROCESS:
+        return audio_bytes, filename
+    try:
+        # pydub нужен только воркеру пула — основной процесс его не грузит
+        from pydub import AudioSegment
+        from pydub.silence import detect_leading_silence
+
+        seg = AudioSegment.from_file(io.BytesIO(audio_bytes))
+        if len(seg) < VOICE_PREPROCESS_MIN_SEC * 1000:
+            return audio_bytes, filename
+
+        start = detect_leading_silence(seg, silence_threshold=VOICE_SILENCE_DB)
+        end = detect_leading_silence(seg.reverse(), silence_threshold=VOICE_SILENCE_DB)
+        trimmed = seg[start:max(start, len(seg) - end)]
+        if not len(trimmed):
+            return audio_bytes, filename
+
+        trimmed = trimmed.set_channels(1).set_frame_rate(VOICE_SAMPLE_RATE)
+        out = io.BytesIO()
+        trimmed.export(out, format="ogg", codec="libopus", bitrate="24k")
+        new_bytes = out.getvalue()
+    except Exception as e:
+        logging.warning(f"Voice preprocessing skipped: {e}")
+        return audio_bytes, filename
+
+    if len(new_bytes) >= len(audio_bytes):
+        return audio_bytes, filename
+    logging.info(
+        f"Voice prepared: {len(seg) / 1000:.1f}s -> {len(trimmed) / 1000:.1f}s, "
+        f"{len(audio_bytes)} -> {len(new_bytes)} bytes"
+    )
+    return new_bytes, "voice.ogg"
@@ -1,4 +1,5 @@
 from datetime import date, timedelta, datetime
+from functools import lru_cache
 import re
 
 # === НАСТРОЙКА ВРЕМЕНИ (US TIME) ===
@@ -10,90 +11,120 @@ def get_current_date_us():
     """Возвращает текущую дату США (с учетом сдвига), а не UTC."""
     return (datetime.utcnow() + timedelta(hours=TIMEZONE_OFFSET)).date()
 
-def parse_date(date_input: str) -> date:
-    """
-    Парсит дату. 
-    СТРОГИЙ ПРИОРИТЕТ: Американский формат (MM.DD).
-    """
-    today_us = get_current_date_us()
-    
-    if not date_input:
-        return today_us
-    
-    s = str(date_input).strip().lower()
-    
+# Разбор за один проход: регулярки компилируются один раз, вместо перебора strptime-форматов
+_NUMERIC_RE = re.compile(
+    r"(?P<m1>\d{1,2})\.(?P<d1>\d{1,2})(?:\.(?P<y1>\d{4}))?"   # MM.DD[.YYYY]
+    r"|(?P<y2>\d{4})\.(?P<m2>\d{1,2})\.(?P<d2>\d{1,2})"       # YYYY.MM.DD
+)
+_TEXT_RE = re.compile(r"([a-z]+) (\d{1,2})(?: (\d{4}))?")      # Jun 4 [2026]
+_FALLBACK_RE = re.compile(r"(\d{1,2})[\./-](\d{1,2})")
+_NON_DIGITS_RE = re.compile(r"\D")
+
+_MONTHS = {}
+for _i, _name in enumerate(("january", "february", "march", "april", "may", "june", "july",
+                            "august", "september", "october", "november", "december"), 1):
+    _MONTHS[_name] = _MONTHS[_name[:3]] = _i
+
+def _make_date(year, month, day):
+    try:
+        return date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+@lru_cache(maxsize=4096)
+def _parse_date_cached(s: str, today_us: date) -> date:
     # Ключевые слова
-    if s in ["today", "сегодня", "now"]:
+    if s in ("today", "сегодня", "now"):
         return today_us
-    if s in ["yesterday", "вчера"]:
+    if s in ("yesterday", "вчера"):
         return today_us - timedelta(days=1)
-        
+
     # Чистим строку: 08-02 -> 08.02
     s_numeric = s.replace(",", ".").replace("/", ".").replace("-", ".")
-    
-    # === 1. ПОЛНЫЙ ФОРМАТ (MM.DD.YYYY) ===
-    # Сначала проверяем американский формат: Месяц.День.Год
-    full_formats = ["%m.%d.%Y", "%Y.%m.%d"]
-    for fmt in full_formats:
-        try:
-            return datetime.strptime(s_numeric, fmt).date()
-        except ValueError:
-            continue
-
-    # === 2. КОРОТКИЙ ФОРМАТ (MM.DD) ===
-    # ВАЖНО: Приоритет Месяц.День
-    # 08.02 -> Август (08), 2-е число.
-    # 02.08 -> Февраль (02), 8-е число.
-    short_formats = ["%m.%d"]
-    
-    for fmt in short_formats:
-        try:
-            dt = datetime.strptime(s_numeric, fmt)
-            dt = dt.replace(year=today_us.year)
-            return dt.date()
-        except ValueError:
-            continue
-
-    # === 3. ТЕКСТОВЫЙ ФОРМАТ ===
-    # Jun 4 ...
-    s_text = s.replace(",", " ").replace(".", " ").replace("/", " ").replace("-", " ")
-    s_text = " ".join(s_text.split())
-    
-    text_formats = [
-        "%b %d %Y", "%B %d %Y", # Jun 4 2026
-        "%b %d", "%B %d"        # Jun 4
-    ]
-    
-    for fmt in text_formats:
-        try:
-            dt = datetime.strptime(s_text, fmt)
-            if dt.year == 1900:
-                dt = dt.replace(year=today_us.year)
-            return dt.date()
-        except ValueError:
-            continue
-            
+
+    # === 1. ЦИФРОВЫЕ ФОРМАТЫ ===
+    # MM.DD.YYYY и MM.DD (ВАЖНО: приоритет Месяц.День, 08.02 -> Август, 2-е число), затем YYYY.MM.DD
+    parsed = None
+    m = _NUMERIC_RE.fullmatch(s_numeric)
+    if m and m.group("y2"):
+        parsed = _make_date(m.group("y2"), m.group("m2"), m.group("d2"))
+    elif m:
+        parsed = _make_date(m.group("y1") or today_us.year, m.group("m1"), m.group("d1"))
+    else:
+        # === 2. ТЕКСТОВЫЙ ФОРМАТ: Jun 4 2026 / June 4 ===
+        s_text = " ".join(s.replace(",", " ").replace(".", " ").replace("/", " ").replace("-", " ").split())
+        m = _TEXT_RE.fullmatch(s_text)
+        if m and m.group(1) in _MONTHS:
+            parsed = _make_date(m.group(3) or today_us.year, _MONTHS[m.group(1)], m.group(2))
+    if parsed:
+        return parsed
+
     # Fallback: если ничего не подошло, пробуем найти цифры и считаем их MM.DD
-    match = re.search(r"(\d{1,2})[\./-](\d{1,2})", s_numeric)
+    match = _FALLBACK_RE.search(s_numeric)
     if match:
-        try:
-            # Group 1 = Month, Group 2 = Day
-            m, d = int(match.group(1)), int(match.group(2))
-            return date(today_us.year, m, d)
-        except:
-            pass
+        parsed = _make_date(today_us.year, match.group(1), match.group(2))
+        if parsed:
+            return parsed
 
     return today_us
 
-def get_week_range(d: date) -> str:
+def parse_date(date_input: str) -> date:
     """
-    Возвращает диапазон: Понедельник - Воскресенье.
+    Парсит дату. 
+    СТРОГИЙ ПРИОРИТЕТ: Американский формат (MM.DD).
+    Результат кэшируется по (строка, текущая дата США) — "today" завтра даст другой ответ.
     """
-    # d.weekday(): 0=Mon, ... 6=Sun
-    start_date = d - timedelta(days=d.weekday())
+    today_us = get_current_date_us()
+    if not date_input:
+        return today_us
+    return _parse_date_cached(str(date_input).strip().lower(), today_us)
+
+def parse_dates(date_inputs) -> list:
+    """Пакетный parse_date: текущая дата считается один раз на весь список."""
+    today_us = get_current_date_us()
+    return [_parse_date_cached(str(s).strip().lower(), today_us) if s else today_us for s in date_inputs]
+
+@lru_cache(maxsize=1024)
+def _week_range_from_monday(start_date: date) -> str:
     end_date = start_date + timedelta(days=6)
     fmt = "%m.%d.%Y"
     return f"{start_date.strftime(fmt)}-{end_date.strftime(fmt)}"
 
+def get_week_range(d: date) -> str:
+    """
+    Возвращает диапазон: Понедельник - Воскресенье.
+    """
+    # d.weekday(): 0=Mon, ... 6=Sun
+    return _week_range_from_monday(d - timedelta(days=d.weekday()))
+
+def bucket_by_week(values, key=None) -> dict:
+    """
+    Раскладывает значения по неделям: {"MM.DD.YYYY-MM.DD.YYYY": [значения, ...]}.
+    key(значение) -> строка даты (по умолчанию само значение). Порядок внутри недели сохраняется.
+    """
+    values = list(values)
+    dates = parse_dates(values if key is None else map(key, values))
+    buckets = {}
+    for value, d in zip(values, dates):
+        buckets.setdefault(get_week_range(d), []).append(value)
+    return buckets
+
 def normalize_week_string(s: str) -> str:
-    return re.sub(r"\D", "", str(s))
+    return _NON_DIGITS_RE.sub("", str(s))
+
+@lru_cache(maxsize=8192)
+def _week_key_cached(s: str):
+    digits = _NON_DIGITS_RE.sub("", s)
+    # Длинные числа в колонке B — не неделя (и int() на тысячи цифр запрещен)
+    if not digits or len(digits) > 32:
+        return None
+    return int(digits)
+
+def week_key(s) -> int:
+    """
+    Ключ недели для индекса: цифры строки как одно число
+    ("10.12.2026-10.18.2026" -> 1012202610182026). None, если цифр нет.
+    """
+    if s is None:
+        return None
+    return _week_key_cached(str(s))
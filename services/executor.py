@@ -0,0 +1,111 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from config import SHEETS_WORKERS, SHEETS_MAX_PENDING, PDF_WORKERS, PDF_MAX_PENDING
+from services.metrics import register_collector
+
+class AsyncPool:
+    """
+    Ограниченный пул для блокирующей работы из async-хендлеров.
+    - max_workers: сколько задач выполняется одновременно;
+    - max_pending: сколько задач может висеть в пуле (остальные ждут снаружи, не раздувая очередь).
+    """
+
+    def __init__(self, name: str, kind: str, max_workers: int, max_pending: int):
+        self.name = name
+        self.kind = kind  # "thread" | "process"
+        self.max_workers = max_workers
+        self._slots = asyncio.Semaphore(max_pending)
+        self._executor = None
+
+        # --- Метрики ---
+        self.in_flight = 0        # отправлено в пул и еще не завершено
+        self.waiting = 0          # ждут свободного места (backpressure)
+        self.completed = 0
+        self.failed = 0
+        self.max_queue_depth = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                # spawn: не форкаем процесс с живыми потоками и сокетами
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix=self.name
+                )
+        return self._executor
+
+    @property
+    def queue_depth(self) -> int:
+        """Задачи, которые уже в пуле, но ждут свободного воркера."""
+        return max(0, self.in_flight - self.max_workers)
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        call = functools.partial(fn, *args, **kwargs)
+        if self.kind == "thread":
+            # Потоку передаем контекст (trace id в логах gspread-вызовов)
+            call = functools.partial(contextvars.copy_context().run, call)
+        try:
+            return await loop.run_in_executor(self._get_executor(), call)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+# Сетевые вызовы gspread — потоки (GIL отпускается на I/O)
+sheets_pool = AsyncPool("sheets", "thread", SHEETS_WORKERS, SHEETS_MAX_PENDING)
+# Парсинг PDF — CPU, поэтому отдельные процессы
+pdf_pool = AsyncPool("pdf", "process", PDF_WORKERS, PDF_MAX_PENDING)
+
+def pool_stats() -> dict:
+    """Метрики всех пулов: {имя: {in_flight, queue_depth, ...}}."""
+    return {pool.name: pool.stats() for pool in (sheets_pool, pdf_pool)}
+
+@register_collector
+def _collect_pool_metrics():
+    for name, stats in pool_stats().items():
+        for key in ("in_flight", "queue_depth", "waiting", "max_queue_depth"):
+            yield f"finbot_pool_{key}", stats[key], {"pool": name}
+        yield "finbot_pool_completed_total", stats["completed"], {"pool": name}
+        yield "finbot_pool_failed_total", stats["failed"], {"pool": name}
+
+def shutdown_pools():
+    for pool in (sheets_pool, pdf_pool):
+        pool.shutdown()
+    logging.info("Executor pools stopped")
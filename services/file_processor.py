@@ -1,13 +1,198 @@
 import io
-import pdfplumber
+import asyncio
+import logging
+import math
+from config import (
+    PDF_MAX_PAGES, PDF_MAX_CHARS, PDF_PAGES_PER_CHUNK,
+    PDF_SCAN_PAGES, PDF_MIN_TEXT_CHARS, PDF_RENDER_DPI, PDF_MAX_IMAGE_PAGES,
+)
+from services.executor import pdf_pool
+from services.metrics import timed
 
-def extract_text_from_pdf(file_bytes: bytes) -> str:
+# pdfplumber и pdfium нужны только воркерам пула: основной процесс их не импортирует,
+# это заметно ускоряет холодный старт
+
+def _open_pdf(file_bytes: bytes):
+    import pdfplumber
+    return pdfplumber.open(io.BytesIO(file_bytes))
+
+def preload_worker() -> bool:
+    """Прогрев воркера пула: импорт тяжелых библиотек заранее, до первого документа."""
+    import pdfplumber  # noqa: F401
+    import pypdfium2  # noqa: F401
+    from PIL import Image  # noqa: F401
+    return True
+
+def count_pdf_pages(file_bytes: bytes) -> int:
+    try:
+        with _open_pdf(file_bytes) as pdf:
+            return len(pdf.pages)
+    except Exception as e:
+        logging.error(f"PDF Error: {e}")
+        return 0
+
+def extract_page_range(file_bytes: bytes, start: int, stop: int) -> list:
+    """Текст страниц [start, stop) — единица работы для пула процессов."""
+    with _open_pdf(file_bytes) as pdf:
+        return [page.extract_text() or "" for page in pdf.pages[start:stop]]
+
+def _join_pages(pages, max_chars: int) -> str:
+    """Склеивает страницы один раз, обрезая по бюджету символов."""
+    parts = []
+    total = 0
+    for text in pages:
+        parts.append(text)
+        total += len(text) + 1
+        if max_chars and total >= max_chars:
+            break
+    text = "\n".join(parts)
+    return text[:max_chars] if max_chars else text
+
+async def _iter_ranges(fn, file_bytes: bytes, start: int, stop: int, *args):
+    """
+    Раскидывает страницы [start, stop) пачками по пулу процессов: fn(file_bytes, a, b, *args) -> список.
+    Отдает результаты по порядку страниц, как только готова очередная пачка.
+    Если потребитель остановился — хвост отменяется.
+    """
+    chunk = max(1, min(PDF_PAGES_PER_CHUNK, math.ceil((stop - start) / pdf_pool.max_workers)))
+    tasks = [
+        asyncio.ensure_future(pdf_pool.run(fn, file_bytes, a, min(a + chunk, stop), *args))
+        for a in range(start, stop, chunk)
+    ]
+    try:
+        for task in tasks:
+            for item in await task:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def iter_pdf_pages_async(file_bytes: bytes, max_pages: int = PDF_MAX_PAGES):
+    """Текст страниц через pdfplumber, пачками параллельно в пуле процессов."""
+    file_bytes = bytes(file_bytes)
+    total = await pdf_pool.run(count_pdf_pages, file_bytes)
+    if max_pages:
+        total = min(total, max_pages)
+    pages = _iter_ranges(extract_page_range, file_bytes, 0, total)
+    try:
+        async for text in pages:
+            yield text
+    finally:
+        await pages.aclose()
+
+async def extract_text_from_pdf_async(file_bytes: bytes, max_pages: int = PDF_MAX_PAGES, max_chars: int = PDF_MAX_CHARS) -> str:
+    """Запасной путь (pdfium не открыл файл): pdfplumber, страницы параллельно в пуле процессов."""
+    parts = []
+    total = 0
+    pages = iter_pdf_pages_async(file_bytes, max_pages)
+    try:
+        async for text in pages:
+            parts.append(text)
+            total += len(text) + 1
+            if max_chars and total >= max_chars:
+                break
+    except Exception as e:
+        logging.error(f"PDF Error: {e}")
+        return ""
+    finally:
+        await pages.aclose()
+    return _join_pages(parts, max_chars)
+
+# ==============================================================================
+# Быстрый путь: проверка текстового слоя и легкое извлечение через pdfium
+# ==============================================================================
+
+def _page_text(page) -> str:
+    textpage = page.get_textpage()
+    try:
+        return textpage.get_text_range().replace("\r\n", "\n").replace("\r", "\n")
+    finally:
+        textpage.close()
+
+def _render_page(page, dpi: int) -> bytes:
+    image = page.render(scale=dpi / 72).to_pil()
+    out = io.BytesIO()
+    image.convert("RGB").save(out, format="JPEG", quality=85)
+    return out.getvalue()
+
+def _open_pdfium(file_bytes: bytes):
+    import pypdfium2 as pdfium
+    return pdfium.PdfDocument(file_bytes)
+
+def _map_pages(file_bytes: bytes, start: int, stop: int, fn) -> list:
+    pdf = _open_pdfium(file_bytes)
     try:
-        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-            text = ""
-            for page in pdf.pages:
-                text += page.extract_text() or ""
-            return text
+        result = []
+        for i in range(start, stop):
+            page = pdf[i]
+            try:
+                result.append(fn(page))
+            finally:
+                page.close()
+        return result
+    finally:
+        pdf.close()
+
+def pdfium_text_range(file_bytes: bytes, start: int, stop: int) -> list:
+    """Текст страниц [start, stop) через pdfium — единица работы для пула."""
+    return _map_pages(file_bytes, start, stop, _page_text)
+
+def pdfium_render_range(file_bytes: bytes, start: int, stop: int, dpi: int) -> list:
+    """JPEG страниц [start, stop) — единица работы для пула."""
+    return _map_pages(file_bytes, start, stop, lambda page: _render_page(page, dpi))
+
+def probe_pdf(file_bytes: bytes, max_pages: int = PDF_MAX_PAGES):
+    """
+    Первая задача по документу: число страниц (с учетом max_pages) и текст первых PDF_SCAN_PAGES.
+    None — pdfium файл не открыл.
+    """
+    try:
+        pdf = _open_pdfium(file_bytes)
+    except Exception as e:
+        logging.warning(f"pdfium failed, fallback to pdfplumber: {e}")
+        return None
+    try:
+        total = min(len(pdf), max_pages) if max_pages else len(pdf)
+    finally:
+        pdf.close()
+    return {"pages": total, "texts": pdfium_text_range(file_bytes, 0, min(total, PDF_SCAN_PAGES))}
+
+@timed("extract_pdf")
+async def extract_pdf_content_async(file_bytes: bytes, max_pages: int = PDF_MAX_PAGES,
+                                    max_chars: int = PDF_MAX_CHARS) -> dict:
+    """
+    Читает PDF без тяжелой раскладки pdfplumber:
+    - есть текстовый слой -> {"text": ..., "images": []} (текст из pdfium);
+    - скан -> {"text": "", "images": [JPEG страниц]} для vision-запроса.
+    Первые страницы проверяются одной задачей пула; остальные страницы (и рендер сканов)
+    расходятся пачками по пулу, чтение останавливается на бюджете символов.
+    """
+    file_bytes = bytes(file_bytes)
+    try:
+        probe = await pdf_pool.run(probe_pdf, file_bytes, max_pages)
+        if probe is None:
+            return {"text": await extract_text_from_pdf_async(file_bytes, max_pages, max_chars), "images": []}
+
+        total, texts = probe["pages"], probe["texts"]
+        if sum(len(t.strip()) for t in texts) >= PDF_MIN_TEXT_CHARS:
+            chars = sum(len(t) + 1 for t in texts)
+            if len(texts) < total and not (max_chars and chars >= max_chars):
+                pages = _iter_ranges(pdfium_text_range, file_bytes, len(texts), total)
+                try:
+                    async for text in pages:
+                        texts.append(text)
+                        chars += len(text) + 1
+                        if max_chars and chars >= max_chars:
+                            break
+                finally:
+                    await pages.aclose()
+            return {"text": _join_pages(texts, max_chars), "images": []}
+
+        # Скан: рендерим страницы с ограниченным DPI
+        count = min(total, PDF_MAX_IMAGE_PAGES)
+        images = [image async for image in _iter_ranges(pdfium_render_range, file_bytes, 0, count, PDF_RENDER_DPI)]
+        logging.info(f"PDF has no text layer, rendered {len(images)} page(s) at {PDF_RENDER_DPI} DPI")
+        return {"text": "", "images": images}
     except Exception as e:
-        print(f"PDF Error: {e}")
-        return ""
\ No newline at end of file
+        logging.error(f"PDF Error: {e}")
+        return {"text": "", "images": []}
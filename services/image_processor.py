@@ -0,0 +1,102 @@
+import io
+import math
+import logging
+from config import IMAGE_MAX_EDGE, IMAGE_JPEG_QUALITY, IMAGE_GRAYSCALE, IMAGE_AUTOCROP
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """
+    Оценка токенов картинки для gpt-4o (detail=high):
+    вписываем в 2048x2048, короткую сторону — до 768, дальше 170 токенов за тайл 512x512 + 85.
+    """
+    if not width or not height:
+        return 0
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+def detect_mime(image_bytes: bytes) -> str:
+    """MIME по сигнатуре файла (на случай, если картинку не удалось пережать)."""
+    if image_bytes[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+def crop_to_document(img: "Image.Image") -> "Image.Image":
+    """
+    Обрезает фон вокруг листа бумаги: бумага светлее стола/салона.
+    Если светлая область подозрительно маленькая или это вся картинка — не трогаем.
+    """
+    from PIL import ImageFilter, ImageOps
+    gray = ImageOps.autocontrast(img.convert("L"))
+    # Медианный фильтр убирает блики и мелкий мусор до порога
+    mask = gray.resize((max(1, gray.width // 4), max(1, gray.height // 4)))
+    mask = mask.filter(ImageFilter.MedianFilter(5)).point(lambda p: 255 if p > 160 else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return img
+
+    left, top, right, bottom = (v * 4 for v in bbox)
+    area_ratio = ((right - left) * (bottom - top)) / float(img.width * img.height)
+    if area_ratio < 0.3 or area_ratio > 0.95:
+        return img
+
+    margin = int(min(img.width, img.height) * 0.02)
+    return img.crop((
+        max(0, left - margin), max(0, top - margin),
+        min(img.width, right + margin), min(img.height, bottom + margin),
+    ))
+
+def prepare_image(image_bytes: bytes):
+    """
+    Готовит фото к отправке в vision-модель:
+    поворот по EXIF -> (обрезка по листу) -> уменьшение до IMAGE_MAX_EDGE ->
+    (оттенки серого) -> JPEG с IMAGE_JPEG_QUALITY.
+    Возвращает (bytes, mime, stats) — stats с экономией байт и токенов.
+    """
+    original_size = len(image_bytes)
+    try:
+        # PIL нужен только воркеру пула — основной процесс его не грузит
+        from PIL import Image, ImageOps
+
+        with Image.open(io.BytesIO(image_bytes)) as src:
+            original_w, original_h = src.size
+            orientation = src.getexif().get(0x0112, 1)
+            img = ImageOps.exif_transpose(src)
+
+            if IMAGE_AUTOCROP:
+                img = crop_to_document(img)
+
+            if max(img.size) > IMAGE_MAX_EDGE:
+                img.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), Image.LANCZOS)
+
+            img = img.convert("L") if IMAGE_GRAYSCALE else img.convert("RGB")
+
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True, progressive=True)
+            new_bytes = out.getvalue()
+            new_w, new_h = img.size
+    except Exception as e:
+        logging.warning(f"Image preprocessing skipped: {e}")
+        return bytes(image_bytes), detect_mime(image_bytes), None
+
+    # Маленький JPEG без поворота и изменений геометрии после пережатия может только вырасти
+    if len(new_bytes) >= original_size and (new_w, new_h) == (original_w, original_h) \
+            and orientation == 1 and detect_mime(image_bytes) == "image/jpeg":
+        new_bytes = bytes(image_bytes)
+
+    original_tokens = estimate_image_tokens(original_w, original_h)
+    new_tokens = estimate_image_tokens(new_w, new_h)
+    stats = {
+        "original_bytes": original_size,
+        "bytes": len(new_bytes),
+        "saved_bytes": original_size - len(new_bytes),
+        "original_tokens": original_tokens,
+        "tokens": new_tokens,
+        "saved_tokens": original_tokens - new_tokens,
+        "size": (new_w, new_h),
+    }
+    return new_bytes, "image/jpeg", stats
@@ -0,0 +1,108 @@
+import json
+from services.models import ValidationError, parse_amount
+
+class SchemaError(ValueError):
+    """Ответ модели не совпадает со схемой {"date", "items": [...]} — дочитывать бессмысленно."""
+
+def validate_item(item) -> dict:
+    if not isinstance(item, dict):
+        raise SchemaError(f"item is not an object: {item!r}")
+    # Те же правила, что и при сборке Transaction: "$1,234.56" и "(40.00)" — тоже суммы
+    try:
+        parse_amount(item.get("amount"))
+    except ValidationError as e:
+        raise SchemaError(f"item {e}")
+    if not isinstance(item.get("category"), str):
+        raise SchemaError(f"item category is not a string: {item.get('category')!r}")
+    return item
+
+class ItemStreamParser:
+    """
+    Инкрементальный разбор ответа {"date": ..., "items": [{...}, ...]} по кускам текста.
+    feed(кусок) возвращает позиции, которые пришли целиком; явный мусор
+    (не объект, items не список, позиция без суммы) — SchemaError сразу, не дожидаясь конца.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.items = []
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string = None   # последняя строка на верхнем уровне (кандидат в ключ)
+        self._key = None           # ключ, значение которого сейчас начнется
+        self._in_items = False
+        self._item_start = None
+
+    def feed(self, chunk: str) -> list:
+        start = len(self.text)
+        self.text += chunk
+        new_items = []
+
+        for i in range(start, len(self.text)):
+            ch = self.text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = self.text[self._string_start + 1:i]
+                continue
+            if ch.isspace():
+                continue
+
+            if not self._started:
+                if ch != "{":
+                    raise SchemaError("response is not a JSON object")
+                self._started = True
+
+            # Начало значения ключа верхнего уровня
+            if self._depth == 1 and self._key is not None and ch != ":":
+                if self._key == "items" and ch not in "[n":
+                    raise SchemaError("items is not a list")
+                self._in_items = self._key == "items" and ch == "["
+                self._key = None
+
+            if self._in_items and self._depth == 2 and ch not in "{,]":
+                raise SchemaError("items must contain objects")
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch == ":" and self._depth == 1:
+                self._key = self._last_string
+            elif ch in "{[":
+                self._depth += 1
+                if ch == "{" and self._in_items and self._depth == 3:
+                    self._item_start = i
+            elif ch in "}]":
+                if ch == "}" and self._in_items and self._depth == 3 and self._item_start is not None:
+                    item = validate_item(json.loads(self.text[self._item_start:i + 1]))
+                    self.items.append(item)
+                    new_items.append(item)
+                    self._item_start = None
+                elif ch == "]" and self._in_items and self._depth == 2:
+                    self._in_items = False
+                self._depth -= 1
+
+        return new_items
+
+    def result(self) -> dict:
+        """Итоговый объект после конца потока (недописанный JSON — SchemaError)."""
+        try:
+            data = json.loads(self.text)
+        except ValueError as e:
+            raise SchemaError(f"incomplete JSON: {e}")
+        if not isinstance(data, dict):
+            raise SchemaError("response is not a JSON object")
+        items = data.get("items") or []
+        if not isinstance(items, list):
+            raise SchemaError("items is not a list")
+        for item in items:
+            validate_item(item)
+        return data
@@ -0,0 +1,257 @@
+import io
+import re
+import logging
+from datetime import datetime
+from config import CATEGORIES_MAP
+from services.executor import pdf_pool
+from services.models import Transaction
+
+# ==============================================================================
+# Локальный разбор известных шаблонов (брокерские стейтменты, топливные карты).
+# Результат — тот же JSON, что у analyze_content: {"date": "MM.DD.YYYY"|None, "items": [...]}.
+# Если шаблон узнали, но что-то не сошлось — возвращаем None, и работает модель.
+# ==============================================================================
+
+TEMPLATES = []
+
+class Template:
+    def __init__(self, name, doc_type, fingerprint, extract, needs_tables=False):
+        self.name = name
+        self.doc_type = doc_type
+        self.fingerprint = [re.compile(p, re.IGNORECASE) for p in fingerprint]
+        self.extract = extract            # (text, tables) -> dict | None
+        self.needs_tables = needs_tables  # нужны ли таблицы pdfplumber
+
+    def matches(self, text: str) -> bool:
+        return all(p.search(text) for p in self.fingerprint)
+
+def register_template(name, doc_type, fingerprint, needs_tables=False):
+    """Декоратор: регистрирует функцию разбора шаблона."""
+    def wrapper(fn):
+        TEMPLATES.append(Template(name, doc_type, fingerprint, fn, needs_tables))
+        return fn
+    return wrapper
+
+def match_template(text: str):
+    if not text:
+        return None
+    for template in TEMPLATES:
+        if template.matches(text):
+            return template
+    return None
+
+# --- Общие правила ---
+
+_MONEY_RE = re.compile(r"\(?-?\$?\s*\d[\d,]*\.\d{2}\)?")
+_DATE_FORMATS = ["%m/%d/%Y", "%m/%d/%y", "%m-%d-%Y", "%m.%d.%Y", "%Y-%m-%d", "%b %d, %Y", "%B %d, %Y", "%b %d %Y"]
+_DATE_RE = re.compile(
+    r"\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d{4}-\d{2}-\d{2}|[A-Z][a-z]{2,8}\.? \d{1,2},? \d{4}"
+)
+
+def parse_money(s) -> float:
+    """'$1,234.56' -> 1234.56, '(12.00)' -> 12.0 (знак убираем — сумма вычета положительная)."""
+    if s is None:
+        return None
+    m = _MONEY_RE.search(str(s))
+    if not m:
+        return None
+    return abs(float(re.sub(r"[^\d.]", "", m.group(0))))
+
+def parse_us_date(s):
+    """Строгий разбор даты документа. В отличие от parse_date — без подстановки 'сегодня'."""
+    if not s:
+        return None
+    s = " ".join(str(s).replace(".", " ").split()) if re.match(r"[A-Za-z]", str(s)) else str(s).strip()
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(s, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def _find_dates(text: str):
+    return [d for d in (parse_us_date(m) for m in _DATE_RE.findall(text)) if d]
+
+def _item(category, amount, description):
+    return {"category": category, "amount": round(amount, 2), "description": description}
+
+# Вычеты стейтмента -> категория. Порядок важен (как в PROMPT_STATEMENT):
+# "Trailer Rent Deposit" — это other, а не trailer_rent.
+DEDUCTION_RULES = [
+    (re.compile(r"deposit", re.I), "other"),
+    (re.compile(r"trailer\s+insurance", re.I), "trailer_insurance"),
+    (re.compile(r"physical\s+damage|bobtail", re.I), "car_insurance"),
+    (re.compile(r"trailer\s+rent", re.I), "trailer_rent"),
+    (re.compile(r"cargo", re.I), "cargo_liab"),
+    (re.compile(r"dispatch", re.I), "dispatch_fee"),
+    (re.compile(r"samsara|logbook|eld", re.I), "samsara"),
+    (re.compile(r"fuel", re.I), "fuel"),
+]
+
+def classify_deduction(description: str):
+    for pattern, category in DEDUCTION_RULES:
+        if pattern.search(description or ""):
+            return category
+    return None
+
+# ==============================================================================
+# Шаблоны
+# ==============================================================================
+
+def _signed_money(s):
+    """Как parse_money, но со знаком: '(12.00)' и '-12.00' -> -12.0."""
+    amount = parse_money(s)
+    if amount is None:
+        return None
+    return -amount if re.search(r"\(|-", str(s)) else amount
+
+def _money_line(label: str):
+    return re.compile(label + r"[^\d$(\n-]*(\(?-?\$?\s*\d[\d,]*\.\d{2}\)?)", re.I)
+
+_DISCOUNT_RE = _money_line(r"Total Payables After Discount")
+_NON_CASH_RE = _money_line(r"Total Payables After Non-Cash Adjustment")
+_PERIOD_END_RE = re.compile(r"(?:End Period|Period Ending|Period End)[^\dA-Za-z\n]*([^\n]+)", re.I)
+
+# Сводка топливной карты, где есть обе итоговые строки: берем "After Discount" (сумма после скидок).
+# Одна строка из двух, несколько карт в одном отчете или скидка больше суммы — решает модель.
+@register_template("fuel_card_summary", "fuel", [
+    r"Total Payables After Non-Cash Adjustment",
+    r"Total Payables After Discount",
+    r"Period Ending|End Period|Period End",
+])
+def parse_fuel_card_summary(text, tables):
+    discount = [parse_money(m) for m in _DISCOUNT_RE.findall(text)]
+    non_cash = [parse_money(m) for m in _NON_CASH_RE.findall(text)]
+    if len(discount) != 1 or len(non_cash) != 1 or not discount[0] or not non_cash[0]:
+        return None
+    if discount[0] > non_cash[0]:
+        return None
+
+    date = None
+    m = _PERIOD_END_RE.search(text)
+    if m:
+        found = _find_dates(m.group(1))
+        date = found[0] if found else None
+
+    return {
+        "date": date.strftime("%m.%d.%Y") if date else None,
+        "items": [_item("fuel", discount[0], "Fuel report")],
+    }
+
+def _header_index(header, *names):
+    """Колонка с заголовком из names (точное совпадение без регистра, пробелов, ':' и '#')."""
+    for idx, cell in enumerate(header):
+        cell = " ".join((cell or "").lower().replace("#", " ").replace(":", " ").split())
+        if cell in names:
+            return idx
+    return None
+
+_NET_PAY_RE = _money_line(r"\bNet Pay\b")
+_TOTAL_DEDUCTIONS_RE = _money_line(r"\bTotal Deductions\b")
+_CENT = 0.005
+
+# Стейтмент с таблицей грузов (Load / Pickup / Delivery / Rate) и строкой Net Pay.
+# Разбор принимается, только если gross минус вычеты сходится с Net Pay (и с Total Deductions,
+# если она есть): вычет вне таблицы Description/Amount иначе потерялся бы молча.
+@register_template("settlement_loads_table", "statement", [
+    r"settlement",
+    r"\bLoad\b[^\n]*\bPickup\b[^\n]*\bDelivery\b[^\n]*\bRate\b",
+    r"\bNet Pay\b",
+], needs_tables=True)
+def parse_settlement_loads_table(text, tables):
+    gross = 0.0
+    delivery_dates = []
+    items = []
+
+    for table in tables:
+        if not table or not table[0]:
+            continue
+        header = table[0]
+        delivery_idx = _header_index(header, "delivery", "delivery date")
+        rate_idx = _header_index(header, "rate", "total revenue")
+        desc_idx = _header_index(header, "description", "deduction")
+        amount_idx = _header_index(header, "amount")
+
+        # Таблица грузов: Delivery + Rate
+        if delivery_idx is not None and rate_idx is not None:
+            for row in table[1:]:
+                # Итоговая строка таблицы — не груз
+                if (row[0] or "").strip().lower().startswith("total"):
+                    continue
+                rate = parse_money(row[rate_idx]) if rate_idx < len(row) else None
+                if rate:
+                    gross += rate
+                if delivery_idx < len(row):
+                    delivery_dates.extend(_find_dates(row[delivery_idx] or ""))
+
+        # Таблица вычетов: Description + Amount
+        elif desc_idx is not None and amount_idx is not None:
+            for row in table[1:]:
+                desc = (row[desc_idx] or "").strip() if desc_idx < len(row) else ""
+                amount = parse_money(row[amount_idx]) if amount_idx < len(row) else None
+                if not desc or not amount or desc.lower().startswith("total"):
+                    continue
+                category = classify_deduction(desc)
+                if category is None:
+                    # Незнакомый вычет — пусть решает модель
+                    return None
+                items.append(_item(category, amount, desc))
+
+    if not gross:
+        return None
+
+    # Сверка с итогами документа
+    deductions = sum(item["amount"] for item in items)
+    net = [_signed_money(m) for m in _NET_PAY_RE.findall(text)]
+    if len(net) != 1 or net[0] is None or abs(gross - deductions - net[0]) > _CENT:
+        logging.info(f"Settlement template: gross {gross:.2f} - deductions {deductions:.2f} != net pay {net}")
+        return None
+    total_deductions = [parse_money(m) for m in _TOTAL_DEDUCTIONS_RE.findall(text)]
+    if total_deductions and any(t is None or abs(t - deductions) > _CENT for t in total_deductions):
+        return None
+
+    items.insert(0, _item("gross", gross, "Gross (loads)"))
+    date = max(delivery_dates) if delivery_dates else None
+    return {"date": date.strftime("%m.%d.%Y") if date else None, "items": items}
+
+# ==============================================================================
+# Вход
+# ==============================================================================
+
+def extract_tables(file_bytes: bytes) -> list:
+    import pdfplumber  # только в воркере пула
+    with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
+        return [table for page in pdf.pages for table in page.extract_tables()]
+
+def parse_known_layout(file_bytes: bytes, text: str, categories: dict = None):
+    """
+    Пробует разобрать документ по известному шаблону.
+    categories — карта колонок автопарка (по умолчанию CATEGORIES_MAP).
+    Возвращает (doc_type, result) или None — тогда нужен AI.
+    """
+    categories = categories or CATEGORIES_MAP
+    template = match_template(text)
+    if template is None:
+        return None
+    try:
+        tables = extract_tables(file_bytes) if template.needs_tables else []
+        result = template.extract(text, tables)
+    except Exception as e:
+        logging.warning(f"Local parser {template.name} failed: {e}")
+        return None
+    if not result or not result.get("items"):
+        return None
+    # Категории, которой у автопарка нет колонки, шаблон не выдумывает — пусть решает модель
+    if any(item["category"] not in categories for item in result["items"]):
+        return None
+    transaction = Transaction.from_result(result, template.doc_type, categories)
+    if transaction.rejected:
+        return None
+    logging.info(f"Parsed locally with template {template.name}")
+    return template.doc_type, transaction
+
+async def parse_known_layout_async(file_bytes: bytes, text: str, categories: dict = None):
+    # Без совпадения по отпечатку в пул даже не ходим
+    if match_template(text) is None:
+        return None
+    return await pdf_pool.run(parse_known_layout, bytes(file_bytes), text, categories)
@@ -0,0 +1,188 @@
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# ==============================================================================
+# Минимальные метрики в формате Prometheus (text exposition 0.0.4).
+# Без зависимостей: счетчики/гистограммы пишутся из event loop и из потоков пула.
+# ==============================================================================
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_lock = threading.Lock()
+_metrics = []
+_collectors = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt_labels(names, values, extra=None) -> str:
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(l, "") for l in self.labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_fmt_labels(self.labels, key)} {value}")
+        return lines
+
+class Gauge(Counter):
+    def set(self, value, **labels):
+        key = tuple(labels.get(l, "") for l in self.labels)
+        with _lock:
+            self._values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # key -> [counts по бакетам..., sum, count]
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(l, "") for l in self.labels)
+        with _lock:
+            data = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, data in sorted(self._values.items()):
+            for i, bound in enumerate(self.buckets):
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, [('le', bound)])} {data[i]}")
+            lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, [('le', '+Inf')])} {data[-1]}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {data[-2]}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {data[-1]}")
+        return lines
+
+def register_collector(fn):
+    """fn() -> [(имя, значение, {метки})] — снимается в момент запроса /metrics (статистика пулов и т.п.)."""
+    _collectors.append(fn)
+    return fn
+
+def render_metrics() -> str:
+    with _lock:
+        lines = [line for metric in _metrics for line in metric.render()]
+    for collect in _collectors:
+        try:
+            for name, value, labels in collect():
+                if value is None:
+                    continue
+                lines.append(f"{name}{_fmt_labels(list(labels), list(labels.values()))} {value}")
+        except Exception as e:
+            logging.warning(f"Metrics collector failed: {e}")
+    return "\n".join(lines) + "\n"
+
+# ==============================================================================
+# Метрики пайплайна
+# ==============================================================================
+
+STAGE_LATENCY = Histogram("finbot_stage_seconds", "Latency of pipeline stages", ["stage"])
+STAGE_IN_FLIGHT = Gauge("finbot_stage_in_flight", "Stage calls currently running", ["stage"])
+STAGE_ERRORS = Counter("finbot_stage_errors_total", "Stage calls that raised", ["stage"])
+AI_TOKENS = Counter("finbot_ai_tokens_total", "OpenAI tokens by doc type", ["doc_type", "kind"])
+AI_CALL_LATENCY = Histogram("finbot_ai_call_seconds", "OpenAI call latency incl. queueing and retries", ["doc_type"])
+AI_COST = Counter("finbot_ai_cost_usd_total", "Estimated OpenAI cost by doc type", ["doc_type"])
+PROMPT_TRIMMED_TOKENS = Counter(
+    "finbot_prompt_trimmed_tokens_total", "Estimated document tokens cut by the prompt budget", ["doc_type"]
+)
+SHEETS_CALLS = Counter("finbot_sheets_calls_total", "Google Sheets API calls", ["op"])
+JOURNAL_LAG = Histogram(
+    "finbot_journal_lag_seconds", "Time from user ack to the entry written to the sheet",
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600, 21600),
+)
+
+_stage_observers = []
+
+def add_stage_observer(fn):
+    """fn(stage, seconds) на каждый замер — сырые значения для бенчмарка (перцентили)."""
+    _stage_observers.append(fn)
+    return fn
+
+@contextmanager
+def track(stage: str):
+    """Замер участка кода: гистограмма задержки, in-flight и ошибки."""
+    STAGE_IN_FLIGHT.inc(stage=stage)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.observe(elapsed, stage=stage)
+        STAGE_IN_FLIGHT.dec(stage=stage)
+        for observer in _stage_observers:
+            observer(stage, elapsed)
+
+def timed(stage: str):
+    """Декоратор для sync и async функций."""
+    def wrapper(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_inner(*args, **kwargs):
+                with track(stage):
+                    return await fn(*args, **kwargs)
+            return async_inner
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with track(stage):
+                return fn(*args, **kwargs)
+        return inner
+    return wrapper
+
+# ==============================================================================
+# Trace id: один на апдейт, виден во всех строках лога этого апдейта
+# ==============================================================================
+
+trace_id_var = contextvars.ContextVar("trace_id", default="-")
+
+def new_trace_id() -> str:
+    trace_id = uuid.uuid4().hex[:12]
+    trace_id_var.set(trace_id)
+    return trace_id
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record):
+        record.trace_id = trace_id_var.get()
+        return True
+
+def install_log_trace_ids():
+    """Добавляет %(trace_id)s во все обработчики корневого логгера."""
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(TraceIdFilter())
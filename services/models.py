@@ -0,0 +1,130 @@
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from config import CATEGORIES_MAP
+
+# ==============================================================================
+# Транзакция из документа: одна структура для хендлеров, кэша, журнала и записи в таблицу.
+# Суммы — Decimal (центы не теряются на float), категории сверяются с CATEGORIES_MAP.
+# ==============================================================================
+
+CENT = Decimal("0.01")
+
+class ValidationError(ValueError):
+    """Ответ модели/шаблона нельзя привести к транзакции."""
+
+def parse_amount(value) -> Decimal:
+    """12.5 / "12.50" / "$1,234.56" / "(40.00)" -> Decimal с точностью до цента."""
+    if isinstance(value, bool) or value is None:
+        raise ValidationError(f"amount is not a number: {value!r}")
+    if isinstance(value, Decimal):
+        amount = value
+    elif isinstance(value, int):
+        amount = Decimal(value)
+    elif isinstance(value, float):
+        amount = Decimal(repr(value))  # repr — без хвоста двоичной дроби
+    elif isinstance(value, str):
+        s = value.strip().replace("$", "").replace(",", "").replace(" ", "")
+        negative = s.startswith("(") and s.endswith(")")
+        try:
+            amount = Decimal(s.strip("()"))
+        except InvalidOperation:
+            raise ValidationError(f"amount is not a number: {value!r}")
+        if negative:
+            amount = -amount
+    else:
+        raise ValidationError(f"amount is not a number: {value!r}")
+    if not amount.is_finite():
+        raise ValidationError(f"amount is not finite: {value!r}")
+    return amount.quantize(CENT, rounding=ROUND_HALF_UP)
+
+@dataclass(slots=True, frozen=True)
+class LineItem:
+    category: str
+    amount: Decimal
+    description: str = "Bot"
+    # Категория от модели, если ее нет в CATEGORIES_MAP (позиция ушла в other)
+    unknown_category: str = None
+
+    @classmethod
+    def from_dict(cls, data, categories: dict = None) -> "LineItem":
+        """categories — карта колонок автопарка (по умолчанию CATEGORIES_MAP)."""
+        categories = categories or CATEGORIES_MAP
+        if not isinstance(data, dict):
+            raise ValidationError(f"item is not an object: {data!r}")
+        amount = parse_amount(data.get("amount"))
+
+        category = str(data.get("category") or "other").strip().lower()
+        unknown = data.get("unknown_category")
+        if category not in categories:
+            unknown, category = category, "other"
+
+        description = str(data.get("description") or "Bot").strip() or "Bot"
+        return cls(category, amount, description, unknown)
+
+    def to_dict(self) -> dict:
+        data = {"category": self.category, "amount": str(self.amount), "description": self.description}
+        if self.unknown_category:
+            data["unknown_category"] = self.unknown_category
+        return data
+
+@dataclass(slots=True)
+class Transaction:
+    items: list
+    date: str = None
+    doc_type: str = "general"
+    # Сколько позиций ответа не удалось разобрать (для отчета пользователю)
+    rejected: int = 0
+
+    @classmethod
+    def from_result(cls, data, doc_type: str = "general", categories: dict = None) -> "Transaction":
+        """
+        Ответ analyze_content / локального шаблона -> Transaction.
+        Битые позиции отбрасываются (rejected), битая структура — ValidationError.
+        """
+        if not isinstance(data, dict):
+            raise ValidationError("result is not an object")
+        raw_items = data.get("items") or []
+        if not isinstance(raw_items, list):
+            raise ValidationError("items is not a list")
+
+        items = []
+        rejected = 0
+        for raw in raw_items:
+            try:
+                items.append(LineItem.from_dict(raw, categories))
+            except ValidationError:
+                rejected += 1
+
+        date = data.get("date")
+        date = str(date).strip() if date not in (None, "") else None
+        return cls(items, date, data.get("doc_type", doc_type), rejected)
+
+    # Формат кэша/журнала совпадает с ответом модели — from_result читает его обратно
+    def to_dict(self) -> dict:
+        return {
+            "date": self.date,
+            "doc_type": self.doc_type,
+            "items": [item.to_dict() for item in self.items],
+            "rejected": self.rejected,
+        }
+
+    @classmethod
+    def from_dict(cls, data, categories: dict = None) -> "Transaction":
+        tx = cls.from_result(data, categories=categories)
+        tx.rejected += int(data.get("rejected", 0))
+        return tx
+
+    @property
+    def total(self) -> Decimal:
+        return sum((item.amount for item in self.items), Decimal(0))
+
+    def entries(self, categories: dict = None) -> list:
+        """
+        Позиции для записи: (колонка, сумма, комментарий), только положительные суммы.
+        categories — карта колонок автопарка; категории, которой в ней нет, пишутся в other.
+        """
+        categories = categories or CATEGORIES_MAP
+        return [
+            (categories.get(item.category, categories["other"]), item.amount, item.description)
+            for item in self.items if item.amount > 0
+        ]
@@ -0,0 +1,332 @@
+import asyncio
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from telegram.ext import BasePersistence, PersistenceInput
+from config import PERSISTENCE_URL, PERSISTENCE_UPDATE_INTERVAL, CONVERSATION_TTL, BLOB_TTL
+
+# ==============================================================================
+# Key-value бэкенды: память (по умолчанию), SQLite, Redis-протокол.
+# Все значения — bytes, у каждой записи может быть TTL.
+# ==============================================================================
+
+class MemoryKV:
+    """Хранилище в памяти процесса — когда внешнего нет (локальный запуск)."""
+
+    def __init__(self):
+        self._data = {}  # key -> (value, expires_at | None)
+
+    async def get(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at < time.time():
+            self._data.pop(key, None)
+            return None
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: int = None):
+        self._data[key] = (value, time.time() + ttl if ttl else None)
+        self._purge()
+
+    async def delete(self, key: str):
+        self._data.pop(key, None)
+
+    async def keys(self, prefix: str):
+        now = time.time()
+        return [k for k, (_, exp) in self._data.items() if k.startswith(prefix) and (exp is None or exp >= now)]
+
+    def _purge(self):
+        now = time.time()
+        for key in [k for k, (_, exp) in self._data.items() if exp is not None and exp < now]:
+            self._data.pop(key, None)
+
+    async def close(self):
+        pass
+
+class SQLiteKV:
+    """Локальный файл SQLite: переживает рестарт инстанса (если диск не tmpfs)."""
+
+    PURGE_EVERY = 200  # записей между чистками протухших ключей
+
+    def __init__(self, path: str):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+        )
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    # sqlite3 блокирует (блобы — мегабайты): сами запросы идут в потоке, не на event loop
+
+    def _get(self, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+                (key, time.time()),
+            ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def _set(self, key: str, value: bytes, ttl: int = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl if ttl else None),
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._conn.execute("DELETE FROM kv WHERE expires_at < ?", (time.time(),))
+
+    def _delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def _keys(self, prefix: str):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key FROM kv WHERE substr(key, 1, ?) = ? AND (expires_at IS NULL OR expires_at >= ?)",
+                (len(prefix), prefix, time.time()),
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def _close(self):
+        with self._lock:
+            self._conn.close()
+
+    async def get(self, key: str):
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: bytes, ttl: int = None):
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._delete, key)
+
+    async def keys(self, prefix: str):
+        return await asyncio.to_thread(self._keys, prefix)
+
+    async def close(self):
+        await asyncio.to_thread(self._close)
+
+class RedisKV:
+    """
+    Любой сервер с Redis-протоколом (Redis, Memorystore, KeyDB, локальная заглушка).
+    Общий для всех инстансов Cloud Run.
+    """
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("PERSISTENCE_URL=redis://... requires the 'redis' package")
+        self._redis = redis.Redis.from_url(url)
+
+    async def get(self, key: str):
+        return await self._redis.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: int = None):
+        await self._redis.set(key, value, ex=ttl)
+
+    async def delete(self, key: str):
+        await self._redis.delete(key)
+
+    async def keys(self, prefix: str):
+        return [k.decode() if isinstance(k, bytes) else k async for k in self._redis.scan_iter(match=f"{prefix}*")]
+
+    async def close(self):
+        await self._redis.aclose()
+
+def open_kv(url: str):
+    """'' -> память, 'sqlite:///path/db.sqlite' -> SQLite, 'redis://host:6379/0' -> Redis."""
+    if not url:
+        return MemoryKV()
+    if url.startswith("sqlite:///"):
+        return SQLiteKV(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisKV(url)
+    raise ValueError(f"Unsupported PERSISTENCE_URL: {url}")
+
+# ==============================================================================
+# Большие бинарные данные (фото, страницы сканов) — отдельно, по хэшу содержимого
+# ==============================================================================
+
+class BlobStore:
+    """В user_data лежит только ссылка (sha256), сами байты — в KV с TTL."""
+
+    def __init__(self, kv, ttl: int):
+        self._kv = kv
+        self.ttl = ttl
+
+    async def put(self, data: bytes) -> str:
+        data = bytes(data)
+        ref = hashlib.sha256(data).hexdigest()
+        await self._kv.set(f"blob:{ref}", data, ttl=self.ttl)
+        return ref
+
+    async def get(self, ref: str):
+        return await self._kv.get(f"blob:{ref}")
+
+# ==============================================================================
+# Persistence для PTB: user_data и состояния ConversationHandler
+# ==============================================================================
+
+class KVPersistence(BasePersistence):
+    """
+    Хранит user_data и состояния диалогов в KV-бэкенде.
+    После рестарта (scale-to-zero) user_data и состояния диалогов поднимаются из хранилища.
+    Перед каждым апдейтом user_data сверяется с хранилищем (refresh_user_data),
+    так что данные, записанные другим инстансом, подхватываются.
+    Состояния диалогов PTB читает только при старте — поэтому SharedConversationHandler
+    (handlers/common.py) сам читает состояние перед апдейтом (get_conversation)
+    и пишет его сразу при смене, не дожидаясь периодического сброса.
+    Запись пропускается, если в хранилище уже лежит то же самое: иначе периодический
+    сброс PTB вернул бы старое состояние поверх записи другого инстанса.
+    """
+
+    def __init__(self, kv, ttl: int, update_interval: float = PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._kv = kv
+        self.ttl = ttl
+        self._versions = {}      # user_id -> версия, которую видели/записали последней
+        self._fingerprints = {}  # user_id -> хэш user_data, которые лежат в хранилище
+        self._states = {}        # ключ диалога в KV -> состояние, которое лежит в хранилище
+
+    # --- user_data ---
+    # Запись хранится как (версия, данные). Версия — время записи в нс:
+    # перечитываем user_data, только если другой инстанс записал что-то новее нас.
+
+    async def _load_user(self, user_id):
+        raw = await self._kv.get(f"user:{user_id}")
+        if raw is None:
+            return 0, {}
+        return pickle.loads(raw)
+
+    @staticmethod
+    def _fingerprint(data) -> bytes:
+        return hashlib.sha1(pickle.dumps(dict(data))).digest()
+
+    async def get_user_data(self):
+        result = {}
+        for key in await self._kv.keys("user:"):
+            user_id = int(key.split(":", 1)[1])
+            version, data = await self._load_user(user_id)
+            self._versions[user_id] = version
+            self._fingerprints[user_id] = self._fingerprint(data)
+            result[user_id] = data
+        return result
+
+    async def update_user_data(self, user_id, data):
+        fingerprint = self._fingerprint(data)
+        if self._fingerprints.get(user_id) == fingerprint:
+            return
+        version = time.time_ns()
+        self._versions[user_id] = version
+        if data:
+            await self._kv.set(f"user:{user_id}", pickle.dumps((version, dict(data))), ttl=self.ttl)
+        else:
+            await self._kv.delete(f"user:{user_id}")
+        self._fingerprints[user_id] = fingerprint
+
+    async def refresh_user_data(self, user_id, user_data):
+        version, fresh = await self._load_user(user_id)
+        if version > self._versions.get(user_id, 0):
+            self._versions[user_id] = version
+            self._fingerprints[user_id] = self._fingerprint(fresh)
+            user_data.clear()
+            user_data.update(fresh)
+
+    async def drop_user_data(self, user_id):
+        self._versions.pop(user_id, None)
+        self._fingerprints.pop(user_id, None)
+        await self._kv.delete(f"user:{user_id}")
+
+    # --- Диалоги ---
+
+    @staticmethod
+    def _conv_key(name, key) -> str:
+        return f"conv:{name}:{':'.join(map(str, key))}"
+
+    async def get_conversations(self, name):
+        prefix = f"conv:{name}:"
+        result = {}
+        for kv_key in await self._kv.keys(prefix):
+            raw = await self._kv.get(kv_key)
+            if raw is not None:
+                conv_key, state = pickle.loads(raw)
+                self._states[kv_key] = state
+                result[conv_key] = state
+        return result
+
+    async def get_conversation(self, name, key):
+        """Состояние одного диалога из хранилища (его мог сменить другой инстанс). None — диалога нет."""
+        kv_key = self._conv_key(name, key)
+        raw = await self._kv.get(kv_key)
+        state = pickle.loads(raw)[1] if raw is not None else None
+        self._states[kv_key] = state
+        return state
+
+    async def update_conversation(self, name, key, new_state):
+        kv_key = self._conv_key(name, key)
+        if kv_key in self._states and self._states[kv_key] == new_state:
+            return
+        if new_state is None:
+            await self._kv.delete(kv_key)
+        else:
+            await self._kv.set(kv_key, pickle.dumps((key, new_state)), ttl=self.ttl)
+        self._states[kv_key] = new_state
+
+    # --- Не используется (store_data выключен), но обязательно для BasePersistence ---
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def flush(self):
+        await self._kv.close()
+
+# Один бэкенд на процесс: и для диалогов, и для блобов
+kv_store = open_kv(PERSISTENCE_URL)
+blob_store = BlobStore(kv_store, BLOB_TTL)
+
+def build_persistence():
+    """Persistence для ApplicationBuilder или None, если внешнее хранилище не настроено."""
+    if not PERSISTENCE_URL:
+        return None
+    logging.info(f"Persistence: {PERSISTENCE_URL.split('://')[0]}")
+    return KVPersistence(kv_store, CONVERSATION_TTL)
@@ -0,0 +1,138 @@
+import logging
+import re
+
+from services.metrics import PROMPT_TRIMMED_TOKENS
+
+# ==============================================================================
+# Бюджет промпта: из длинного документа оставляем строки, которые нужны модели
+# (таблица грузов, вычеты, итоги), и режем текст под потолок токенов.
+# ==============================================================================
+
+_AMOUNT_RE = re.compile(r"\d[\d,]*\.\d{2}\b")
+_DATE_RE = re.compile(
+    r"\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b"
+    r"|\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.? \d{1,2}\b",
+    re.IGNORECASE,
+)
+
+# Ключевые слова разделов, которые разбирают промпты (см. PROMPT_STATEMENT / PROMPT_FUEL)
+_SECTION_KEYWORDS = {
+    "statement": re.compile(
+        r"load|pick ?up|deliver|rate|revenue|gross|total|deduct|fuel|dispatch|insurance|physical|bobtail|"
+        r"trailer|rent|deposit|escrow|samsara|logbook|eld|advance|net|pay|settlement|period|cargo|credit|"
+        r"registration|toll|fee",
+        re.IGNORECASE,
+    ),
+    "fuel": re.compile(
+        r"fuel|total|payable|discount|adjust|period|ending|transaction|diesel|gallon|\bdef\b|summary",
+        re.IGNORECASE,
+    ),
+}
+
+_tiktoken_encoding = None
+
+def estimate_tokens(text: str) -> int:
+    """
+    Число токенов текста: tiktoken, если установлен, иначе оценка сверху
+    (~4 байта UTF-8 на токен: для латиницы близко, кириллицу чуть завышает).
+    """
+    global _tiktoken_encoding
+    if not text:
+        return 0
+    if _tiktoken_encoding is None:
+        try:
+            import tiktoken
+            _tiktoken_encoding = tiktoken.get_encoding("o200k_base")  # токенизатор gpt-4o
+        except Exception:
+            _tiktoken_encoding = False
+    if _tiktoken_encoding:
+        return len(_tiktoken_encoding.encode(text, disallowed_special=()))
+    return (len(text.encode("utf-8")) + 3) // 4
+
+def _amount_only(line: str) -> bool:
+    """Строка из одних сумм (колонка Amount, вынесенная pdf-экстрактором на отдельную строку)."""
+    return not re.sub(r"[\s$()\-]", "", _AMOUNT_RE.sub("", line))
+
+def select_sections(text: str, doc_type: str) -> str:
+    """
+    Оставляет строки с суммами, датами и ключевыми словами разделов doc_type.
+    Перед строкой из одних сумм оставляет и предыдущую (подпись вроде "Lumper", "Comdata cash").
+    Повторяющиеся строки без сумм (колонтитулы страниц) — один раз.
+    Если фильтр не нашел ни одной суммы — возвращает текст как есть.
+    """
+    keywords = _SECTION_KEYWORDS.get(doc_type)
+    if not keywords or not text:
+        return text
+
+    kept = []
+    seen = set()
+    has_amounts = False
+    prev = None   # предыдущая непустая строка, если ее отбросили
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        amount = _AMOUNT_RE.search(line)
+        if not amount:
+            if line in seen:
+                prev = None
+                continue
+            if not (_DATE_RE.search(line) or keywords.search(line)):
+                prev = line
+                continue
+            seen.add(line)
+        elif prev is not None and _amount_only(line):
+            kept.append(prev)
+        prev = None
+        has_amounts = has_amounts or amount is not None
+        kept.append(line)
+    return "\n".join(kept) if has_amounts else text
+
+def fit_to_budget(text: str, max_tokens: int) -> str:
+    """
+    Режет текст по строкам под max_tokens: начало (шапка, таблица грузов) и конец (итоги)
+    сохраняются, середина заменяется пометкой.
+    """
+    if not max_tokens or estimate_tokens(text) <= max_tokens:
+        return text
+    lines = text.splitlines()
+    head_budget = max_tokens * 6 // 10
+    tail_budget = max_tokens - head_budget
+
+    head, used = [], 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > head_budget:
+            if not head:
+                # Одна гигантская строка (таблица без переносов) — режем по символам
+                head.append(line[:head_budget * 3])
+            break
+        head.append(line)
+        used += cost
+
+    tail, used = [], 0
+    for line in reversed(lines[len(head):]):
+        cost = estimate_tokens(line) + 1
+        if used + cost > tail_budget:
+            break
+        tail.append(line)
+        used += cost
+    tail.reverse()
+
+    skipped = len(lines) - len(head) - len(tail)
+    return "\n".join(head + [f"[... пропущено строк: {skipped} ...]"] + tail)
+
+def prepare_document_text(text: str, doc_type: str, max_tokens: int, section_filter: bool = True) -> str:
+    """Текст документа для запроса: фильтр разделов (только сверх потолка) + потолок токенов."""
+    if not text:
+        return text
+    before = estimate_tokens(text)
+    # Документ влезает в потолок — отдаем целиком, без фильтра
+    if section_filter and max_tokens and before > max_tokens:
+        text = select_sections(text, doc_type)
+    text = fit_to_budget(text, max_tokens)
+    after = estimate_tokens(text)
+    if after < before:
+        PROMPT_TRIMMED_TOKENS.inc(before - after, doc_type=doc_type)
+        logging.info(f"Prompt budget ({doc_type}): ~{before} -> ~{after} tokens")
+    return text
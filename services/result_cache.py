@@ -0,0 +1,98 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+def make_cache_key(*parts) -> str:
+    """SHA-256 от частей ключа (str/bytes). Длина каждой части входит в хэш — без склеек."""
+    h = hashlib.sha256()
+    for part in parts:
+        if part is None:
+            part = b""
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        h.update(len(part).to_bytes(8, "big"))
+        h.update(bytes(part))
+    return h.hexdigest()
+
+class ResultCache:
+    """
+    Персистентный кэш JSON-результатов в SQLite с LRU-вытеснением по размеру.
+    Соединение открывается при первом обращении.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._lock = threading.Lock()
+
+        # --- Метрики ---
+        self.hits = 0
+        self.misses = 0
+
+    def _db(self):
+        if self._conn is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS results_lru ON results(last_access)")
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str):
+        try:
+            with self._lock:
+                db = self._db()
+                row = db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                db.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+                self.hits += 1
+                return json.loads(row[0])
+        except Exception as e:
+            # Кэш не должен ломать основной сценарий
+            logging.warning(f"Cache read error: {e}")
+            return None
+
+    def put(self, key: str, value):
+        try:
+            data = json.dumps(value, ensure_ascii=False)
+            with self._lock:
+                db = self._db()
+                db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, data, len(data), time.time()),
+                )
+                self._evict(db)
+        except Exception as e:
+            logging.warning(f"Cache write error: {e}")
+
+    def _evict(self, db):
+        """Удаляет самые давно использованные записи, пока кэш больше лимита."""
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM results ORDER BY last_access").fetchall():
+            db.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,298 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import suppress
+from decimal import Decimal
+
+from services.metrics import JOURNAL_LAG, track
+
+class SaveJournal:
+    """
+    Журнал подтвержденных позиций (write-ahead) в SQLite.
+    Позиция попадает сюда до ответа пользователю и уходит из очереди только после записи в таблицу.
+    id позиции — ключ дедупликации: он же пишется в заметку ячейки.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        if self._conn is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            # FULL: подтвержденная пользователю позиция не должна пропасть и при сбое питания
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    id TEXT PRIMARY KEY,
+                    week TEXT NOT NULL,
+                    col TEXT NOT NULL,
+                    amount TEXT NOT NULL,
+                    comment TEXT NOT NULL,
+                    chat_id INTEGER,
+                    tenant TEXT,
+                    created REAL NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    done_at REAL
+                )
+            """)
+            # Журнал из версии без автопарков — добавляем колонку (NULL = автопарк по умолчанию)
+            if "tenant" not in {row["name"] for row in conn.execute("PRAGMA table_info(entries)")}:
+                conn.execute("ALTER TABLE entries ADD COLUMN tenant TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_status ON entries(status, created)")
+            self._conn = conn
+        return self._conn
+
+    def append(self, week: str, entries, chat_id=None, tenant=None) -> list:
+        """Позиции одной транзакции — одной SQLite-транзакцией. tenant — id автопарка. Возвращает их id."""
+        tx_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        rows = [
+            (f"{tx_id}-{i}", week, col, str(amount), comment, chat_id, tenant, now)
+            for i, (col, amount, comment) in enumerate(entries)
+        ]
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.executemany(
+                    "INSERT INTO entries (id, week, col, amount, comment, chat_id, tenant, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return [row[0] for row in rows]
+
+    def pending(self, limit: int) -> list:
+        """Самые старые незаписанные позиции."""
+        with self._lock:
+            return self._db().execute(
+                "SELECT * FROM entries WHERE status = 'pending' ORDER BY created LIMIT ?", (limit,)
+            ).fetchall()
+
+    def mark(self, ids, status: str):
+        with self._lock:
+            self._db().executemany(
+                "UPDATE entries SET status = ?, done_at = ? WHERE id = ?",
+                [(status, time.time(), id_) for id_ in ids],
+            )
+
+    def record_failure(self, ids, error: str, max_attempts: int) -> set:
+        """
+        Считает неудачную попытку. Позиции, исчерпавшие max_attempts, уходят в статус failed
+        (из очереди pending — иначе они вечно занимали бы голову пачки). Возвращает их id.
+        """
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.executemany(
+                    "UPDATE entries SET attempts = attempts + 1, error = ?, "
+                    "status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE status END, "
+                    "done_at = CASE WHEN attempts + 1 >= ? THEN ? ELSE done_at END "
+                    "WHERE id = ?",
+                    [(error[:500], max_attempts, max_attempts, now, id_) for id_ in ids],
+                )
+                placeholders = ",".join("?" * len(ids))
+                failed = {
+                    row["id"] for row in db.execute(
+                        f"SELECT id FROM entries WHERE status = 'failed' AND id IN ({placeholders})", list(ids)
+                    )
+                }
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return failed
+
+    def purge(self, older_than_days: int):
+        """Удаляет давно записанные позиции (незаписанные не трогаем)."""
+        with self._lock:
+            self._db().execute(
+                "DELETE FROM entries WHERE status != 'pending' AND done_at < ?",
+                (time.time() - older_than_days * 86400,),
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, oldest = self._db().execute(
+                "SELECT COUNT(*), MIN(created) FROM entries WHERE status = 'pending'"
+            ).fetchone()
+        return {"pending": count, "oldest_age": time.time() - oldest if oldest else 0.0}
+
+class JournalFlusher:
+    """
+    Фоновая запись журнала в таблицу.
+    - Новая позиция будит флашер сразу; без новых — опрос раз в `interval` (остатки после рестарта).
+    - Недели пишутся параллельно, позиции одной недели автопарка — одним вызовом writer.
+    - Ошибка записи — позиции остаются в журнале, повтор с экспоненциальной паузой до `backoff_max`.
+      После `max_attempts` неудач позиции помечаются failed и о них сообщается водителю.
+    - Повтор безопасен: writer пропускает позиции, id которых уже есть в заметке ячейки.
+
+    writer: async (неделя, [(колонка, сумма, комментарий, id)], id автопарка) -> результат записи
+    или None (недели нет).
+    notify: async (chat_id, текст) — сообщить, что позиции записать не удалось.
+    """
+
+    def __init__(self, journal: SaveJournal, writer, interval: float, batch_size: int, backoff_max: float,
+                 max_attempts: int):
+        self.journal = journal
+        self._writer = writer
+        self.interval = interval
+        self.batch_size = batch_size
+        self.backoff_max = backoff_max
+        self.max_attempts = max_attempts
+        self.notify = None
+        self._task = None
+        self._wakeup = None
+
+        # --- Метрики ---
+        self.applied = 0
+        self.not_found = 0
+        self.failed = 0
+        self.errors = 0
+
+    def start(self):
+        """Запуск фоновой задачи (идемпотентно; вызывать из event loop)."""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, week: str, entries, chat_id=None, tenant=None) -> list:
+        """Пишет позиции в журнал (durable) и будит флашер. tenant — id автопарка. Возвращает id позиций."""
+        # Коммит с synchronous=FULL ждет fsync — не на event loop
+        ids = await asyncio.to_thread(self.journal.append, week, entries, chat_id, tenant)
+        self.start()
+        self._wakeup.set()
+        return ids
+
+    async def _run(self):
+        delay = 0
+        while True:
+            if delay:
+                # Таблица недоступна — новые позиции не должны ускорять повторы
+                await asyncio.sleep(delay)
+            else:
+                # asyncio.wait, а не wait_for: в 3.11 wait_for может проглотить cancel() из drain
+                waiter = asyncio.create_task(self._wakeup.wait())
+                try:
+                    await asyncio.wait((waiter,), timeout=self.interval)
+                finally:
+                    waiter.cancel()
+            self._wakeup.clear()
+            try:
+                ok = await self.flush_once()
+            except Exception as e:
+                logging.error(f"Journal flush failed: {e}")
+                ok = False
+            delay = 0 if ok else min(max(delay * 2, 1), self.backoff_max)
+
+    async def flush_once(self) -> bool:
+        """Пишет журнал, пока в нем есть позиции. False — часть недель записать не удалось."""
+        while True:
+            rows = await asyncio.to_thread(self.journal.pending, self.batch_size)
+            if not rows:
+                return True
+            by_week = {}
+            for row in rows:
+                by_week.setdefault((row["tenant"], row["week"]), []).append(row)
+            results = await asyncio.gather(*(
+                self._flush_week(week, week_rows, tenant) for (tenant, week), week_rows in by_week.items()
+            ))
+            if not all(results):
+                return False
+
+    async def _flush_week(self, week: str, rows, tenant=None) -> bool:
+        ids = [row["id"] for row in rows]
+        entries = [(row["col"], Decimal(row["amount"]), row["comment"], row["id"]) for row in rows]
+        try:
+            with track("journal_flush"):
+                saved = await self._writer(week, entries, tenant)
+        except Exception as e:
+            self.errors += 1
+            logging.warning(f"Journal: week {week} not written ({len(rows)} поз.), retry later: {e}")
+            failed = await asyncio.to_thread(self.journal.record_failure, ids, str(e), self.max_attempts)
+            if failed:
+                self.failed += len(failed)
+                logging.error(f"Journal: week {week}, {len(failed)} поз. не записаны после {self.max_attempts} попыток")
+                await self._notify(
+                    [row for row in rows if row["id"] in failed],
+                    f"❌ Не удалось записать в таблицу (неделя {week}):\n",
+                )
+            return False
+
+        if saved is None:
+            await asyncio.to_thread(self.journal.mark, ids, "not_found")
+            self.not_found += len(ids)
+            await self._notify_not_found(week, rows)
+            return True
+
+        await asyncio.to_thread(self.journal.mark, ids, "applied")
+        self.applied += len(ids)
+        now = time.time()
+        for row in rows:
+            JOURNAL_LAG.observe(now - row["created"])
+        return True
+
+    async def _notify_not_found(self, week: str, rows):
+        logging.warning(f"Journal: week {week} not found, {len(rows)} поз. не записаны")
+        await self._notify(rows, f"❌ Неделя {week} не найдена в таблице, не записал:\n")
+
+    async def _notify(self, rows, header: str):
+        """Сообщает водителям про их позиции, которые не попали в таблицу."""
+        if not self.notify:
+            return
+        by_chat = {}
+        for row in rows:
+            if row["chat_id"] is not None:
+                by_chat.setdefault(row["chat_id"], []).append(f"• ${row['amount']} ({row['comment']})")
+        for chat_id, lines in by_chat.items():
+            try:
+                await self.notify(chat_id, header + "\n".join(lines))
+            except Exception as e:
+                logging.warning(f"Journal: notify {chat_id} failed: {e}")
+
+    async def drain(self, timeout: float):
+        """
+        Перед остановкой процесса: дописать журнал, но не дольше timeout.
+        Что не успели — остается в журнале и запишется после рестарта.
+        """
+        if self._task:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        try:
+            await asyncio.wait_for(self.flush_once(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except Exception as e:
+            logging.warning(f"Journal drain failed: {e}")
+        left = (await asyncio.to_thread(self.journal.stats))["pending"]
+        if left:
+            logging.warning(f"Journal: {left} поз. остались в журнале до следующего запуска")
+
+    def stats(self) -> dict:
+        return {
+            **self.journal.stats(),
+            "applied": self.applied,
+            "not_found": self.not_found,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
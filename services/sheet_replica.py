@@ -0,0 +1,249 @@
+import logging
+import re
+import threading
+import time
+from array import array
+from contextlib import nullcontext
+from datetime import date, timedelta
+
+from services.calendar_service import get_current_date_us, get_week_range, week_key
+
+_WEEK_START_RE = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4})")
+
+def _to_number(value) -> float:
+    if isinstance(value, bool):
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(",", "").replace("$", "")) if value not in (None, "") else 0.0
+    except ValueError:
+        return 0.0
+
+def _week_start(text: str):
+    m = _WEEK_START_RE.search(text)
+    if not m:
+        return None
+    try:
+        return date(int(m.group(3)), int(m.group(1)), int(m.group(2)))
+    except ValueError:
+        return None
+
+class SheetReplica:
+    """
+    Локальная копия листа недель для отчетов: колонка недель + суммы по колонкам категорий.
+    Суммы лежат в массивах array('d') по колонке, индекс = строка листа - 1.
+    - Полная загрузка одним batch_get — при первом обращении и раз в full_ttl.
+    - Между ними, если ревизия таблицы изменилась, перечитываются только "горячие" строки:
+      последние hot_weeks недель и хвост листа, куда вписывают новые недели.
+      Вместе с ревизией сверяется число строк листа (с сервера): изменилось — полная загрузка
+      (номера строк сдвинулись).
+    - Записи бота применяются на месте (apply_write), без чтения.
+
+    call(op) — контекст-менеджер учета вызова Sheets API (метрики).
+    """
+
+    def __init__(self, date_column: str, categories: dict, hot_weeks: int, check_ttl: float, full_ttl: float,
+                 call=None):
+        self.date_column = date_column
+        self.categories = categories              # категория -> буква колонки
+        self.last_column = max(categories.values())
+        self.hot_weeks = hot_weeks
+        self.check_ttl = check_ttl
+        self.full_ttl = full_ttl
+        self._call = call or (lambda op: nullcontext())
+        self._lock = threading.Lock()
+
+        self.weeks = []                           # текст колонки недель по строкам
+        self.week_starts = []                     # понедельник недели (date) или None
+        self.values = {letter: array("d") for letter in sorted(set(categories.values()))}
+        self.rows = {}                            # ключ недели -> строка (первая, как в индексе недель)
+        self.sheet_key = None
+        self.revision = None
+        self.loaded_at = 0.0
+        self.checked_at = 0.0
+
+        # --- Метрики ---
+        self.full_loads = 0
+        self.partial_loads = 0
+        self.rows_read = 0
+
+    # --- Загрузка ---
+
+    def _range(self, first_row: int, last_row: int) -> str:
+        return f"{self.date_column}{first_row}:{self.last_column}{last_row}"
+
+    def _store_row(self, row: int, cells: list):
+        """row — номер строки листа; cells — значения от колонки недель до последней категории."""
+        while len(self.weeks) < row:
+            self.weeks.append("")
+            self.week_starts.append(None)
+            for column in self.values.values():
+                column.append(0.0)
+        text = str(cells[0]).strip() if cells else ""
+        self.weeks[row - 1] = text
+        self.week_starts[row - 1] = _week_start(text)
+        first = ord(self.date_column)
+        for letter, column in self.values.items():
+            i = ord(letter) - first
+            column[row - 1] = _to_number(cells[i]) if i < len(cells) else 0.0
+
+    def _rebuild_rows(self):
+        rows = {}
+        for i, text in enumerate(self.weeks):
+            key = week_key(text)
+            if key is not None and key not in rows:
+                rows[key] = i + 1
+        self.rows = rows
+
+    def _read(self, ws, ranges, op: str) -> list:
+        with self._call(op):
+            return ws.batch_get(ranges, value_render_option="UNFORMATTED_VALUE")
+
+    def _row_count(self, ws) -> int:
+        """Число строк листа с сервера: ws.row_count у закэшированного листа не обновляется."""
+        with self._call("row_count"):
+            meta = ws.spreadsheet.fetch_sheet_metadata(params={
+                "fields": "sheets.properties(sheetId,gridProperties.rowCount)",
+            })
+        for sheet in meta.get("sheets", []):
+            props = sheet.get("properties", {})
+            if props.get("sheetId") == ws.id:
+                return props["gridProperties"]["rowCount"]
+        raise ValueError(f"Sheet {ws.id} not found in spreadsheet metadata")
+
+    def _load_full(self, ws, row_count: int = None):
+        row_count = row_count or self._row_count(ws)
+        (data,) = self._read(ws, [self._range(1, row_count)], "replica_full")
+        self.weeks, self.week_starts = [], []
+        self.values = {letter: array("d") for letter in self.values}
+        for i, cells in enumerate(data):
+            self._store_row(i + 1, cells)
+        # Хвост пустых строк тоже держим: новые недели обычно дописывают туда
+        if len(self.weeks) < row_count:
+            self._store_row(row_count, [])
+        self._rebuild_rows()
+        self.full_loads += 1
+        self.rows_read += len(data)
+        self.loaded_at = time.monotonic()
+
+    def _hot_rows(self) -> list:
+        """Строки последних hot_weeks недель и хвост листа, куда вписывают новые недели."""
+        today = get_current_date_us()
+        rows = set()
+        for i in range(self.hot_weeks):
+            row = self.rows.get(week_key(get_week_range(today - timedelta(days=7 * i))))
+            if row:
+                rows.add(row)
+        # Пустые строки batch_get не возвращает — хвост до конца листа почти бесплатен
+        last_filled = max((i + 1 for i, text in enumerate(self.weeks) if text), default=1)
+        rows.update(range(max(1, last_filled - self.hot_weeks + 1), len(self.weeks) + 1))
+        return sorted(rows)
+
+    def _load_partial(self, ws):
+        rows = self._hot_rows()
+        # Соседние строки — одним диапазоном
+        spans = []
+        for row in rows:
+            if spans and spans[-1][1] == row - 1:
+                spans[-1][1] = row
+            else:
+                spans.append([row, row])
+        if spans:
+            data = self._read(ws, [self._range(a, b) for a, b in spans], "replica_rows")
+            for (first, last), block in zip(spans, data):
+                for offset in range(last - first + 1):
+                    self._store_row(first + offset, block[offset] if offset < len(block) else [])
+                self.rows_read += last - first + 1
+            self._rebuild_rows()
+        self.partial_loads += 1
+
+    def sync(self, ws):
+        """Приводит копию в актуальное состояние (блокирующий, вызывать из пула Sheets)."""
+        with self._lock:
+            now = time.monotonic()
+            sheet_key = (ws.spreadsheet.id, ws.id)
+            if sheet_key != self.sheet_key or now - self.loaded_at > self.full_ttl:
+                revision = self._revision(ws)
+                self._load_full(ws)
+                self.sheet_key, self.revision, self.checked_at = sheet_key, revision, now
+                return
+            if now - self.checked_at < self.check_ttl:
+                return
+            revision = self._revision(ws)
+            if revision is None or revision != self.revision:
+                # Строки вставили/удалили — номера строк сдвинулись, частичное чтение не годится
+                row_count = self._row_count(ws)
+                if row_count != len(self.weeks):
+                    self._load_full(ws, row_count)
+                else:
+                    self._load_partial(ws)
+            self.revision, self.checked_at = revision, now
+
+    def _revision(self, ws):
+        try:
+            with self._call("revision"):
+                return ws.spreadsheet.get_lastUpdateTime()
+        except Exception as e:
+            logging.warning(f"Replica: revision unavailable: {e}")
+            return None
+
+    def apply_write(self, ws, row: int, results: dict):
+        """Итог записи бота ({колонка: (старое, новое)}) — сразу в копию."""
+        with self._lock:
+            if self.sheet_key != (ws.spreadsheet.id, ws.id) or row > len(self.weeks):
+                return
+            for letter, (_, new) in results.items():
+                if letter in self.values:
+                    self.values[letter][row - 1] = float(new)
+
+    # --- Запросы (только память) ---
+
+    def _row_totals(self, row: int) -> dict:
+        return {category: self.values[letter][row - 1] for category, letter in self.categories.items()}
+
+    def week_totals(self, d: date):
+        """(диапазон недели, {категория: сумма}) для недели с датой d; None — недели нет в таблице."""
+        week = get_week_range(d)
+        with self._lock:
+            row = self.rows.get(week_key(week))
+            return (week, self._row_totals(row)) if row else None
+
+    def period_totals(self, start: date, end: date):
+        """
+        Суммы по неделям, чей четверг попадает в [start, end] (неделя относится к месяцу
+        своего четверга, как в ISO). Возвращает ({категория: сумма}, число недель).
+        """
+        totals = dict.fromkeys(self.categories, 0.0)
+        weeks = 0
+        with self._lock:
+            for row in self.rows.values():
+                monday = self.week_starts[row - 1]
+                if monday is None or not start <= monday + timedelta(days=3) <= end:
+                    continue
+                weeks += 1
+                for category, letter in self.categories.items():
+                    totals[category] += self.values[letter][row - 1]
+        return totals, weeks
+
+    def category_history(self, category: str, weeks: int, until: date = None) -> list:
+        """[(неделя, сумма)] по категории за последние weeks недель до недели until включительно."""
+        letter = self.categories[category]
+        until = until or get_current_date_us()
+        result = []
+        with self._lock:
+            for i in reversed(range(weeks)):
+                week = get_week_range(until - timedelta(days=7 * i))
+                row = self.rows.get(week_key(week))
+                if row:
+                    result.append((week, self.values[letter][row - 1]))
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "rows": len(self.weeks),
+            "weeks": len(self.rows),
+            "full_loads": self.full_loads,
+            "partial_loads": self.partial_loads,
+            "rows_read": self.rows_read,
+        }
@@ -1,33 +1,411 @@
 import json
-import gspread
-from google.oauth2.service_account import Credentials
-from config import SHEET_ID, TAB_NAME, GOOGLE_SA_JSON, DATE_COLUMN
-from services.calendar_service import normalize_week_string
-
-def get_worksheet():
-    scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-    creds_dict = json.loads(GOOGLE_SA_JSON)
-    creds = Credentials.from_service_account_info(creds_dict, scopes=scopes)
-    client = gspread.authorize(creds)
-    return client.open_by_key(SHEET_ID).worksheet(TAB_NAME)
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from config import (
+    get_google_sa_json, DATE_COLUMN,
+    SHEETS_TOKEN_REFRESH_MARGIN, SHEETS_HTTP_POOL_SIZE, WEEK_INDEX_TTL,
+    WRITE_COALESCE_WINDOW, SAVE_JOURNAL_PATH, SAVE_JOURNAL_INTERVAL, SAVE_JOURNAL_BATCH,
+    SAVE_JOURNAL_BACKOFF_MAX, SAVE_JOURNAL_MAX_ATTEMPTS, REPLICA_HOT_WEEKS, REPLICA_CHECK_TTL, REPLICA_FULL_TTL,
+    TENANT_CACHE_SIZE, TENANT_IDLE_TTL,
+)
+from services.calendar_service import week_key
+from services.executor import sheets_pool
+from services.write_queue import RowWriteQueue
+from services.save_journal import SaveJournal, JournalFlusher
+from services.sheet_replica import SheetReplica
+from services.tenants import default_tenant, get_tenant, sheets_budget
+from services.metrics import timed, track, SHEETS_CALLS, register_collector
 
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+
+# Коды, после которых клиент/лист пересобираются с нуля:
+# 401/403 — протух или отозван токен, 404 — таблицу/лист пересоздали.
+_REBUILD_STATUSES = {401, 403, 404}
+
+# gspread и google-auth импортируются при первом обращении к таблице, а не при старте
+# (холодный старт Cloud Run платит за это на первом webhook).
+
+# --- Кэш клиента (один на процесс) и листов автопарков (LRU) ---
+# Раньше на каждое сохранение заново парсили ключ, авторизовались и открывали лист.
+# Креды и HTTP-сессия общие, открытый лист — свой у каждого автопарка; давно не
+# использованные листы закрываются вместе с их индексом недель и копией.
+_lock = threading.Lock()
+_creds = None
+_session = None
+_client = None
+_auth_request = None          # транспорт для обновления токена (своя сессия, не _session)
+_worksheets = OrderedDict()   # id автопарка -> [лист, время последнего обращения]
+_evictions = 0
+
+def _build_client():
+    """Создает креды, общую HTTP-сессию с пулом соединений и клиента gspread."""
+    global _creds, _session, _client
+    import gspread
+    from google.auth.transport.requests import AuthorizedSession
+    from google.oauth2.service_account import Credentials
+    from requests.adapters import HTTPAdapter
+
+    creds_dict = json.loads(get_google_sa_json())
+    creds = Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
+
+    session = AuthorizedSession(creds)
+    adapter = HTTPAdapter(pool_connections=SHEETS_HTTP_POOL_SIZE, pool_maxsize=SHEETS_HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+
+    _creds, _session, _client = creds, session, gspread.Client(auth=creds, session=session)
+    logging.info("Sheets client ready")
+
+def _open_worksheet(client, tenant):
+    with _sheets_call("open"):
+        ws = client.open_by_key(tenant.sheet_id).worksheet(tenant.tab_name)
+    logging.info(f"Sheet opened: {tenant.id} -> {tenant.sheet_id}/{tenant.tab_name}")
+    return ws
+
+def _refresh_token_if_needed():
+    """
+    Обновляет токен заранее, чтобы запрос не упирался в истекший токен.
+    Токен запрашиваем простым Request, не через _session: AuthorizedSession сама обновляет
+    креды на 401, и обновление через нее же дало бы второй запрос токена на те же креды.
+    """
+    global _auth_request
+    from google.auth.transport.requests import Request
+    expiry = _creds.expiry
+    margin = timedelta(seconds=SHEETS_TOKEN_REFRESH_MARGIN)
+    if not _creds.token or expiry is None or expiry - datetime.utcnow() < margin:
+        if _auth_request is None:
+            _auth_request = Request()
+        _creds.refresh(_auth_request)
+
+def _evict_locked(now: float) -> list:
+    """Листы сверх TENANT_CACHE_SIZE и неактивные дольше TENANT_IDLE_TTL. Вызывать под _lock."""
+    global _evictions
+    evicted = []
+    while _worksheets:
+        tenant_id, (ws, last_used) = next(iter(_worksheets.items()))
+        if len(_worksheets) <= TENANT_CACHE_SIZE and now - last_used < TENANT_IDLE_TTL:
+            break
+        _worksheets.popitem(last=False)
+        evicted.append((tenant_id, ws))
+    _evictions += len(evicted)
+    return evicted
+
+def _forget(tenant_id, ws):
+    """Закрытый лист больше не держит память: индекс недель и копия автопарка удаляются."""
+    invalidate_week_index(ws)
+    _replicas.pop(tenant_id, None)
+    logging.info(f"Sheet closed: {tenant_id}")
+
+def prepare_client():
+    """Авторизация в Sheets без открытия листов (прогрев, когда автопарков несколько)."""
+    with _lock:
+        if _client is None:
+            _build_client()
+        _refresh_token_if_needed()
+
+def get_worksheet(tenant=None):
+    """Возвращает закэшированный лист автопарка (открывается при первом обращении)."""
+    tenant = tenant or default_tenant()
+    with _lock:
+        if _client is None:
+            _build_client()
+        _refresh_token_if_needed()
+        client = _client
+        entry = _worksheets.get(tenant.id)
+        if entry is not None:
+            entry[1] = time.monotonic()
+            _worksheets.move_to_end(tenant.id)
+            return entry[0]
+
+    # Открываем без общей блокировки: медленная таблица одного автопарка не держит остальных
+    ws = _open_worksheet(client, tenant)
+    with _lock:
+        entry = _worksheets.get(tenant.id)
+        if entry is not None:
+            # Параллельный вызов успел открыть раньше
+            ws = entry[0]
+        now = time.monotonic()
+        _worksheets[tenant.id] = [ws, now]
+        _worksheets.move_to_end(tenant.id)
+        evicted = _evict_locked(now)
+    for tenant_id, old_ws in evicted:
+        _forget(tenant_id, old_ws)
+    return ws
+
+def reset_worksheet(tenant=None):
+    """
+    Сбрасывает кэш — следующий get_worksheet() соберет клиента заново.
+    С tenant — только лист этого автопарка (таблицу пересоздали), клиент остается.
+    """
+    global _creds, _session, _client
+    with _lock:
+        if tenant is not None:
+            entry = _worksheets.pop(tenant.id, None)
+        else:
+            if _session is not None:
+                _session.close()
+            _creds, _session, _client = None, None, None
+            _worksheets.clear()
+    # Лист могли пересоздать — старые номера строк больше не верны
+    if tenant is None:
+        invalidate_week_index()
+    elif entry is not None:
+        invalidate_week_index(entry[0])
+
+def _needs_rebuild(e: Exception) -> bool:
+    import gspread
+    from google.auth.exceptions import RefreshError, TransportError
+    if isinstance(e, (RefreshError, TransportError, gspread.exceptions.WorksheetNotFound)):
+        return True
+    if isinstance(e, gspread.exceptions.APIError):
+        return e.code in _REBUILD_STATUSES
+    return False
+
+def _is_sheet_error(e: Exception) -> bool:
+    """Ошибка конкретной таблицы (404, лист переименовали), а не авторизации."""
+    import gspread
+    if isinstance(e, gspread.exceptions.WorksheetNotFound):
+        return True
+    return isinstance(e, gspread.exceptions.APIError) and e.code == 404
+
+def run_with_worksheet(action, tenant=None):
+    """
+    Выполняет action(ws) на кэшированном листе автопарка.
+    При ошибке авторизации или 404 пересобирает клиента (или только лист) и пробует еще раз.
+    """
+    tenant = tenant or default_tenant()
+    try:
+        return action(get_worksheet(tenant))
+    except Exception as e:
+        if not _needs_rebuild(e):
+            raise
+        logging.warning(f"Sheets client rebuild after error ({tenant.id}): {e}")
+        reset_worksheet(tenant if _is_sheet_error(e) else None)
+        return action(get_worksheet(tenant))
+
+# --- Индекс недель: ключ недели (int из цифр диапазона) -> номер строки ---
+# Ключ — (id таблицы, id листа). Значение — словарь с индексом и признаками свежести.
+# Общий замок — только на словари; чтение листа идет под замком своего листа,
+# чтобы медленный автопарк не держал поиск недель у остальных.
+_week_index = {}
+_week_index_locks = {}
+_week_index_lock = threading.Lock()
+
+@contextmanager
+def _sheets_call(op: str):
+    """Учет одного HTTP-вызова Sheets/Drive API: счетчик + задержка."""
+    SHEETS_CALLS.inc(op=op)
+    with track(f"sheets_{op}"):
+        yield
+
+def _index_key(ws):
+    return (ws.spreadsheet.id, ws.id)
+
+def _sheet_index_lock(ws):
+    """Замок индекса недель одного листа (создается при первом обращении)."""
+    key = _index_key(ws)
+    with _week_index_lock:
+        lock = _week_index_locks.get(key)
+        if lock is None:
+            lock = _week_index_locks[key] = threading.Lock()
+        return lock
+
+def _build_week_index(ws):
+    """Читает колонку B целиком и строит индекс неделя -> строка."""
+    with _sheets_call("col_values"):
+        date_col_values = ws.col_values(ord(DATE_COLUMN) - 64) # B -> 2
+
+    rows = {}
+    for idx, val in enumerate(date_col_values):
+        key = week_key(val)
+        # Если неделя встречается дважды — берем первую, как и раньше при линейном поиске
+        if key is not None and key not in rows:
+            rows[key] = idx + 1 # Gspread row starts at 1
+
+    try:
+        with _sheets_call("revision"):
+            revision = ws.spreadsheet.get_lastUpdateTime()
+    except Exception as e:
+        logging.warning(f"Week index: revision unavailable: {e}")
+        revision = None
+
+    entry = {
+        "rows": rows,
+        "revision": revision,
+        "checked_at": time.monotonic(),
+    }
+    with _week_index_lock:
+        _week_index[_index_key(ws)] = entry
+    return entry
+
+def _is_index_fresh(ws, entry) -> bool:
+    """
+    В пределах TTL индекс считаем валидным (сдвиг строк ловит проверка недели при записи).
+    По истечении TTL сверяем ревизию таблицы (легкий запрос в Drive) —
+    колонку перечитываем, только если таблицу действительно меняли.
+    ws.row_count не сверяем: у закэшированного листа он не обновляется.
+    """
+    if time.monotonic() - entry["checked_at"] < WEEK_INDEX_TTL:
+        return True
+    if entry["revision"] is None:
+        return False
+    try:
+        with _sheets_call("revision"):
+            revision = ws.spreadsheet.get_lastUpdateTime()
+    except Exception as e:
+        logging.warning(f"Week index: revision check failed: {e}")
+        return False
+    if revision != entry["revision"]:
+        return False
+    entry["checked_at"] = time.monotonic()
+    return True
+
+def invalidate_week_index(ws=None):
+    """Сбрасывает индекс недель (для одного листа или целиком)."""
+    with _week_index_lock:
+        if ws is None:
+            _week_index.clear()
+            _week_index_locks.clear()
+        else:
+            _week_index.pop(_index_key(ws), None)
+            _week_index_locks.pop(_index_key(ws), None)
+
+@timed("find_row_by_week")
 def find_row_by_week(ws, target_week_str: str):
     """Ищет строку, где в колонке B записана нужная неделя."""
-    # Получаем все значения колонки дат
-    # (Оптимизация: можно кэшировать, но для надежности читаем каждый раз)
-    date_col_values = ws.col_values(ord(DATE_COLUMN) - 64) # B -> 2
-    
-    target_norm = normalize_week_string(target_week_str)
-    
-    for idx, val in enumerate(date_col_values):
-        if normalize_week_string(val) == target_norm:
-            return idx + 1 # Gspread row starts at 1
-            
+    target_key = week_key(target_week_str)
+
+    with _sheet_index_lock(ws):
+        with _week_index_lock:
+            entry = _week_index.get(_index_key(ws))
+        if entry is None or not _is_index_fresh(ws, entry):
+            entry = _build_week_index(ws)
+            # Только что перечитали — повторно при промахе не читаем
+            return entry["rows"].get(target_key)
+
+        row = entry["rows"].get(target_key)
+        if row:
+            return row
+
+        # Промах по кэшу: неделю могли добавить руками — перечитываем один раз
+        entry = _build_week_index(ws)
+
     # Если недели нет — создаем новую вверху (после заголовка) или внизу?
     # По ТЗ просто "выбирает неделю". Если её нет — ошибка или создать. 
     # Допустим, мы добавляем новую строку после заголовков (строка 2).
     # Но безопаснее вернуть None и сообщить юзеру.
-    return None
+    return entry["rows"].get(target_key)
+
+class WeekRowMismatch(Exception):
+    """В найденной строке уже другая неделя (строки сдвинули вручную)."""
+
+def _parse_amount(cell: dict) -> float:
+    """Достает число из ячейки ответа Sheets API (effectiveValue/formattedValue)."""
+    number = cell.get("effectiveValue", {}).get("numberValue")
+    if number is not None:
+        return float(number)
+
+    current_val_str = cell.get("formattedValue")
+    try:
+        return float(current_val_str.replace(",", "").replace("$", "")) if current_val_str else 0.0
+    except:
+        return 0.0
+
+def _read_row_cells(ws, row, last_col):
+    """
+    Одним запросом читает значения и заметки строки от колонки дат до last_col.
+    Возвращает {буква колонки: ячейка API}.
+    """
+    range_a1 = f"'{ws.title}'!{DATE_COLUMN}{row}:{last_col}{row}"
+    with _sheets_call("read_row"):
+        meta = ws.spreadsheet.fetch_sheet_metadata(params={
+            "ranges": range_a1,
+            "includeGridData": "true",
+            "fields": "sheets.data.rowData.values(formattedValue,effectiveValue,note)",
+        })
+
+    try:
+        values = meta["sheets"][0]["data"][0]["rowData"][0].get("values", [])
+    except (KeyError, IndexError):
+        values = []
+
+    first = ord(DATE_COLUMN)
+    return {chr(first + i): cell for i, cell in enumerate(values)}
+
+def update_row_with_notes(ws, row, entries, expected_week: str = None):
+    """
+    Пакетная запись позиций в одну строку.
+    entries: список (буква колонки, сумма, комментарий[, id]).
+    1 запрос на чтение (значения + заметки) и 1 на запись вместо 4 на каждую позицию.
+    Позиции в одной колонке суммируются, в заметку идет строка на каждую.
+    Позиция с id пишется в заметку с меткой #id; если метка уже есть — позиция
+    была записана раньше (повтор из журнала) и пропускается.
+    Возвращает {колонка: (старое значение, новое значение)}.
+    """
+    by_col = {}
+    for entry in entries:
+        col_letter, amount, comment = entry[:3]
+        dedup_id = entry[3] if len(entry) > 3 else None
+        by_col.setdefault(col_letter, []).append((amount, comment, dedup_id))
+    if not by_col:
+        return {}
+
+    cells = _read_row_cells(ws, row, max(by_col))
+
+    if expected_week is not None:
+        found = cells.get(DATE_COLUMN, {}).get("formattedValue", "")
+        if week_key(found) != week_key(expected_week):
+            raise WeekRowMismatch(f"Row {row}: expected {expected_week}, found {found!r}")
+
+    requests = []
+    results = {}
+    for col_letter, col_entries in by_col.items():
+        cell = cells.get(col_letter, {})
+        current_val = _parse_amount(cell)
+        current_note = cell.get("note", "")
+
+        # Метка стоит в конце строки заметки; точное совпадение — #tx-1 не должен совпасть с #tx-10
+        col_entries = [
+            e for e in col_entries
+            if not (e[2] and re.search(rf"#{re.escape(e[2])}$", current_note, re.MULTILINE))
+        ]
+        if not col_entries:
+            results[col_letter] = (current_val, current_val)
+            continue
+        new_val = current_val + sum(float(amount) for amount, _, _ in col_entries)
+
+        lines = [
+            f"+ ${amount} ({comment})" + (f" #{dedup_id}" if dedup_id else "")
+            for amount, comment, dedup_id in col_entries
+        ]
+        final_note = "\n".join([current_note] + lines) if current_note else "\n".join(lines)
+
+        col_idx = ord(col_letter) - 65
+        requests.append({
+            "updateCells": {
+                "range": {
+                    "sheetId": ws.id,
+                    "startRowIndex": row - 1, "endRowIndex": row,
+                    "startColumnIndex": col_idx, "endColumnIndex": col_idx + 1,
+                },
+                "rows": [{"values": [{
+                    "userEnteredValue": {"numberValue": new_val},
+                    "note": final_note,
+                }]}],
+                "fields": "userEnteredValue,note",
+            }
+        })
+        results[col_letter] = (current_val, new_val)
+
+    # Значения и заметки — одним batchUpdate (атомарно на стороне Sheets)
+    if requests:
+        with _sheets_call("write_row"):
+            ws.spreadsheet.batch_update({"requests": requests})
+    return results
 
 def update_cell_with_note(ws, row, col_letter, amount, comment):
     """
@@ -35,31 +413,137 @@ def update_cell_with_note(ws, row, col_letter, amount, comment):
     2. Складывает с новым.
     3. Добавляет запись в Note (Заметку).
     """
-    cell_addr = f"{col_letter}{row}"
-    
-    # Получаем текущее значение и заметку
-    # batch_get эффективнее, но для простоты используем простые вызовы
-    cell = ws.acell(cell_addr)
-    current_val_str = cell.value
-    
-    try:
-        current_val = float(current_val_str.replace(",", "").replace("$", "")) if current_val_str else 0.0
-    except:
-        current_val = 0.0
-        
-    new_val = current_val + float(amount)
-    
-    # Работа с заметкой
-    try:
-        current_note = ws.get_note(cell_addr)
-    except:
-        current_note = ""
-        
-    entry = f"+ ${amount} ({comment})"
-    final_note = f"{current_note}\n{entry}" if current_note else entry
-    
-    # Атомарное обновление (насколько возможно в gspread)
-    ws.update(range_name=cell_addr, values=[[new_val]])
-    ws.update_note(cell_addr, final_note)
-    
-    return current_val, new_val
\ No newline at end of file
+    return update_row_with_notes(ws, row, [(col_letter, amount, comment)])[col_letter]
+
+def save_week_items(week_range: str, entries, tenant=None):
+    """
+    Находит строку недели в листе автопарка и пишет все позиции одной пачкой.
+    Возвращает (row, {колонка: (старое, новое)}) или None, если недели нет в таблице.
+    """
+    tenant = tenant or default_tenant()
+
+    def write(ws, row):
+        results = update_row_with_notes(ws, row, entries, expected_week=week_range)
+        # Итоговые значения известны — обновляем локальную копию без чтения
+        replica = _replicas.get(tenant.id)
+        if replica:
+            replica.apply_write(ws, row, results)
+        return row, results
+
+    def action(ws):
+        row = find_row_by_week(ws, week_range)
+        if not row:
+            return None
+        try:
+            return write(ws, row)
+        except WeekRowMismatch as e:
+            # Строки сдвинули — индекс устарел, ищем заново
+            logging.warning(f"Week index stale: {e}")
+            invalidate_week_index(ws)
+            row = find_row_by_week(ws, week_range)
+            if not row:
+                return None
+            return write(ws, row)
+
+    return run_with_worksheet(action, tenant)
+
+# --- Локальные копии листов для отчетов (/week, /month, /summary): своя у каждого автопарка ---
+_replicas = {}   # id автопарка -> SheetReplica (удаляется вместе с листом из кэша)
+
+def _replica_for(tenant):
+    replica = _replicas.get(tenant.id)
+    if replica is None:
+        replica = _replicas.setdefault(tenant.id, SheetReplica(
+            DATE_COLUMN, tenant.categories, REPLICA_HOT_WEEKS, REPLICA_CHECK_TTL, REPLICA_FULL_TTL,
+            call=_sheets_call,
+        ))
+    return replica
+
+def sync_replica(tenant=None):
+    """Актуализирует копию (обычно без запросов: в пределах REPLICA_CHECK_TTL) и возвращает ее."""
+    tenant = tenant or default_tenant()
+    replica = _replica_for(tenant)
+    run_with_worksheet(replica.sync, tenant)
+    return replica
+
+# --- Async-обертки: вызовы gspread блокирующие, гоняем их в пуле потоков ---
+# Каждый вызов идет в счет квоты Sheets своего автопарка (при нескольких автопарках).
+
+async def get_worksheet_async(tenant=None):
+    tenant = tenant or default_tenant()
+    async with sheets_budget.slot(tenant.id):
+        return await sheets_pool.run(get_worksheet, tenant)
+
+async def get_replica_async(tenant=None):
+    tenant = tenant or default_tenant()
+    async with sheets_budget.slot(tenant.id):
+        return await sheets_pool.run(sync_replica, tenant)
+
+async def _write_week(key, entries):
+    tenant, week_range = key
+    async with sheets_budget.slot(tenant.id):
+        return await sheets_pool.run(save_week_items, week_range, entries, tenant)
+
+# Все записи процесса идут через очередь: одна неделя листа = одна строка = один воркер
+row_write_queue = RowWriteQueue(_write_week, WRITE_COALESCE_WINDOW)
+
+async def save_week_items_async(week_range: str, entries, tenant=None):
+    """
+    Ставит позиции в очередь записи строки недели (в листе автопарка tenant).
+    Возвращает (row, {колонка: (старое, итоговое)}) по своим колонкам или None.
+    """
+    # Tenant хэшируется по (id, таблица, лист) — ключ строки, как раньше (SHEET_ID, TAB_NAME, неделя)
+    return await row_write_queue.submit((tenant or default_tenant(), week_range), entries)
+
+async def _write_journal_week(week_range: str, entries, tenant_id=None):
+    """
+    Запись из журнала: автопарк по id из журнала (строки до автопарков — "default").
+    Автопарка больше нет в конфиге — как "недели нет": позиции помечаются, водитель получает сообщение.
+    """
+    tenant = get_tenant(tenant_id or "default")
+    if tenant is None:
+        logging.warning(f"Journal: tenant {tenant_id} is not configured")
+        return None
+    return await save_week_items_async(week_range, entries, tenant)
+
+# Журнал подтвержденных позиций: ответ пользователю — сразу после записи в журнал,
+# в таблицу — фоном через ту же очередь строк (повтор после сбоя не задвоит суммы)
+save_journal = SaveJournal(SAVE_JOURNAL_PATH) if SAVE_JOURNAL_PATH else None
+journal_flusher = JournalFlusher(
+    save_journal, _write_journal_week,
+    SAVE_JOURNAL_INTERVAL, SAVE_JOURNAL_BATCH, SAVE_JOURNAL_BACKOFF_MAX, SAVE_JOURNAL_MAX_ATTEMPTS,
+) if save_journal else None
+
+@register_collector
+def _collect_write_queue_metrics():
+    stats = row_write_queue.stats()
+    yield "finbot_write_queue_pending_rows", stats["pending_rows"], {}
+    yield "finbot_write_queue_submitted_total", stats["submitted"], {}
+    yield "finbot_write_queue_batches_total", stats["batches"], {}
+
+@register_collector
+def _collect_journal_metrics():
+    if not journal_flusher:
+        return
+    stats = journal_flusher.stats()
+    yield "finbot_journal_pending", stats["pending"], {}
+    yield "finbot_journal_oldest_pending_seconds", round(stats["oldest_age"], 3), {}
+    yield "finbot_journal_applied_total", stats["applied"], {}
+    yield "finbot_journal_not_found_total", stats["not_found"], {}
+    yield "finbot_journal_failed_total", stats["failed"], {}
+    yield "finbot_journal_flush_errors_total", stats["errors"], {}
+
+@register_collector
+def _collect_replica_metrics():
+    for tenant_id, replica in list(_replicas.items()):
+        stats = replica.stats()
+        labels = {"tenant": tenant_id}
+        yield "finbot_replica_rows", stats["rows"], labels
+        yield "finbot_replica_loads_total", stats["full_loads"], {**labels, "kind": "full"}
+        yield "finbot_replica_loads_total", stats["partial_loads"], {**labels, "kind": "partial"}
+        yield "finbot_replica_rows_read_total", stats["rows_read"], labels
+
+@register_collector
+def _collect_tenant_sheet_metrics():
+    yield "finbot_tenant_sheets_open", len(_worksheets), {}
+    yield "finbot_tenant_sheets_evicted_total", _evictions, {}
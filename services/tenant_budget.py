@@ -0,0 +1,87 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "semaphore", "in_flight", "throttled", "wait_seconds")
+
+    def __init__(self, tokens: float, concurrency: int):
+        self.tokens = tokens
+        self.updated = time.monotonic()
+        self.semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+        self.in_flight = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+
+class TenantBudget:
+    """
+    Квота на арендатора (автопарк) поверх общих лимитов процесса:
+    - не больше concurrency вызовов одновременно;
+    - не больше per_minute стартов в минуту (token bucket, запас — минутная норма).
+    Ждет только тот, кто превысил свою квоту, — остальные арендаторы идут без очереди.
+    enabled=False (один автопарк на инстанс) — slot() ничего не ограничивает.
+    """
+
+    def __init__(self, name: str, per_minute: int, concurrency: int, enabled: bool = True):
+        self.name = name
+        self.per_minute = per_minute
+        self.concurrency = concurrency
+        self.enabled = enabled and bool(per_minute or concurrency)
+        self._buckets = {}   # id арендатора -> _Bucket
+
+    def _bucket(self, key) -> _Bucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(self.per_minute, self.concurrency)
+        return bucket
+
+    async def _take_token(self, bucket: _Bucket) -> bool:
+        """Берет токен; True — пришлось ждать."""
+        if not self.per_minute:
+            return False
+        rate = self.per_minute / 60
+        now = time.monotonic()
+        bucket.tokens = min(self.per_minute, bucket.tokens + (now - bucket.updated) * rate)
+        bucket.updated = now
+        # Токен резервируем сразу (баланс может уйти в минус) — очередь ждущих честная
+        bucket.tokens -= 1
+        if bucket.tokens >= 0:
+            return False
+        try:
+            await asyncio.sleep(-bucket.tokens / rate)
+        except asyncio.CancelledError:
+            bucket.tokens += 1
+            raise
+        return True
+
+    @asynccontextmanager
+    async def slot(self, key):
+        """async with budget.slot(tenant_id): ... — один вызов в счет квоты арендатора."""
+        if not self.enabled or key is None:
+            yield
+            return
+        bucket = self._bucket(key)
+        started = time.monotonic()
+        waited = False
+        if bucket.semaphore is not None:
+            waited = bucket.semaphore.locked()
+            await bucket.semaphore.acquire()
+        try:
+            waited = await self._take_token(bucket) or waited
+            if waited:
+                bucket.throttled += 1
+                bucket.wait_seconds += time.monotonic() - started
+            bucket.in_flight += 1
+            try:
+                yield
+            finally:
+                bucket.in_flight -= 1
+        finally:
+            if bucket.semaphore is not None:
+                bucket.semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            key: {"in_flight": b.in_flight, "throttled": b.throttled, "wait_seconds": b.wait_seconds}
+            for key, b in list(self._buckets.items())
+        }
@@ -0,0 +1,91 @@
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from config import (
+    SHEET_ID, TAB_NAME, ALLOWED_IDS, CATEGORIES_MAP, TENANTS_PATH, TENANTS_JSON,
+    TENANT_OPENAI_CONCURRENCY, TENANT_OPENAI_PER_MIN, TENANT_SHEETS_CONCURRENCY, TENANT_SHEETS_PER_MIN,
+)
+from services.tenant_budget import TenantBudget
+from services.metrics import register_collector
+
+# ==============================================================================
+# Арендаторы (автопарки): пользователь Telegram -> своя таблица, лист и карта колонок.
+# ==============================================================================
+
+@dataclass(frozen=True)
+class Tenant:
+    id: str
+    sheet_id: str
+    tab_name: str
+    # В хэш/сравнение не входят: ключом очереди записи служит (id, таблица, лист)
+    categories: dict = field(compare=False)
+    users: frozenset = field(default=frozenset(), compare=False)
+
+def _parse_tenants(raw: dict) -> dict:
+    tenants = {}
+    owner = {}
+    for tenant_id, spec in raw.items():
+        if not spec.get("sheet_id"):
+            raise ValueError(f"Tenant {tenant_id}: sheet_id is required")
+        categories = {str(k).lower(): str(v).upper() for k, v in (spec.get("categories") or CATEGORIES_MAP).items()}
+        # Позиции с незнакомой категорией уходят в other — колонка обязательна
+        if "other" not in categories:
+            raise ValueError(f"Tenant {tenant_id}: categories must include 'other'")
+        # Колонки — одна буква A..Z: из них собираются диапазоны A1 и индексы колонок
+        bad = {k: v for k, v in categories.items() if not re.fullmatch(r"[A-Z]", v)}
+        if bad:
+            raise ValueError(f"Tenant {tenant_id}: column must be a single letter A-Z: {bad}")
+        users = frozenset(int(u) for u in spec.get("users", []))
+        for user_id in users:
+            if user_id in owner:
+                raise ValueError(f"User {user_id} is in tenants {owner[user_id]} and {tenant_id}")
+            owner[user_id] = tenant_id
+        tenants[tenant_id] = Tenant(tenant_id, spec["sheet_id"], spec.get("tab") or TAB_NAME, categories, users)
+    return tenants
+
+def load_tenants() -> dict:
+    """{id: Tenant} из TENANTS_PATH / TENANTS_JSON; без них — один автопарк из SHEET_ID/TAB_NAME/ALLOWED_IDS."""
+    if TENANTS_PATH:
+        with open(TENANTS_PATH, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+    elif TENANTS_JSON:
+        raw = json.loads(TENANTS_JSON)
+    else:
+        return {"default": Tenant("default", SHEET_ID, TAB_NAME, CATEGORIES_MAP, frozenset(ALLOWED_IDS))}
+    tenants = _parse_tenants(raw)
+    logging.info(f"Tenants loaded: {len(tenants)}")
+    return tenants
+
+TENANTS = load_tenants()
+_by_user = {user_id: tenant for tenant in TENANTS.values() for user_id in tenant.users}
+
+# Квоты имеют смысл, только когда автопарков несколько
+MULTI_TENANT = len(TENANTS) > 1
+openai_budget = TenantBudget("openai", TENANT_OPENAI_PER_MIN, TENANT_OPENAI_CONCURRENCY, enabled=MULTI_TENANT)
+sheets_budget = TenantBudget("sheets", TENANT_SHEETS_PER_MIN, TENANT_SHEETS_CONCURRENCY, enabled=MULTI_TENANT)
+
+def tenant_for_user(user_id):
+    """Автопарк пользователя или None (доступа нет)."""
+    return _by_user.get(user_id)
+
+def get_tenant(tenant_id):
+    return TENANTS.get(tenant_id)
+
+def default_tenant():
+    """Автопарк для вызовов без пользователя (bulk_import, bench): единственный или "default"."""
+    if len(TENANTS) == 1:
+        return next(iter(TENANTS.values()))
+    tenant = TENANTS.get("default")
+    if tenant is None:
+        raise ValueError("Several tenants configured: tenant must be specified")
+    return tenant
+
+@register_collector
+def _collect_tenant_metrics():
+    for budget in (openai_budget, sheets_budget):
+        for tenant_id, stats in budget.stats().items():
+            labels = {"tenant": tenant_id, "budget": budget.name}
+            yield "finbot_tenant_in_flight", stats["in_flight"], labels
+            yield "finbot_tenant_throttled_total", stats["throttled"], labels
+            yield "finbot_tenant_throttle_seconds_total", round(stats["wait_seconds"], 3), labels
@@ -0,0 +1,68 @@
+import asyncio
+
+class RowWriteQueue:
+    """
+    Очередь записи в строку таблицы (write-behind).
+    - Записи в одну строку идут строго по одной: read-modify-write не перетирает соседей.
+    - Всё, что пришло за окно `window`, склеивается в один пакетный запрос.
+    - Каждый вызывающий получает итоговые значения своих колонок после записи.
+
+    writer: async (key, entries) -> (row, {колонка: (старое, новое)}) или None.
+    """
+
+    def __init__(self, writer, window: float):
+        self._writer = writer
+        self.window = window
+        self._pending = {}   # key -> [(entries, future)]
+        self._workers = {}   # key -> asyncio.Task
+
+        # --- Метрики ---
+        self.submitted = 0
+        self.batches = 0
+
+    async def submit(self, key, entries):
+        """Ставит позиции в очередь строки и ждет результата записи."""
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(key, []).append((entries, fut))
+        self.submitted += 1
+
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._drain(key))
+        return await fut
+
+    async def _drain(self, key):
+        """Один воркер на строку: пока есть очередь — собираем окно и пишем пачкой."""
+        try:
+            while self._pending.get(key):
+                # Даем набежать соседним записям в ту же строку
+                await asyncio.sleep(self.window)
+                batch = self._pending.pop(key)
+                merged = [entry for entries, _ in batch for entry in entries]
+                self.batches += 1
+
+                try:
+                    saved = await self._writer(key, merged)
+                except Exception as e:
+                    for _, fut in batch:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    continue
+
+                for entries, fut in batch:
+                    if fut.done():
+                        continue
+                    if saved is None:
+                        fut.set_result(None)
+                        continue
+                    row, results = saved
+                    cols = {entry[0] for entry in entries}
+                    fut.set_result((row, {col: results[col] for col in cols if col in results}))
+        finally:
+            self._workers.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "pending_rows": len(self._pending),
+            "submitted": self.submitted,
+            "batches": self.batches,
+        }
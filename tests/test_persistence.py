@@ -0,0 +1,101 @@
+import asyncio
+import inspect
+
+import pytest
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, ConversationHandler, MessageHandler, TypeHandler, filters
+
+from bench.fakes import FakeBotRequest
+from bench.scenarios import message_update
+from handlers.common import SharedConversationHandler
+from services.persistence import KVPersistence, MemoryKV, SQLiteKV
+
+WAITING_FOR_DATE = 2
+USER = 4242
+
+def build_app(kv, seen):
+    """Минимальная копия диалога из main.py: вход -> WAITING_FOR_DATE -> END."""
+    async def entry(update, context):
+        seen.append(("entry", update.message.text))
+        context.user_data["pending"] = update.message.text
+        return WAITING_FOR_DATE
+
+    async def date_reply(update, context):
+        seen.append(("date", context.user_data.get("pending"), update.message.text))
+        context.user_data.clear()
+        return SharedConversationHandler.END
+
+    # Интервал сброса — час: все, что видит второй инстанс, записано сразу, а не по таймеру
+    persistence = KVPersistence(kv, ttl=3600, update_interval=3600)
+    app = (
+        ApplicationBuilder().token("1:test").request(FakeBotRequest({}, 0.0))
+        .get_updates_request(FakeBotRequest({})).updater(None).persistence(persistence).build()
+    )
+    conv = SharedConversationHandler(
+        entry_points=[MessageHandler(filters.TEXT, entry)],
+        states={WAITING_FOR_DATE: [MessageHandler(filters.TEXT, date_reply)]},
+        fallbacks=[],
+        name="finbot",
+        persistent=True,
+    )
+    app.add_handler(TypeHandler(Update, conv.refresh), group=-1)
+    app.add_handler(conv)
+    return app
+
+async def send(app, text):
+    await app.process_update(Update.de_json(message_update(USER, text=text), app.bot))
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_kv(request, tmp_path):
+    return lambda: MemoryKV() if request.param == "memory" else SQLiteKV(str(tmp_path / "kv.sqlite"))
+
+def test_conversation_continues_on_another_instance(make_kv):
+    async def scenario():
+        kv = make_kv()
+        seen_a, seen_b = [], []
+        app_a, app_b = build_app(kv, seen_a), build_app(kv, seen_b)
+        async with app_a, app_b:
+            # Оба инстанса стартовали до начала диалога — при старте им читать нечего
+            await send(app_a, "10 fuel")
+            await send(app_b, "10.14")
+            assert seen_b == [("date", "10 fuel", "10.14")]
+
+            # Диалог закончился на B: A не должен считать, что все еще ждет дату
+            await send(app_a, "20 fuel")
+            assert seen_a == [("entry", "10 fuel"), ("entry", "20 fuel")]
+
+    asyncio.run(scenario())
+
+def test_periodic_flush_does_not_resurrect_finished_dialog(make_kv):
+    async def scenario():
+        kv = make_kv()
+        app_a, app_b = build_app(kv, []), build_app(kv, [])
+        async with app_a, app_b:
+            await send(app_a, "10 fuel")
+            await send(app_b, "10.14")
+            # Таймерный сброс A несет его устаревшее WAITING_FOR_DATE и user_data
+            await app_a.update_persistence()
+            assert await kv.keys("conv:") == []
+            assert await kv.keys("user:") == []
+
+    asyncio.run(scenario())
+
+def test_ptb_internals_used_by_shared_handler():
+    """SharedConversationHandler опирается на внутренности PTB — при смене их раскладки падаем здесь."""
+    from telegram.ext._handlers.conversationhandler import PendingState
+
+    async def scenario():
+        app = build_app(MemoryKV(), [])
+        async with app:
+            (conv,) = [h for h in app.handlers[0] if isinstance(h, SharedConversationHandler)]
+            # После initialize() с persistence PTB подменяет словарь на TrackingDict
+            conversations = conv._conversations
+            assert callable(conversations.update_no_track)
+            assert isinstance(conversations.data, dict)
+            assert callable(conv._get_key)
+
+    asyncio.run(scenario())
+    assert inspect.isclass(PendingState)
+    params = list(inspect.signature(ConversationHandler.handle_update).parameters)
+    assert params == ["self", "update", "application", "check_result", "context"]